@@ -29,10 +29,24 @@ export interface ApiFunctionProps {
    */
   code: string;
 
+  /**
+   * Lambda handler (module.function in the source dir)
+   *
+   * @default index.handler
+   */
+  handler?: string;
+
   /**
    * Python layer arn
    */
   pythonLayerArn?: string;
+
+  /**
+   * Lambda timeout
+   *
+   * @default - Lambda default timeout (3 seconds)
+   */
+  timeout?: Duration;
 }
 
 export class ApiFunction extends Construct {
@@ -50,10 +64,11 @@ export class ApiFunction extends Construct {
     }
 
     this.lambda = new Lambda.Function(this, 'lambda', {
-      handler: 'index.handler',
+      handler: props.handler ?? 'index.handler',
       code: Lambda.Code.fromAsset(props.code),
       runtime: Lambda.Runtime.PYTHON_3_9,
       memorySize: 512,
+      timeout: props.timeout,
       description: props.description,
       insightsVersion: Lambda.LambdaInsightsVersion.fromInsightVersionArn(insightsArn),
       logRetention: RetentionDays.ONE_MONTH,
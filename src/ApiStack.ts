@@ -1,11 +1,14 @@
 import {
   aws_apigateway as ApiGateway,
   aws_iam as IAM,
+  aws_s3 as S3,
   aws_ssm as SSM,
   Stack,
   StackProps,
   aws_route53 as route53,
   aws_route53_targets as targets,
+  Duration,
+  Size,
 } from 'aws-cdk-lib';
 import { ApiKeySourceType } from 'aws-cdk-lib/aws-apigateway';
 import { Certificate, CertificateValidation } from 'aws-cdk-lib/aws-certificatemanager';
@@ -13,6 +16,7 @@ import { ITable, Table } from 'aws-cdk-lib/aws-dynamodb';
 import { Role, ServicePrincipal } from 'aws-cdk-lib/aws-iam';
 import { IKey, Key } from 'aws-cdk-lib/aws-kms';
 import { ARecord, AaaaRecord, HostedZone, IHostedZone } from 'aws-cdk-lib/aws-route53';
+import { ISecret, Secret } from 'aws-cdk-lib/aws-secretsmanager';
 import { StringParameter } from 'aws-cdk-lib/aws-ssm';
 import { Construct } from 'constructs';
 import { ApiFunction } from './ApiFunction';
@@ -77,6 +81,8 @@ export class ApiStack extends Stack {
       restApiName: Statics.verwerkingenApiName,
       description: 'Verwerkingen API Gateway (REST)',
       apiKeySourceType: ApiKeySourceType.HEADER,
+      // Compress (gzip/deflate) responses for clients sending Accept-Encoding
+      minCompressionSize: Size.kibibytes(1),
       domainName: {
         certificate: certificate,
         domainName: hostedzone.zoneName,
@@ -109,6 +115,12 @@ export class ApiStack extends Stack {
     // Inzage API
     this.initializeInzageLambdaIntegrations(props, ddbTable, hostedzone);
 
+    // Import the hash key secret (from DatabaseStack), all lambdas hashing objectIds need the key of the v2 scheme
+    const hashKeySecret = Secret.fromSecretCompleteArn(this, 'hash-key-secret', SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_hashKeySecretArn));
+    for (const lambda of [this.verwerkingenGenLambdaFunction, this.verwerkingenRecLambdaFunction, this.inzageLambdaFunction]) {
+      this.configureHashing(lambda, hashKeySecret, props.configuration.hashScheme);
+    }
+
     // Create API Key and add a new usage plan
     this.addUsagePlan();
 
@@ -120,8 +132,8 @@ export class ApiStack extends Stack {
     const verboseLogs = props.configuration.enableVerboseAndSensitiveLogging;
     const keyArn = SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_dynamodbKmsKeyArn);
     const key = Key.fromKeyArn(this, 'key', keyArn);
-    this.verwerkingenGenLambdaFunction = this.setupVerwerkingenGenLambdaFunction(ddbTable, key, hostedzone.zoneName, verboseLogs);
-    this.verwerkingenRecLambdaFunction = this.setupVerwerkingenRecLambdaFunction(ddbTable, key, verboseLogs);
+    this.verwerkingenGenLambdaFunction = this.setupVerwerkingenGenLambdaFunction(ddbTable, key, hostedzone.zoneName, verboseLogs, props.configuration.enableQueueBackup);
+    this.verwerkingenRecLambdaFunction = this.setupVerwerkingenRecLambdaFunction(ddbTable, key, verboseLogs, props.configuration.enableActiviteitIndex);
 
     // Create Integrations
     this.verwerkingenGenLambdaIntegration = new ApiGateway.LambdaIntegration(this.verwerkingenGenLambdaFunction.lambda);
@@ -133,6 +145,10 @@ export class ApiStack extends Stack {
     verwerkingsactiesRoute.addMethod('PATCH', this.verwerkingenGenLambdaIntegration, { apiKeyRequired: true });
     verwerkingsactiesRoute.addMethod('GET', this.verwerkingenRecLambdaIntegration, { apiKeyRequired: true });
 
+    // Route: /verwerkingsacties/batch (bulk ingest)
+    const batchRoute = verwerkingsactiesRoute.addResource('batch');
+    batchRoute.addMethod('POST', this.verwerkingenGenLambdaIntegration, { apiKeyRequired: true });
+
     // Route: /verwerkingsacties/{actieId}
     const actieIdRoute = verwerkingsactiesRoute.addResource('{actieId}');
     actieIdRoute.addMethod('PUT', this.verwerkingenGenLambdaIntegration, { apiKeyRequired: true });
@@ -147,7 +163,7 @@ export class ApiStack extends Stack {
     const verboseLogs = props.configuration.enableVerboseAndSensitiveLogging;
     const keyArn = SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_dynamodbKmsKeyArn);
     const key = Key.fromKeyArn(this, 'key-inzage-lambda-integration', keyArn);
-    this.inzageLambdaFunction = this.setupInzageLambdaFunction(ddbTable, key, verboseLogs);
+    this.inzageLambdaFunction = this.setupInzageLambdaFunction(ddbTable, key, verboseLogs, props.configuration.enableActiviteitIndex);
 
     // Create Integrations
     this.inzageLambdaIntegration = new ApiGateway.LambdaIntegration(this.inzageLambdaFunction.lambda);
@@ -156,22 +172,56 @@ export class ApiStack extends Stack {
     const verwerkteObjectenRoute = this.verwerkingenAPI.root.addResource('verwerkte-objecten');
     verwerkteObjectenRoute.addMethod('GET', this.inzageLambdaIntegration, { apiKeyRequired: true });
 
+    // Route: /verwerkte-objecten/export (NDJSON export of all verwerkingsacties to S3)
+    const exportRoute = verwerkteObjectenRoute.addResource('export');
+    exportRoute.addMethod('GET', this.inzageLambdaIntegration, { apiKeyRequired: true });
+
     // Route: /verwerkte-objecten/{verwerktObjectId}
-    const verwerktObjectIdRoute = verwerkteObjectenRoute.addResource('{verwerkteObjectId}');
+    const verwerktObjectIdRoute = verwerkteObjectenRoute.addResource('{verwerktObjectId}');
     verwerktObjectIdRoute.addMethod('GET', this.inzageLambdaIntegration, { apiKeyRequired: true });
   }
 
-  private setupInzageLambdaFunction(table: ITable, key: IKey, enableVerboseAndSensitiveLogging?: boolean): ApiFunction {
+  private setupInzageLambdaFunction(table: ITable, key: IKey, enableVerboseAndSensitiveLogging?: boolean, enableActiviteitIndex?: boolean): ApiFunction {
+    // Exports are only kept for a day, the download url expires after an hour
+    const exportBucket = new S3.Bucket(this, 'inzage-export-bucket', {
+      blockPublicAccess: S3.BlockPublicAccess.BLOCK_ALL,
+      enforceSSL: true,
+      encryption: S3.BucketEncryption.S3_MANAGED,
+      lifecycleRules: [
+        {
+          enabled: true,
+          expiration: Duration.days(1),
+          abortIncompleteMultipartUploadAfter: Duration.days(1),
+        },
+      ],
+    });
+
     const lambda = new ApiFunction(this, 'inzage-api-function', {
       description: 'Responsible for providing verwerkingen on inzage request',
       code: 'src/api/InzageLambdaFunction',
       pythonLayerArn: StringParameter.valueForStringParameter(this, Statics.ssmName_pythonLambdaLayerArn),
+      timeout: Duration.seconds(29), // API Gateway integration timeout, required for exports
       environment: {
         DYNAMO_TABLE_NAME: table.tableName,
+        EXPORT_BUCKET_NAME: exportBucket.bucketName,
         ENABLE_VERBOSE_AND_SENSITIVE_LOGGING: enableVerboseAndSensitiveLogging ? 'true' : 'false',
+        ENABLE_ACTIVITEIT_INDEX: enableActiviteitIndex ? 'true' : 'false',
       },
     });
     key.grantEncryptDecrypt(lambda.lambda);
+    exportBucket.grantReadWrite(lambda.lambda);
+
+    // Presigned urls expire with the credentials they are signed with, the Lambda session credentials
+    // may expire before the url should. The url is signed with credentials of this role, which are valid
+    // for the full hour (the maximum session duration of a role assumed by a role).
+    const exportSigningRole = new Role(this, 'inzage-export-signing-role', {
+      assumedBy: lambda.lambda.grantPrincipal,
+      maxSessionDuration: Duration.hours(1),
+    });
+    exportBucket.grantRead(exportSigningRole, 'exports/*');
+    exportSigningRole.grantAssumeRole(lambda.lambda.grantPrincipal);
+    lambda.lambda.addEnvironment('EXPORT_SIGNING_ROLE_ARN', exportSigningRole.roleArn);
+
     lambda.lambda.grantInvoke(new IAM.ServicePrincipal('apigateway.amazonaws.com'));
     lambda.lambda.addToRolePolicy(new IAM.PolicyStatement({
       effect: IAM.Effect.ALLOW,
@@ -184,7 +234,10 @@ export class ApiStack extends Stack {
       resources: [
         table.tableArn,
         table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortId, // Is equal to old verwerkingen static, no change required
+        table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortIdTijdstip,
+        table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortIdActiviteit, // Only queried if enableActiviteitIndex
         table.tableArn + '/index/' + Statics.verwerkingenTableIndex_verwerkingId, // Is equal to old verwerkingen static, no change required
+        table.tableArn + '/index/' + Statics.verwerkingenTableIndex_verwerktObjectId,
       ],
     }));
     new StringParameter(this, 'inzage-log-group-arn-ssm', {
@@ -198,13 +251,15 @@ export class ApiStack extends Stack {
    * Lambda for forwaring to queue and sync responses
    * @param table
    * @param enableVerboseAndSensitiveLogging
+   * @param enableQueueBackup
    */
-  private setupVerwerkingenGenLambdaFunction(table: ITable, key: IKey, apiBaseUrl: string, enableVerboseAndSensitiveLogging?: boolean) {
+  private setupVerwerkingenGenLambdaFunction(table: ITable, key: IKey, apiBaseUrl: string, enableVerboseAndSensitiveLogging?: boolean, enableQueueBackup?: boolean) {
     // Create Lambda & Grant API Gateway permission to invoke the Lambda function.
 
     const lambda = new ApiFunction(this, 'generation', {
       description: 'Receive calls and place on queue',
       code: 'src/api/GenLambdaFunction',
+      timeout: Duration.seconds(29), // API Gateway integration timeout, required for batch requests
       pythonLayerArn: StringParameter.valueForStringParameter(this, Statics.ssmName_pythonLambdaLayerArn),
       environment: {
         S3_BACKUP_BUCKET_NAME: SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_verwerkingenS3BackupBucketName),
@@ -212,6 +267,7 @@ export class ApiStack extends Stack {
         DYNAMO_TABLE_NAME: table.tableName,
         ENABLE_VERBOSE_AND_SENSITIVE_LOGGING: enableVerboseAndSensitiveLogging ? 'true' : 'false',
         API_BASE_URL: apiBaseUrl,
+        BACKUP_MODE: enableQueueBackup ? 'queue' : 'sync',
       },
     });
     key.grantEncryptDecrypt(lambda.lambda);
@@ -221,7 +277,9 @@ export class ApiStack extends Stack {
       actions: [
         's3:PutObject',
         'sqs:SendMessage',
+        'sqs:GetQueueAttributes', // queue health check of the synchronous write mode
         'dynamodb:Query',
+        'dynamodb:BatchWriteItem', // synchronous write mode
       ],
       resources: [
         SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_verwerkingenS3BackupBucketArn),
@@ -243,16 +301,19 @@ export class ApiStack extends Stack {
    * Lambda for processing get and delete verwerkingsacties
    * @param table
    * @param enableVerboseAndSensitiveLogging
+   * @param enableActiviteitIndex
    * @returns
    */
-  private setupVerwerkingenRecLambdaFunction(table: ITable, key: IKey, enableVerboseAndSensitiveLogging?: boolean) {
+  private setupVerwerkingenRecLambdaFunction(table: ITable, key: IKey, enableVerboseAndSensitiveLogging?: boolean, enableActiviteitIndex?: boolean) {
     const lambda = new ApiFunction(this, 'receiver', {
       description: 'Responsible for get and delete verwerkingsacties',
       code: 'src/api/RecLambdaFunction',
       pythonLayerArn: StringParameter.valueForStringParameter(this, Statics.ssmName_pythonLambdaLayerArn),
+      timeout: Duration.seconds(29), // API Gateway integration timeout, pages of filtered queries can take several queries
       environment: {
         DYNAMO_TABLE_NAME: table.tableName,
         ENABLE_VERBOSE_AND_SENSITIVE_LOGGING: enableVerboseAndSensitiveLogging ? 'true' : 'false',
+        ENABLE_ACTIVITEIT_INDEX: enableActiviteitIndex ? 'true' : 'false',
       },
     });
     key.grantEncryptDecrypt(lambda.lambda);
@@ -261,11 +322,13 @@ export class ApiStack extends Stack {
       effect: IAM.Effect.ALLOW,
       actions: [
         'dynamodb:Query',
-        'dynamodb:PutItem',
+        'dynamodb:UpdateItem',
       ],
       resources: [
         table.tableArn,
         table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortId,
+        table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortIdTijdstip,
+        table.tableArn + '/index/' + Statics.verwerkingenTableIndex_objectTypeSoortIdActiviteit, // Only queried if enableActiviteitIndex
         table.tableArn + '/index/' + Statics.verwerkingenTableIndex_verwerkingId,
       ],
     }));
@@ -302,6 +365,18 @@ export class ApiStack extends Stack {
     });
   }
 
+  /**
+   * Configure the objectId hash scheme of a lambda and grant it read access to the hash key secret
+   * @param lambda
+   * @param hashKeySecret
+   * @param hashScheme
+   */
+  private configureHashing(lambda: ApiFunction, hashKeySecret: ISecret, hashScheme?: string) {
+    lambda.lambda.addEnvironment('HASH_SCHEME', hashScheme ?? 'v1');
+    lambda.lambda.addEnvironment('HASH_KEY_SECRET_ARN', hashKeySecret.secretArn);
+    hashKeySecret.grantRead(lambda.lambda);
+  }
+
   private hostedzone() {
     return HostedZone.fromHostedZoneAttributes(this, 'hostedzone', {
       hostedZoneId: StringParameter.valueForStringParameter(this, Statics.ssmName_projectHostedZoneId),
@@ -34,6 +34,7 @@ export class ApiStage extends Stage {
     });
     const databaseStack = new DatabaseStack(this, 'database-stack', {
       env: props.configuration.targetEnvironment,
+      configuration: props.configuration,
     });
     const apiStack = new ApiStack(this, 'api-stack', {
       env: props.configuration.targetEnvironment,
@@ -50,6 +51,7 @@ export class ApiStage extends Stage {
 
     apiStack.addDependency(lambdaLayerStack);
     queueStack.addDependency(lambdaLayerStack);
+    queueStack.addDependency(databaseStack, 'Relies on the S3 backup bucket parameters');
 
     dashboardStack.addDependency(apiStack, 'Relies on the log groups of the lambdas in this stack');
     dashboardStack.addDependency(dashboardStack, 'Relies on the queues in this stack');
@@ -40,6 +40,30 @@ export interface Configuration {
    */
   enableVerboseAndSensitiveLogging?: boolean;
 
+  /**
+   * Send the raw event backups along with the queue messages, the processing
+   * lambda archives them in S3 (gzipped JSONL per minute) instead of the Gen
+   * lambda storing every event in S3 before queueing.
+   * @default false
+   */
+  enableQueueBackup?: boolean;
+
+  /**
+   * Create (and query) the objectTypeSoortId-verwerkingsactiviteitId-index.
+   * DynamoDB creates only one GSI per table update: enable this in a deployment
+   * after the objectTypeSoortId-tijdstip-index has been created (and is ACTIVE).
+   * @default false
+   */
+  enableActiviteitIndex?: boolean;
+
+  /**
+   * Scheme used to hash objectIds: 'v1' (sha3-256) or 'v2' (HMAC-sha256 with the
+   * key in the hash key secret of the DatabaseStack). Migrate the existing items
+   * with tools/migrate_hash_prefix.py when switching schemes.
+   * @default 'v1'
+   */
+  hashScheme?: 'v1' | 'v2';
+
 }
 
 export const configurations: { [key: string]: Configuration } = {
@@ -27,10 +27,16 @@ export class DashboardStack extends Stack {
       genLambdaLogGroupArn,
       recLambdaLogGroupArn,
     ]);
+    const handlers = ['gen', 'rec', 'inzage', 'proc', 'redrive'];
+    const latency = this.latencyWidget(handlers);
+    const capacity = this.dynamoDbWidget(handlers);
+    const ingestLag = this.ingestLagWidget();
 
     // Create the layout (each array is one row)
     const layout = [
       [timeLine],
+      [latency, capacity],
+      [ingestLag],
       [table],
     ];
 
@@ -72,6 +78,68 @@ export class DashboardStack extends Stack {
     });
   }
 
+  /**
+   * Metric emitted by the lambdas (Shared.metrics) for a single handler
+   */
+  handlerMetric(metricName: string, handler: string, statistic: string, label: string) {
+    return new cloudwatch.Metric({
+      namespace: Statics.metricsNamespace,
+      metricName,
+      dimensionsMap: { Handler: handler },
+      statistic,
+      label,
+    });
+  }
+
+  latencyWidget(handlers: string[]) {
+    return new cloudwatch.GraphWidget({
+      title: 'Handler latency (p50 / p99)',
+      height: 6,
+      width: 12,
+      view: cloudwatch.GraphWidgetView.TIME_SERIES,
+      left: handlers.flatMap(handler => [
+        this.handlerMetric('Latency', handler, cloudwatch.Stats.p(50), handler + ' p50'),
+        this.handlerMetric('Latency', handler, cloudwatch.Stats.p(99), handler + ' p99'),
+      ]),
+    });
+  }
+
+  dynamoDbWidget(handlers: string[]) {
+    return new cloudwatch.GraphWidget({
+      title: 'DynamoDB consumed capacity and items returned vs. scanned',
+      height: 6,
+      width: 12,
+      view: cloudwatch.GraphWidgetView.TIME_SERIES,
+      left: handlers.flatMap(handler => [
+        this.handlerMetric('ConsumedReadCapacity', handler, cloudwatch.Stats.SUM, handler + ' RCU'),
+        this.handlerMetric('ConsumedWriteCapacity', handler, cloudwatch.Stats.SUM, handler + ' WCU'),
+      ]),
+      right: ['rec', 'inzage'].flatMap(handler => [
+        this.handlerMetric('ItemsReturned', handler, cloudwatch.Stats.SUM, handler + ' items returned'),
+        this.handlerMetric('ItemsScanned', handler, cloudwatch.Stats.SUM, handler + ' items scanned'),
+      ]),
+    });
+  }
+
+  /**
+   * Spans of the traced requests (Shared.tracing), from API request until readable in DynamoDB
+   */
+  ingestLagWidget() {
+    return new cloudwatch.GraphWidget({
+      title: 'Ingest lag: API request until written (p50 / p99)',
+      height: 6,
+      width: 24,
+      view: cloudwatch.GraphWidgetView.TIME_SERIES,
+      left: [
+        this.handlerMetric('IngestLag', 'proc', cloudwatch.Stats.p(50), 'ingest lag p50'),
+        this.handlerMetric('IngestLag', 'proc', cloudwatch.Stats.p(99), 'ingest lag p99'),
+        this.handlerMetric('Enqueue', 'proc', cloudwatch.Stats.p(99), 'enqueue p99'),
+        this.handlerMetric('QueueDwell', 'proc', cloudwatch.Stats.p(99), 'queue dwell p99'),
+        this.handlerMetric('Write', 'proc', cloudwatch.Stats.p(99), 'write p99'),
+      ],
+    });
+  }
+
   /**
    * Create the CloudWatch Dashboard
    * @param layout 2d array (each array specifies a row of widges)
@@ -1,4 +1,5 @@
 import {
+  Duration,
   RemovalPolicy,
   Stack,
   aws_dynamodb as DynamoDB,
@@ -8,10 +9,14 @@ import {
   StackProps,
 } from 'aws-cdk-lib';
 import { Key } from 'aws-cdk-lib/aws-kms';
+import { Secret } from 'aws-cdk-lib/aws-secretsmanager';
 import { StringParameter } from 'aws-cdk-lib/aws-ssm';
 import { Construct } from 'constructs';
+import { Configurable } from './Configuration';
 import { Statics } from './statics';
 
+export interface DatabaseStackProps extends StackProps, Configurable {}
+
 /**
  * Database Stack responsible for creating the DynamoDB Table and all other related services.
  */
@@ -32,7 +37,12 @@ export class DatabaseStack extends Stack {
    */
   verwerkingenReadOnlyRole: IAM.Role;
 
-  constructor(scope: Construct, id: string, props: StackProps) {
+  /**
+   * Key of the v2 objectId hash scheme (HMAC), read by the lambdas when hashing objectIds.
+   */
+  hashKeySecret: Secret;
+
+  constructor(scope: Construct, id: string, props: DatabaseStackProps) {
     super(scope, id, props);
 
     // Create the DynamoDB verwerkingen table.
@@ -60,6 +70,27 @@ export class DatabaseStack extends Stack {
       partitionKey: { name: 'objectTypeSoortId', type: DynamoDB.AttributeType.STRING },
     });
 
+    // Date range queries use tijdstip in the key condition instead of a filter.
+    // Every item has a tijdstip, DynamoDB backfills the index for existing items on creation.
+    this.verwerkingenTable.addGlobalSecondaryIndex({
+      indexName: Statics.verwerkingenTableIndex_objectTypeSoortIdTijdstip,
+      partitionKey: { name: 'objectTypeSoortId', type: DynamoDB.AttributeType.STRING },
+      sortKey: { name: 'tijdstip', type: DynamoDB.AttributeType.STRING },
+    });
+
+    // Sparse composite index for filtering on verwerkingsactiviteitId (objectTypeSoortId#verwerkingsactiviteitId).
+    // The key attribute is written by the processing lambda, use tools/backfill_index_attributes.py for existing items.
+    // DynamoDB creates only one GSI per table update, so this index is created in a separate deployment
+    // (enableActiviteitIndex) after the tijdstip index. Filtering on vertrouwelijkheid does not get an index:
+    // every item has one, such an index would not be sparse and only adds write cost.
+    if (props.configuration.enableActiviteitIndex) {
+      this.verwerkingenTable.addGlobalSecondaryIndex({
+        indexName: Statics.verwerkingenTableIndex_objectTypeSoortIdActiviteit,
+        partitionKey: { name: 'objectTypeSoortIdActiviteit', type: DynamoDB.AttributeType.STRING },
+        sortKey: { name: 'tijdstip', type: DynamoDB.AttributeType.STRING },
+      });
+    }
+
     this.verwerkingenTable.addGlobalSecondaryIndex({
       indexName: Statics.verwerkingenTableIndex_verwerkingId,
       partitionKey: { name: 'verwerkingId', type: DynamoDB.AttributeType.STRING },
@@ -76,13 +107,15 @@ export class DatabaseStack extends Stack {
       enforceSSL: true,
       eventBridgeEnabled: true,
       encryption: S3.BucketEncryption.S3_MANAGED,
-      // Disabled as we want to be resiliant may something change even after 2 years
-      // lifecycleRules: [
-      //   {
-      //     enabled: true,
-      //     expiration: Duration.days(90),
-      //   },
-      // ],
+      // Backups do not expire: until tools/backup_archive.py has archived them, they are the only copy.
+      // Archived backups are removed by backup_archive.py write --delete-source (after the manifest is saved),
+      // the archive itself does not expire either, so verwerkingen can be restored even after years.
+      lifecycleRules: [
+        {
+          enabled: true,
+          abortIncompleteMultipartUploadAfter: Duration.days(1),
+        },
+      ],
     });
 
     // Add S3 Backup Bucket ARN to parameter store.
@@ -97,6 +130,22 @@ export class DatabaseStack extends Stack {
       parameterName: Statics.ssmName_verwerkingenS3BackupBucketName,
     });
 
+    // Key of the v2 objectId hash scheme. Retained: without it the hashed objectIds in the table can not be found.
+    this.hashKeySecret = new Secret(this, 'hash-key-secret', {
+      description: 'Key of the v2 objectId hash scheme (HMAC) of verwerkingenlogging',
+      generateSecretString: {
+        passwordLength: 64,
+        excludePunctuation: true,
+      },
+      removalPolicy: RemovalPolicy.RETAIN,
+    });
+
+    // Add hash key secret ARN to parameter store.
+    new SSM.StringParameter(this, 'ssm_hash-key-secret-arn', {
+      stringValue: this.hashKeySecret.secretArn,
+      parameterName: Statics.ssmName_hashKeySecretArn,
+    });
+
     // Assumable read only role to view DynamoDB table, S3 Bucket and CloudWatch logging.
     this.verwerkingenReadOnlyRole = new IAM.Role(this, 'verwerkingen-read-only-role', {
       roleName: 'verwerkingen-full-read',
@@ -1,5 +1,7 @@
 import { Duration, Stack, StackProps } from 'aws-cdk-lib';
 import * as cloudwatch from 'aws-cdk-lib/aws-cloudwatch';
+import * as Events from 'aws-cdk-lib/aws-events';
+import * as EventTargets from 'aws-cdk-lib/aws-events-targets';
 import * as IAM from 'aws-cdk-lib/aws-iam';
 import { Key } from 'aws-cdk-lib/aws-kms';
 import * as LambdaEventSources from 'aws-cdk-lib/aws-lambda-event-sources';
@@ -12,6 +14,12 @@ import { Statics } from './statics';
 
 export interface QueueStackProps extends StackProps, Configurable { }
 
+/**
+ * Timeout of the processing lambda. Long running PATCHes are checkpointed when
+ * a quarter of it remains, the queue visibility timeout is six times as long (as advised for SQS event sources).
+ */
+const processingTimeout = Duration.minutes(2);
+
 export class QueueStack extends Stack {
 
   /**
@@ -30,6 +38,11 @@ export class QueueStack extends Stack {
    */
   declare verwerkingenProcLambdaFunction: ApiFunction;
 
+  /**
+   * Lambda function reprocessing the messages on the Dead Letter Queue (DLQ)
+   */
+  declare verwerkingenRedriveLambdaFunction: ApiFunction;
+
   /**
     * Sqs event source attachable to a Lambda fucntion
     */
@@ -47,6 +60,7 @@ export class QueueStack extends Stack {
     // Message Queue (SQS)
     this.verwerkingenMessageQueue = new Sqs.Queue(this, 'verwerkingen-message-queue', {
       encryption: Sqs.QueueEncryption.KMS_MANAGED,
+      visibilityTimeout: Duration.seconds(processingTimeout.toSeconds() * 6),
       deadLetterQueue: {
         queue: this.verwerkingenMessageDeadLetterQueue,
         maxReceiveCount: 3, //TODO: change amount?
@@ -74,10 +88,22 @@ export class QueueStack extends Stack {
       this.verwerkingenMessageQueue.queueUrl,
       props.configuration.enableVerboseAndSensitiveLogging,
     );
+    // Allow the processing lambda to continue long running PATCHes in a new message
+    this.verwerkingenMessageQueue.grantSendMessages(this.verwerkingenProcLambdaFunction.lambda);
 
     // Add Lambda trigger to the Sqs Queue.
-    this.verwerkingenLambdaSqsEventSource = new LambdaEventSources.SqsEventSource(this.verwerkingenMessageQueue);
+    // Only the messages reported as failed (batchItemFailures) are returned to the queue.
+    this.verwerkingenLambdaSqsEventSource = new LambdaEventSources.SqsEventSource(this.verwerkingenMessageQueue, {
+      reportBatchItemFailures: true,
+    });
     this.verwerkingenProcLambdaFunction.lambda.addEventSource(this.verwerkingenLambdaSqsEventSource);
+
+    this.verwerkingenRedriveLambdaFunction = this.setupRedriveLambda(
+      this.verwerkingenMessageQueue.queueUrl,
+      this.verwerkingenMessageDeadLetterQueue.queueUrl,
+    );
+    this.verwerkingenMessageDeadLetterQueue.grantConsumeMessages(this.verwerkingenRedriveLambdaFunction.lambda);
+    this.verwerkingenMessageQueue.grantSendMessages(this.verwerkingenRedriveLambdaFunction.lambda);
   }
 
   /**
@@ -88,26 +114,70 @@ export class QueueStack extends Stack {
    */
   private setupProcessingLambda(queueUrl: string, enableVerboseAndSensitiveLogging?: boolean) {
 
-    const keyArn = SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_dynamodbKmsKeyArn);
-    const key = Key.fromKeyArn(this, 'key', keyArn);
-
     const lambda = new ApiFunction(this, 'processing', {
       description: 'Responsible for processing messages from the verwerkingenlog queue',
       code: 'src/api/ProcLambdaFunction',
       pythonLayerArn: SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_pythonLambdaLayerArn),
+      timeout: processingTimeout,
       environment: {
         DYNAMO_TABLE_NAME: Statics.verwerkingenTableName,
         SQS_URL: queueUrl, //this.verwerkingenMessageQueue.queueUrl,
+        S3_BACKUP_BUCKET_NAME: SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_verwerkingenS3BackupBucketName),
         ENABLE_VERBOSE_AND_SENSITIVE_LOGGING: enableVerboseAndSensitiveLogging ? 'true' : 'false',
+        PATCH_CHECKPOINT_MARGIN_MS: String(processingTimeout.toMilliseconds() / 4),
       },
     });
 
+    this.grantProcessing(lambda);
+    return lambda;
+  }
+
+  /**
+   * Creates the lambda reprocessing the messages on the DLQ (every 15 minutes).
+   * Messages that can not be processed are quarantined in the S3 backup bucket.
+   * @param queueUrl
+   * @param dlqUrl
+   * @returns
+   */
+  private setupRedriveLambda(queueUrl: string, dlqUrl: string) {
+    const lambda = new ApiFunction(this, 'redrive', {
+      description: 'Responsible for reprocessing messages from the verwerkingenlog dead letter queue',
+      code: 'src/api/ProcLambdaFunction',
+      handler: 'redrive.handler',
+      pythonLayerArn: SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_pythonLambdaLayerArn),
+      timeout: Duration.minutes(5),
+      environment: {
+        DYNAMO_TABLE_NAME: Statics.verwerkingenTableName,
+        SQS_URL: queueUrl,
+        DLQ_URL: dlqUrl,
+        S3_BACKUP_BUCKET_NAME: SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_verwerkingenS3BackupBucketName),
+      },
+    });
+
+    this.grantProcessing(lambda);
+
+    new Events.Rule(this, 'redrive-schedule', {
+      description: 'Reprocess the messages on the verwerkingenlog dead letter queue',
+      schedule: Events.Schedule.rate(Duration.minutes(15)),
+      targets: [new EventTargets.LambdaFunction(lambda.lambda)],
+    });
+    return lambda;
+  }
+
+  /**
+   * Allow a lambda to process messages (process_message): write to the table and the S3 backup bucket
+   * @param lambda
+   */
+  private grantProcessing(lambda: ApiFunction) {
+    const keyArn = SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_dynamodbKmsKeyArn);
+    const key = Key.fromKeyArn(this, `${lambda.node.id}-key`, keyArn);
     key.grantEncryptDecrypt(lambda.lambda);
 
     lambda.lambda.addToRolePolicy(new IAM.PolicyStatement({
       effect: IAM.Effect.ALLOW,
       actions: [
         'dynamodb:PutItem',
+        'dynamodb:BatchWriteItem',
         'dynamodb:DeleteItem',
         'dynamodb:GetItem',
         'dynamodb:Scan',
@@ -120,7 +190,17 @@ export class QueueStack extends Stack {
         `arn:aws:dynamodb:${this.region}:${this.account}:table/` + Statics.verwerkingenTableName + '/index/' + Statics.verwerkingenTableIndex_verwerkingId,
       ],
     }));
-    return lambda;
+
+    // Archive the raw event backups sent along with the messages (and quarantine messages)
+    lambda.lambda.addToRolePolicy(new IAM.PolicyStatement({
+      effect: IAM.Effect.ALLOW,
+      actions: [
+        's3:PutObject',
+      ],
+      resources: [
+        SSM.StringParameter.valueForStringParameter(this, Statics.ssmName_verwerkingenS3BackupBucketArn) + '/*',
+      ],
+    }));
   }
 
 
@@ -1,15 +1,59 @@
 import json
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from Shared.helpers import hashHelper, logApiCall
+from Shared.cache import LruTtlCache
+from Shared.hashing import canonicalHashes, hashCache, legacyObjectId
+from Shared.helpers import logApiCall, logCacheStats
+from Shared.indexes import addIndexAttributes
+from Shared.metrics import addMetric
 from Shared.responses import badRequestResponse, successResponse
+from Shared.tracing import startTrace, traceAttributes
 
 
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
 
 apiBaseUrl = os.getenv('API_BASE_URL', 'api.vwlog-prod.csp-nijmegen.nl')
 
+# Maximum number of concurrent objectTypeSoortId-index lookups per request
+lookupMaxWorkers = int(os.getenv('LOOKUP_MAX_WORKERS', '8'))
+
+# objectTypeSoortId -> verwerktObjectId mappings never change once assigned,
+# keep them across warm invocations to skip the objectTypeSoortId-index lookup.
+verwerktObjectIdCache = LruTtlCache(
+    maxSize=int(os.getenv('VERWERKT_OBJECT_ID_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('VERWERKT_OBJECT_ID_CACHE_TTL', '3600')))
+
+# Until all items are migrated to the prefixed hash format (tools/migrate_hash_prefix.py), objects that are
+# not found are looked up by their legacy objectTypeSoortId as well, so they keep their verwerktObjectId
+legacyHashLookup = os.getenv('LEGACY_HASH_LOOKUP', 'true') == 'true'
+
+# SQS limits for a single SendMessageBatch call
+sqsBatchMaxEntries = 10
+sqsBatchMaxBytes = 256 * 1024
+sqsBatchMaxAttempts = int(os.getenv('SQS_BATCH_MAX_ATTEMPTS', '3'))
+sqsAttributesMaxBytes = 1024 # reserved for the other message attributes (path)
+# Rounds in which the queue messages of a verwerkingsactie that were not accepted are sent again
+sqsEnqueueMaxRounds = int(os.getenv('SQS_ENQUEUE_MAX_ROUNDS', '3'))
+
+# Backup mode of the raw events: 'sync' stores them in S3 before queueing, 'queue' sends them
+# along with the queue message and the processing lambda archives them in batches
+backupMode = os.getenv('BACKUP_MODE', 'sync')
+
+# Maximum number of verwerkingsacties in a single POST /verwerkingsacties/batch request
+batchMaxItems = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+
+# Synchronous write mode (X-Write-Mode: sync) of POST /verwerkingsacties: maximum number of items
+# (one BatchWriteItem call, 0 disables the mode) and request body size, the maximum number of messages
+# on the queue for it to be considered healthy, and the time (s) the queue health is cached
+syncWriteMaxItems = int(os.getenv('SYNC_WRITE_MAX_ITEMS', '25'))
+syncWriteMaxBytes = int(os.getenv('SYNC_WRITE_MAX_BYTES', str(64 * 1024)))
+syncWriteMaxQueueDepth = int(os.getenv('SYNC_WRITE_MAX_QUEUE_DEPTH', '100'))
+queueHealthTtl = int(os.getenv('QUEUE_HEALTH_TTL', '10'))
+queueHealth = { 'checked': 0.0, 'healthy': False }
+
 
 # Parse the event object and extract relevant information.
 # After extraction, validates the object for valid parameter combinations.
@@ -86,54 +130,162 @@ def store_item_in_s3(actieId, event, bucket):
         Body=data,
     )
 
-# Generate id(s) for verwerkteObjecten
-def verwerktObjectId_check(item, table):
-    # cache the created verwerktObjectId for other verwerkteObjecten
-    cachedIds = {}
+# Backup the raw event. In 'queue' backup mode the backup is sent along with msg (as message attribute),
+# unless it does not fit in a single queue message, then it is stored in S3 directly.
+# Returns the message attributes to add to the queue message of msg.
+def backup_attributes(key, event, bucket, msg):
+    if (backupMode == 'queue' and msg != None):
+        backup = json.dumps({ 'key': key, 'event': event })
+        entry = { 'MessageBody': json.dumps(msg), 'MessageAttributes': { 'backup': queue_attribute(backup) } }
+        if (queue_entry_size(entry) + sqsAttributesMaxBytes <= sqsBatchMaxBytes):
+            return { 'backup': queue_attribute(backup) }
+
+    store_item_in_s3(key, event, bucket)
+    return {}
+
+# Whether the client asked for the synchronous write mode (X-Write-Mode: sync header)
+def sync_write_requested(event):
+    headers = { name.lower(): value for name, value in (event.get('headers') or {}).items() }
+    return (headers.get('x-write-mode') or '').strip().lower() == 'sync'
+
+# The queue is healthy if the processing lambda keeps up: only a few messages are waiting or in flight.
+# A queued (older) message for the same verwerkingsactie would otherwise be written after a direct write.
+# The result is cached for queueHealthTtl seconds, so not every request pays for GetQueueAttributes.
+def queue_is_healthy(queue):
+    if (time.monotonic() - queueHealth['checked'] < queueHealthTtl):
+        return queueHealth['healthy']
+    try:
+        attributes = queue.meta.client.get_queue_attributes(
+            QueueUrl=queue.url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'],
+        ).get('Attributes')
+        depth = int(attributes.get('ApproximateNumberOfMessages', 0)) + int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
+        healthy = depth <= syncWriteMaxQueueDepth
+    except Exception as e:
+        print('Queue health check failed: ' + str(e))
+        healthy = False
+    queueHealth.update({ 'checked': time.monotonic(), 'healthy': healthy })
+    return healthy
+
+# Small requests of clients asking for it are written directly, when the queue is healthy
+def use_sync_write(event, msgs, queue):
+    if (syncWriteMaxItems <= 0 or not sync_write_requested(event)):
+        return False
+    if (len(msgs) > syncWriteMaxItems or len(event.get('body') or '') > syncWriteMaxBytes):
+        return False
+    return queue_is_healthy(queue)
+
+# Write the POST messages directly to DynamoDB with a single BatchWriteItem call, as the processing lambda
+# does (same item shape, including the index attributes). Nothing is retried here: the indexes (in msgs)
+# of the messages that were not written (throttled, unprocessed) are returned, to be sent to the queue.
+def write_directly(msgs, table):
+    try:
+        response = table.meta.client.batch_write_item(RequestItems={
+            table.name: [{ 'PutRequest': { 'Item': addIndexAttributes(dict(msg)) } } for msg in msgs]
+        })
+    except Exception as e:
+        print('Synchronous write failed, falling back to the queue: ' + str(e))
+        return list(range(len(msgs)))
+
+    unprocessed = response.get('UnprocessedItems', {}).get(table.name, [])
+    unprocessedKeys = { (request.get('PutRequest').get('Item').get('actieId'), request.get('PutRequest').get('Item').get('compositeSortKey')) for request in unprocessed }
+    return [index for index, msg in enumerate(msgs) if (msg.get('actieId'), msg.get('compositeSortKey')) in unprocessedKeys]
+
+# Build the key used in the objectTypeSoortId-index for a verwerktObject
+def object_type_soort_id(verwerktObject):
+    return verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + verwerktObject.get('objectId')
+
+# Build the key an object was stored with before the prefixed hash format, None if it has none
+def legacy_object_type_soort_id(verwerktObject):
+    objectId = legacyObjectId(verwerktObject.get('objectId'))
+    if (objectId == None):
+        return None
+    return verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + objectId
+
+# Query the objectTypeSoortId-index for an existing verwerktObjectId.
+# If it is not found and a legacyKey (unmigrated objectTypeSoortId) is given, that key is looked up instead.
+# Returns None if the objectTypeSoortId is not yet known in the DB.
+def lookup_verwerktObjectId(objectTypeSoortId, table, legacyKey=None):
+    response = table.query(
+            IndexName='objectTypeSoortId-index',
+            KeyConditionExpression=Key('objectTypeSoortId').eq(objectTypeSoortId),
+            Limit=1
+        )
+
+    if (response.get('Count') == 0):
+        if (legacyKey != None and legacyKey != objectTypeSoortId):
+            return lookup_verwerktObjectId(legacyKey, table)
+        return None
+
+    # All items of an object share its verwerktObjectId, so a single item is enough (Limit=1).
+    # search for a verwerkt object (from the query response) where objectTypeSoortId equals that of the main (posted) object
+    # this Id is used to update the item, since we don't want to recreate an Id of an already existing (in DB) verwerkt object.
+    verwerktObjectId = None
+    for verwerktObject in response.get('Items')[0].get('verwerkteObjecten'):
+        if (object_type_soort_id(verwerktObject) == objectTypeSoortId):
+            verwerktObjectId = verwerktObject.get('verwerktObjectId')
+    return verwerktObjectId
+
+# Resolve the verwerktObjectIds for a list of objectTypeSoortIds.
+# Duplicate keys and keys already present in resolvedIds or the cache are only looked up once,
+# the remaining lookups run concurrently on a bounded thread pool.
+# legacyKeys maps objectTypeSoortIds to their legacy key (see objectId_check).
+def lookup_verwerktObjectIds(objectTypeSoortIds, table, resolvedIds=None, legacyKeys=None):
+    resolvedIds = {} if resolvedIds is None else resolvedIds
+    legacyKeys = {} if legacyKeys is None else legacyKeys
+    pending = []
+    for key in dict.fromkeys(objectTypeSoortIds):
+        if key in resolvedIds:
+            continue
+        cachedId = verwerktObjectIdCache.get(key)
+        if cachedId != None:
+            resolvedIds[key] = cachedId
+        else:
+            pending.append(key)
+
+    if (len(pending) == 1):
+        results = [lookup_verwerktObjectId(pending[0], table, legacyKeys.get(pending[0]))]
+    elif (len(pending) > 1):
+        with ThreadPoolExecutor(max_workers=min(lookupMaxWorkers, len(pending))) as executor:
+            results = list(executor.map(lambda key: lookup_verwerktObjectId(key, table, legacyKeys.get(key)), pending))
+    else:
+        results = []
+
+    for key, verwerktObjectId in zip(pending, results):
+        resolvedIds[key] = verwerktObjectId
+        if verwerktObjectId != None:
+            verwerktObjectIdCache.put(key, verwerktObjectId)
+
+    return resolvedIds
 
+# Generate id(s) for verwerkteObjecten
+# resolvedIds can be shared between verwerkingsacties (batch), so objects get the same id within the batch
+def verwerktObjectId_check(item, table, resolvedIds=None, legacyKeys=None):
     # Add verwerktObjectId to each verwerktObject before proceeding
     verwerkteObjecten = item.get('verwerkteObjecten')
-    if (len(verwerkteObjecten) >= 1):
-        for object in verwerkteObjecten:
-            # check if objectTypeSoortId already exists in DB
-            objectTypeSoortId = object.get('objectType') + object.get('soortObjectId') + object.get('objectId')
-            response = table.query(
-                    IndexName='objectTypeSoortId-index',
-                    KeyConditionExpression=Key('objectTypeSoortId').eq(objectTypeSoortId)
-                )
-
-            if ( objectTypeSoortId in cachedIds.keys() ): # validate if verwerkteObjectId was already created before in this function run
-                verwerktObjectId = cachedIds[objectTypeSoortId].get('verwerktObjectId')
-                object.update({ "verwerktObjectId": verwerktObjectId })
-            elif (response.get('Count') == 0):
-                verwerktObjectId = str(uuid.uuid4()) # uuid4 to make uuid random within a for loop (uuid1 gives same uuid to each object)
-                object.update({ "verwerktObjectId": verwerktObjectId })
-                cachedIds.update({ objectTypeSoortId:
-                    { "verwerktObjectId": verwerktObjectId }
-                    })
-            else:
-                # search for a verwerkt object (from the query response) where objectTypeSoortId equals that of the main (posted) object
-                # this Id is used to update the item, since we don't want to recreate an Id of an already existing (in DB) verwerkt object.
-                for verwerktObject in response.get('Items')[0].get('verwerkteObjecten'):
-                    if (verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + verwerktObject.get('objectId') == objectTypeSoortId):
-                        verwerktObjectId = verwerktObject.get('verwerktObjectId')
-                
-                # update verwertkObjectId
-                object.update({ "verwerktObjectId": verwerktObjectId })
+    resolvedIds = lookup_verwerktObjectIds([object_type_soort_id(object) for object in verwerkteObjecten], table, resolvedIds, legacyKeys)
+
+    for object in verwerkteObjecten:
+        objectTypeSoortId = object_type_soort_id(object)
+        if (resolvedIds.get(objectTypeSoortId) == None):
+            # not yet in DB (or created before in this function run): create a new id and reuse it for other verwerkteObjecten
+            resolvedIds[objectTypeSoortId] = str(uuid.uuid4()) # uuid4 to make uuid random within a for loop (uuid1 gives same uuid to each object)
+            verwerktObjectIdCache.put(objectTypeSoortId, resolvedIds[objectTypeSoortId])
+
+        object.update({ "verwerktObjectId": resolvedIds[objectTypeSoortId] })
 
     return item
 
-# Hash the obejctId
-def objectId_check(item):
-    for object in item.get('verwerkteObjecten'):
-        # hash objectId, create composite sort key and update item
-        objectId = object.get('objectId')
-        if (len(objectId) < 10): # dirty fix to check whether BSN has already been hashed
-            hashedObjectId = hashHelper(objectId)
-        else:
-            hashedObjectId = objectId
-        
+# Hash the obejctIds (all objectIds of the item in one call).
+# Already hashed objectIds are recognized by their scheme prefix and not hashed again.
+# If legacyKeys (dict) is given, the legacy key of each object is recorded in it by its new objectTypeSoortId.
+def objectId_check(item, legacyKeys=None):
+    verwerkteObjecten = item.get('verwerkteObjecten')
+    for object, hashedObjectId in zip(verwerkteObjecten, canonicalHashes([object.get('objectId') for object in verwerkteObjecten])):
+        legacyKey = legacy_object_type_soort_id(object) if legacyHashLookup and legacyKeys != None else None
         object.update({'objectId': hashedObjectId})
+        if (legacyKey != None):
+            legacyKeys.setdefault(object_type_soort_id(object), legacyKey)
 
     return item
 
@@ -141,7 +293,7 @@ def objectId_check(item):
 def generate_post_message(verwerktObject, requestJson, actieId, url, tijdstipRegistratie):
     item = filled_item(requestJson, actieId, url, tijdstipRegistratie)
     
-    objectTypeSoortId = verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + verwerktObject.get('objectId')
+    objectTypeSoortId = object_type_soort_id(verwerktObject)
     compositeSortKey = objectTypeSoortId + '#' + tijdstipRegistratie   # Composite SK - combining the unique soortObjecTypeId and the tijdstipRegistratie timestamp
     item.update({ 'compositeSortKey': compositeSortKey, 'objectTypeSoortId': objectTypeSoortId })
 
@@ -154,7 +306,7 @@ def generate_patch_message(event):
     msg = {
         "verwerkingId": event.get('queryStringParameters').get('verwerkingId'),
         "bewaartermijn": requestJson.get('bewaartermijn'), # Optional
-        "vertouwelijkheid": requestJson.get('vertrouwelijkheid') # Optional
+        "vertrouwelijkheid": requestJson.get('vertrouwelijkheid') # Optional
     }
 
     return json.dumps(msg)
@@ -164,7 +316,7 @@ def generate_put_message(event, verwerktObject, item, tijdstipRegistratie):
     # TODO: validate if actieId in pathParameters equals the actieId in the request body (requestJson)
     # If they are not equal it's an invalid / forbidden request. 
     actieId = event.get('pathParameters').get('actieId')
-    objectTypeSoortId = verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + verwerktObject.get('objectId')
+    objectTypeSoortId = object_type_soort_id(verwerktObject)
     compositeSortKey = objectTypeSoortId + '#' + tijdstipRegistratie   # Composite SK - combining the unique soortObjecTypeId and the tijdstipRegistratie timestamp
     item.update({'actieId': actieId, 'compositeSortKey': compositeSortKey, 'objectTypeSoortId': objectTypeSoortId })
 
@@ -173,14 +325,237 @@ def generate_put_message(event, verwerktObject, item, tijdstipRegistratie):
 # Send message to queue
 def send_to_queue(msg, queue, path):
     body = json.dumps(msg)
-    queue.send_message(MessageBody=body, MessageAttributes={
-        'path': {
-            'DataType': 'String',
-            'StringValue': path
-        }})
+    queue.send_message(MessageBody=body, MessageAttributes=queue_message_attributes(path))
+
+def queue_message_attributes(path, attributes=None):
+    return {
+        'path': queue_attribute(path),
+        **traceAttributes(), # correlationId and requestTime
+        **(attributes or {}),
+    }
+
+def queue_attribute(value):
+    return {
+        'DataType': 'String',
+        'StringValue': value
+    }
+
+# Size of a batch entry as counted by SQS (body and message attributes)
+def queue_entry_size(entry):
+    size = len(entry.get('MessageBody').encode('UTF-8'))
+    for name, attribute in entry.get('MessageAttributes').items():
+        size += len(name.encode('UTF-8')) + len(attribute.get('DataType').encode('UTF-8')) + len(attribute.get('StringValue').encode('UTF-8'))
+    return size
+
+# Group entries in batches of at most 10 entries and 256 KB payload
+def queue_batches(entries):
+    batch = []
+    batchSize = 0
+    for entry in entries:
+        entrySize = queue_entry_size(entry)
+        if (len(batch) == sqsBatchMaxEntries or (len(batch) > 0 and batchSize + entrySize > sqsBatchMaxBytes)):
+            yield batch
+            batch = []
+            batchSize = 0
+        batch.append(entry)
+        batchSize += entrySize
+    if (len(batch) > 0):
+        yield batch
+
+# Send a single batch, retrying only the entries that failed on the SQS side.
+# A failed call (e.g. throttling or a timeout) fails all entries of the batch, not the other batches.
+# Returns the entries that could not be enqueued.
+def send_batch(batch, queue):
+    failed = []
+    for attempt in range(sqsBatchMaxAttempts):
+        if (attempt > 0):
+            time.sleep(0.05 * (2 ** attempt))
+        try:
+            failed = queue.send_messages(Entries=batch).get('Failed', [])
+        except Exception as e:
+            print('Failed to send batch: ' + str(e))
+            failed = [{ 'Id': entry.get('Id'), 'SenderFault': False, 'Message': str(e) } for entry in batch]
+        if (len(failed) == 0):
+            return []
+
+        # Sender faults (e.g. invalid or too large messages) will not succeed on retry
+        if any(failure.get('SenderFault') for failure in failed):
+            break
+        failedIds = {failure.get('Id') for failure in failed}
+        batch = [entry for entry in batch if entry.get('Id') in failedIds]
+
+    return failed
+
+# Send messages to queue using SendMessageBatch (up to 10 messages per call).
+# attributes contains additional message attributes by index (in msgs).
+# Returns the indexes (in msgs) of the messages that could not be enqueued.
+def enqueue_messages(msgs, queue, path, attributes=None):
+    entries = [{
+        'Id': str(index),
+        'MessageBody': json.dumps(msg),
+        'MessageAttributes': queue_message_attributes(path, (attributes or {}).get(index)),
+    } for index, msg in enumerate(msgs)]
+
+    failed = []
+    for batch in queue_batches(entries):
+        failed.extend(send_batch(batch, queue))
+
+    return [int(failure.get('Id')) for failure in failed]
+
+# Group the (POST or PUT) messages of a single verwerkingsactie into list messages that fit in a queue message.
+# This is a single message, unless the verwerkingsactie has very many verwerkteObjecten.
+def verwerkingsactie_messages(msgs):
+    messages = []
+    message = []
+    messageSize = 2 # []
+    for msg in msgs:
+        size = len(json.dumps(msg).encode('UTF-8')) + 2 # separator
+        if (len(message) > 0 and messageSize + size + sqsAttributesMaxBytes > sqsBatchMaxBytes):
+            messages.append(message)
+            message = []
+            messageSize = 2
+        message.append(msg)
+        messageSize += size
+    if (len(message) > 0):
+        messages.append(message)
+    return messages
+
+# Send the messages of a single verwerkingsactie to the queue as list messages (see verwerkingsactie_messages),
+# the processing lambda writes the items of a list message together. A verwerkingsactie in a single message
+# is enqueued all-or-nothing. Of one that is split over several messages, the messages that were not accepted
+# are sent again (sqsEnqueueMaxRounds), so it is not left partly enqueued after a failed call.
+# backup is the (key, event) of the raw event backup, sent along with the first message or stored in S3.
+# Raises an exception if nothing was enqueued: the client can retry without duplicating part of the verwerkingsactie.
+# Returns the number of messages that could not be enqueued after others were (0 if all were enqueued).
+def enqueue_verwerkingsactie(msgs, queue, path, bucket, backup=None):
+    messages = verwerkingsactie_messages(msgs)
+    attributes = {}
+    if (backup != None):
+        attributes[0] = backup_attributes(backup[0], backup[1], bucket, messages[0])
+
+    pending = list(range(len(messages)))
+    for attempt in range(sqsEnqueueMaxRounds):
+        if (attempt > 0):
+            time.sleep(0.1 * (2 ** attempt))
+        failed = enqueue_messages([messages[index] for index in pending], queue, path,
+            { position: attributes.get(index) for position, index in enumerate(pending) if index in attributes })
+        pending = [pending[position] for position in failed]
+        # Nothing enqueued at all: fail the request instead of retrying
+        if (len(pending) == 0 or len(pending) == len(messages)):
+            break
+
+    if (len(pending) == len(messages)):
+        raise Exception("Failed to enqueue the " + str(len(messages)) + " messages of the verwerkingsactie")
+    if (0 in pending and 'backup' in attributes.get(0, {})):
+        # The backup was sent along with a message that is not enqueued, the enqueued messages still need it
+        store_item_in_s3(backup[0], backup[1], bucket)
+    if (len(pending) > 0):
+        print('Failed to enqueue ' + str(len(pending)) + ' of ' + str(len(messages)) + ' messages of the verwerkingsactie, restore it from its backup')
+        addMetric('PartialEnqueues', 1)
+    return len(pending)
+
+# Create the POST messages (one for each verwerktObject) of a single verwerkingsactie
+def generate_post_messages(requestJson, actieId, tijdstipRegistratie, table, resolvedIds=None):
+    # Create DB url using generated actieId
+    url = "https://" + apiBaseUrl + "/verwerkingsacties/" + actieId
+
+    legacyKeys = {}
+    item = objectId_check(requestJson, legacyKeys)
+    item = verwerktObjectId_check(item, table, resolvedIds, legacyKeys)
+
+    # Generate post message (including verwerktObjectId) for each verwerktObject
+    return [generate_post_message(verwerktObject, item, actieId, url, tijdstipRegistratie) for verwerktObject in item.get('verwerkteObjecten')]
+
+# verwerktObjectId of each objectTypeSoortId of the messages. Stored in the backup, so a restore gives
+# objects the verwerktObjectIds they had, also when they are no longer in the table.
+def backup_verwerktObjectIds(msgs):
+    return { object_type_soort_id(verwerktObject): verwerktObject.get('verwerktObjectId') for msg in msgs for verwerktObject in msg.get('verwerkteObjecten') }
+
+# Validate a single verwerkingsactie of a batch before it is processed
+def validate_batch_item(requestJson):
+    if (not isinstance(requestJson, dict) or not isinstance(requestJson.get('verwerkteObjecten'), list) or len(requestJson.get('verwerkteObjecten')) == 0):
+        raise Exception("Batch items should be verwerkingsacties with at least one verwerktObject")
+    for verwerktObject in requestJson.get('verwerkteObjecten'):
+        if (not isinstance(verwerktObject, dict) or not isinstance(verwerktObject.get('verwerkteSoortenGegevens'), list)):
+            raise Exception("Batch items should be verwerkingsacties with valid verwerkteObjecten")
+    return validate_body(requestJson)
+
+# POST /verwerkingsacties/batch
+# Runs every verwerkingsactie through the same pipeline as a single POST, with one S3 backup
+# for the batch, a single verwerktObjectId lookup stage and batched queue messages.
+# The POST messages of a verwerkingsactie are sent as a single queue message (a list), so each verwerkingsactie
+# is enqueued all-or-nothing and a failed one (500) can be retried without duplicating part of it.
+# Returns a result for each verwerkingsactie (in order of the request).
+# Backup (RAW) message of a batch request, one backup for the complete batch. Includes the generated actieIds,
+# tijdstipRegistratie and verwerktObjectIds, so a restore recreates the same items. The actieId of a verwerkingsactie
+# that was rejected or not enqueued (failed: indexes in msgs) is None, a restore skips it.
+def batch_backup(event, results, msgs, msgIndexes, failed, tijdstipRegistratie):
+    enqueued = [position for position in range(len(msgs)) if position not in failed]
+    actieIds = [None] * len(results)
+    for position in enqueued:
+        actieIds[msgIndexes[position]] = results[msgIndexes[position]].get('actieId')
+    return dict(event, actieIds=actieIds, tijdstipRegistratie=tijdstipRegistratie,
+        verwerktObjectIds=backup_verwerktObjectIds([msg for position in enqueued for msg in msgs[position]]))
+
+def handle_batch_request(event, bucket, queue, table, tijdstipRegistratie):
+    requestJson = json.loads(event.get('body'))
+    if (not isinstance(requestJson, list) or len(requestJson) == 0 or len(requestJson) > batchMaxItems):
+        return badRequestResponse()
+
+    batchId = str(uuid.uuid1()) # V1 Timestamp
+
+    results = [None] * len(requestJson)
+    accepted = []
+    legacyKeys = {}
+    for index, requestItem in enumerate(requestJson):
+        try:
+            accepted.append((index, objectId_check(validate_batch_item(requestItem), legacyKeys)))
+        except Exception:
+            results[index] = { 'index': index, 'status': 400, 'title': 'Bad request' }
+
+    # Resolve the verwerktObjectIds of all objects in the batch at once
+    resolvedIds = lookup_verwerktObjectIds([object_type_soort_id(object) for _, item in accepted for object in item.get('verwerkteObjecten')], table, legacyKeys=legacyKeys)
+
+    msgs = [] # a message (list of POST messages) for each verwerkingsactie
+    msgIndexes = [] # index of the verwerkingsactie of each message
+    for index, item in accepted:
+        actieId = str(uuid.uuid1()) # V1 Timestamp
+        itemMsgs = generate_post_messages(item, actieId, tijdstipRegistratie, table, resolvedIds)
+        if (len(json.dumps(itemMsgs).encode('UTF-8')) + sqsAttributesMaxBytes > sqsBatchMaxBytes):
+            # Does not fit in a single queue message, can only be posted on its own
+            results[index] = { 'index': index, 'status': 400, 'title': 'Bad request', 'detail': 'Verwerkingsactie too large for a batch request' }
+            continue
+        msgs.append(itemMsgs)
+        msgIndexes.append(index)
+        results[index] = { 'index': index, 'status': 200, 'actieId': actieId, 'url': itemMsgs[0].get('url') }
+    logCacheStats('verwerktObjectId', verwerktObjectIdCache)
+    logCacheStats('hash', hashCache)
+
+    # In queue backup mode the backup is sent along with the first message. The other messages are enqueued
+    # before it, so the backup leaves out the verwerkingsacties that failed.
+    pending = msgs
+    failed = []
+    if (backupMode == 'queue' and len(msgs) > 1):
+        failed = [position + 1 for position in enqueue_messages(msgs[1:], queue, 'POST')]
+        pending = msgs[:1]
+
+    attributes = { 0: backup_attributes('batch/' + batchId, batch_backup(event, results, msgs, msgIndexes, failed, tijdstipRegistratie), bucket, pending[0] if len(pending) > 0 else None) }
+    failedPending = enqueue_messages(pending, queue, 'POST', attributes)
+    failed = sorted(failed + failedPending)
+    if (len(failedPending) > 0):
+        # The stored backup lists verwerkingsacties that are not enqueued, or the backup was sent along with one:
+        # store it without them
+        store_item_in_s3('batch/' + batchId, batch_backup(event, results, msgs, msgIndexes, failed, tijdstipRegistratie), bucket)
+    for failedIndex in failed:
+        index = msgIndexes[failedIndex]
+        results[index] = { 'index': index, 'status': 500, 'title': 'Internal server error' }
+
+    return successResponse({ 'batchId': batchId, 'results': results })
 
 # Receives the event object and routes it to the correct function
 def handle_request(event, bucket, queue, table):
+    # Correlation id of the request, carried along with the queue messages (see Shared.tracing)
+    startTrace(event)
     params = parse_event(event)
     requestJson = json.loads(event.get('body'))
 
@@ -193,28 +568,51 @@ def handle_request(event, bucket, queue, table):
         # Generate UUID for actieId
         actieId = str(uuid.uuid1()) # V1 Timestamp
 
-        # Store (RAW) message as backup in S3
-        store_item_in_s3(actieId, event, bucket)
-
-        # Create DB url using generated actieId
-        url = "https://" + apiBaseUrl + "/verwerkingsacties/" + actieId
-
-        item = objectId_check(requestJson)
-        item = verwerktObjectId_check(item, table)
-
-        for verwerktObject in item.get('verwerkteObjecten'):
-
-            # Generate post message (including verwerktObjectId)
-            msg = generate_post_message(verwerktObject, item, actieId, url, tijdstipRegistratie)
+        msgs = generate_post_messages(requestJson, actieId, tijdstipRegistratie, table)
+        logCacheStats('verwerktObjectId', verwerktObjectIdCache)
+        backup = dict(event, tijdstipRegistratie=tijdstipRegistratie, verwerktObjectIds=backup_verwerktObjectIds(msgs))
+
+        writeMode = 'queue'
+        if (use_sync_write(event, msgs, queue)):
+            # Read-your-writes: the verwerkingsactie can be read as soon as the response is returned.
+            # The backup is stored in S3, there is no queue message to send it along with.
+            store_item_in_s3(actieId, backup, bucket)
+            failed = write_directly(msgs, table)
+            if (len(failed) == 0):
+                writeMode = 'sync'
+                addMetric('SyncWrites', 1)
+            elif (len(failed) == len(msgs)):
+                addMetric('SyncWriteFallbacks', 1)
+                enqueue_verwerkingsactie(msgs, queue, 'POST', bucket)
+            else:
+                # Part of the verwerkingsactie is written, failing the request would make the client retry it
+                # under a new actieId (duplicating the written items). As with a partial enqueue, the items
+                # that cannot be enqueued either are restored from the backup.
+                addMetric('SyncWriteFallbacks', 1)
+                try:
+                    enqueue_verwerkingsactie([msgs[index] for index in failed], queue, 'POST', bucket)
+                except Exception as e:
+                    print('Failed to enqueue the ' + str(len(failed)) + ' unwritten messages of verwerkingsactie ' + actieId + ', restore it from its backup: ' + str(e))
+                    addMetric('PartialEnqueues', 1)
+        else:
+            # Send messages to queue, with the backup (RAW) message in S3 or along with the first message
+            enqueue_verwerkingsactie(msgs, queue, 'POST', bucket, (actieId, backup))
 
-            # Send message to queue
-            send_to_queue(msg, queue, 'POST')
+        msg = msgs[-1]
 
         # Message inlcudes original request combined with actieId and Url
         # Remove compositeSortKey and objectTypeSoortId from return message
         msg.pop('compositeSortKey')
         msg.pop('objectTypeSoortId')
-        return successResponse(msg)
+        response = successResponse(msg)
+        # sync: the verwerkingsactie is written, queue: it is written when the queue message is processed
+        response['headers']['X-Write-Mode'] = writeMode
+        return response
+
+    if(params.get('method') == 'POST' and params.get('resource') == '/verwerkingsacties/batch'):
+        logApiCall('POST', '/verwerkingsacties/batch')
+
+        return handle_batch_request(event, bucket, queue, table, tijdstipRegistratie)
 
     if(params.get('method') == 'PATCH' and params.get('resource') =='/verwerkingsacties'):
         logApiCall('PATCH', '/verwerkingsacties')
@@ -233,12 +631,15 @@ def handle_request(event, bucket, queue, table):
         item = objectId_check(requestJson)
         verwerkteObjecten = item.get('verwerkteObjecten')
 
+        msgs = []
         for object in verwerkteObjecten:
             msg = generate_put_message(event, object, requestJson, tijdstipRegistratie)
 
-            store_item_in_s3(item.get('actieId'), msg, bucket)
+            # generate_put_message updates the same item for each object, keep a copy
+            msgs.append(dict(msg))
 
-            send_to_queue(msg, queue, 'PUT')
+        # The backup of a PUT is the list of its messages
+        enqueue_verwerkingsactie(msgs, queue, 'PUT', bucket, (item.get('actieId'), msgs))
 
         # Remove objectTypeSoortId from return message
         msg.pop('objectTypeSoortId')
@@ -1,17 +1,18 @@
 import os
+from Shared.clients import lazyBucket, lazyQueue, lazyTable, logColdStart
+from Shared.metrics import logMetrics
 from Shared.responses import internalServerErrorResponse
-import boto3
 from handler import handle_request
 import logging
 
-s3 = boto3.resource('s3')
-bucketName = s3.Bucket(os.environ['S3_BACKUP_BUCKET_NAME'])
-sqs = boto3.resource('sqs')
-queue = sqs.Queue(os.environ['SQS_URL'])
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['DYNAMO_TABLE_NAME'])
+# Clients are created on first use (and reused by warm invocations)
+bucketName = lazyBucket(os.environ['S3_BACKUP_BUCKET_NAME'])
+queue = lazyQueue(os.environ['SQS_URL'])
+table = lazyTable(os.environ['DYNAMO_TABLE_NAME'])
 debug = os.getenv('ENABLE_VERBOSE_AND_SENSITIVE_LOGGING', 'false') == 'true'
 
+@logColdStart
+@logMetrics('gen')
 def handler(event, context):
     if debug:
         print(event)
@@ -19,4 +20,4 @@ def handler(event, context):
         return handle_request(event, bucketName, queue, table)
     except Exception as e:
         logging.error(e)
-        return internalServerErrorResponse()
\ No newline at end of file
+        return internalServerErrorResponse()
@@ -1,44 +1,58 @@
 import os
-import json
-from datetime import datetime
-from Shared.helpers import hashHelper, logApiCall
-from Shared.responses import badRequestResponse, notFoundResponse, successResponse
-from boto3.dynamodb.conditions import Key, Attr
+import uuid
+from datetime import datetime, timezone
+import boto3
+from Shared.clients import client
+from Shared.helpers import logApiCall, subjectObjectTypeSoortIds
+from Shared.indexes import VERWERKT_OBJECT_ID, VERWERKT_OBJECT_ID_INDEX, verwerkingsactiesPage, verwerkingsactiesQuery
+from Shared.pagination import parseLimit, queryItems
+from Shared.responses import badRequestResponse, encodeJson, errorResponse, notFoundResponse, successResponse
+from boto3.dynamodb.conditions import Key
 
 apiBaseUrl = os.getenv('API_BASE_URL', 'api.vwlog-prod.csp-nijmegen.nl')
 
+# Exports are uploaded in parts of this size (S3 requires at least 5 MiB per part, except the last)
+exportPartSize = int(os.getenv('EXPORT_PART_SIZE', str(8 * 1024 * 1024)))
+# Seconds the (presigned) url of an export stays valid
+exportUrlExpiresIn = int(os.getenv('EXPORT_URL_EXPIRES_IN', '3600'))
+# A presigned url expires with the credentials it is signed with. The session credentials of the Lambda
+# can expire long before exportUrlExpiresIn, so urls are signed with (new) credentials of this role.
+exportSigningRoleArn = os.getenv('EXPORT_SIGNING_ROLE_ARN')
+# The export is aborted (and an error returned) when less time than this is left, so the upload is never
+# left half written by a timeout. The Lambda timeout equals the API Gateway integration timeout (29s).
+exportTimeMarginMs = int(os.getenv('EXPORT_TIME_MARGIN_MS', '4000'))
+
 # Receives the event object and routes it to the correct function
-def handle_request(event, table):
+def handle_request(event, table, exportBucket=None, remainingTimeMs=None):
     params = parse_event(event)
 
+    if(params.get('method') == 'GET' and params.get('resource') == '/verwerkte-objecten/export'):
+        logApiCall('GET', '/verwerkte-objecten/export')
+
+        return export_verwerkings_acties(event, table, exportBucket, remainingTimeMs)
+
     if(params.get('method') == 'GET' and params.get('resource') == '/verwerkte-objecten'):
         logApiCall('GET', '/verwerkte-objecten')
 
-        msg = get_verwerkings_acties(event, table)
-
-        return {
-            'statusCode': 200,
-            'body': json.dumps(msg),
-            'headers': { 
-            "Content-Type": "application/json",
-            }}
+        return get_verwerkings_acties(event, table, remainingTimeMs)
 
     if(params.get('method') == 'GET' and params.get('resource') =='/verwerkte-objecten/{verwerktObjectId}'):
-        logApiCall('GET', '/verwerkte-objecten/\{verwerkteObjectId\}')
-
-        msg = get_verwerkteobjecten_verwerktobjectid(event, table)
+        logApiCall('GET', '/verwerkte-objecten/{verwerktObjectId}')
 
-        return successResponse(msg)
+        return get_verwerkteobjecten_verwerktobjectid(event, table)
 
     # if no matches were found, handle this as a malformed request
     return badRequestResponse()
 
-# Get verwerkingsacties based on specific verwerkteObjectId
+# Get a verwerkingsactie based on specific verwerktObjectId.
+# The verwerktObjectId is projected on each item (Shared.indexes.indexAttributes), so this is a single
+# key lookup on the verwerktObjectId-index. All items of an object share the verwerktObjectId, one is enough.
 def get_verwerkteobjecten_verwerktobjectid(event, table):
 
     response = table.query(
-            IndexName='verwerktObjectId-index',
-            KeyConditionExpression=Key('verwerkteObjectId').eq(event.get('pathParameters').get('verwerktObjectId')))
+            IndexName=VERWERKT_OBJECT_ID_INDEX,
+            KeyConditionExpression=Key(VERWERKT_OBJECT_ID).eq(event.get('pathParameters').get('verwerktObjectId')),
+            Limit=1)
 
     # Check if requested record is found. If not, the list of items is empty (0).
     if (len(response.get('Items')) == 0):
@@ -52,39 +66,132 @@ def get_verwerkteobjecten_verwerktobjectid(event, table):
         return successResponse(msg)
 
 # Get verwerkingsacties based on given filter parameters
-def get_verwerkings_acties(event, table):
-    hashedObjectId = event.get('queryStringParameters').get('objectId')
-    object_key = event.get('queryStringParameters').get('objectType') + event.get(
-        'queryStringParameters').get('soortObjectId') + hashedObjectId
-
-    attrs = None
-    if (event.get('queryStringParameters').get('beginDatum') != None or event.get('queryStringParameters').get('eindDatum') != None):
-        attrs = Attr("tijdstip").between(event.get('queryStringParameters').get(
-            'beginDatum'), event.get('queryStringParameters').get('eindDatum'))
-    if (event['queryStringParameters'].get('verwerkingsactiviteitId') != None):
-        if (attrs != None):
-            attrs &= Attr("verwerkingsactiviteitId").eq(
-                event.get('queryStringParameters').get('verwerkingsactiviteitId'))
-        else:
-            attrs = Attr("verwerkingsactiviteitId").eq(
-                event.get('queryStringParameters').get('verwerkingsactiviteitId'))
-
-    if (attrs != None):
-        response = table.query(
-            IndexName='objectTypeSoortId-index',
-            KeyConditionExpression=Key('objectTypeSoortId').eq(object_key),
-            FilterExpression=attrs)
-    else:
-        response = table.query(
-            IndexName='objectTypeSoortId-index',
-            KeyConditionExpression=Key('objectTypeSoortId').eq(object_key))
+def get_verwerkings_acties(event, table, remainingTimeMs=None):
+    objectTypeSoortIds, filters = verwerkings_acties_filters(event)
+
+    try:
+        limit = parseLimit(event.get('queryStringParameters').get('limit'))
+        items, nextToken = verwerkingsactiesPage(table, limit, objectTypeSoortIds, event.get('queryStringParameters').get('nextToken'), remainingTimeMs, **filters)
+    except ValueError:
+        return badRequestResponse()
 
     # Remove objectTypeSoortId from return message
-    for item in response['Items']:
+    for item in items:
         item.pop('objectTypeSoortId')
 
-    return successResponse(response)
-
+    return successResponse({
+        'Items': items,
+        'Count': len(items),
+        'nextToken': nextToken,
+    })
+
+
+# Export all verwerkingsacties matching the filter parameters as NDJSON (one verwerkingsactie per line) to S3.
+# The items are streamed from the query into a multipart upload, so memory use does not depend on the size
+# of the history. Returns a (presigned) url to download the export.
+# Exports that can not be completed within the time left (remainingTimeMs) are aborted, the client
+# gets an error and should export a smaller date range (beginDatum, eindDatum).
+def export_verwerkings_acties(event, table, exportBucket, remainingTimeMs=None):
+    objectTypeSoortIds, filters = verwerkings_acties_filters(event)
+    key = 'exports/' + str(uuid.uuid4()) + '.ndjson'
+
+    count = 0
+    upload = ExportUpload(exportBucket, key)
+    try:
+        for item in (item for objectTypeSoortId in objectTypeSoortIds for item in queryItems(table, **verwerkingsactiesQuery(objectTypeSoortId, **filters))):
+            if remainingTimeMs is not None and remainingTimeMs() < exportTimeMarginMs:
+                upload.abort()
+                print('Export aborted after ' + str(count) + ' items, not enough time left')
+                return errorResponse('Export too large, use a smaller date range (beginDatum, eindDatum)', 422)
+            # Remove objectTypeSoortId from the export
+            item.pop('objectTypeSoortId', None)
+            upload.write((encodeJson(item) + '\n').encode('UTF-8'))
+            count += 1
+        upload.close()
+    except Exception:
+        upload.abort()
+        raise
+
+    url, expiresIn = presign_export_url(exportBucket, key)
+
+    return successResponse({
+        'exportId': key,
+        'url': url,
+        'expiresIn': expiresIn,
+        'Count': count,
+    })
+
+# Presigned url to download an export, and the seconds it is actually valid: at most exportUrlExpiresIn,
+# and not longer than the credentials it is signed with (those of exportSigningRoleArn, if configured).
+def presign_export_url(exportBucket, key):
+    s3 = exportBucket.meta.client
+    expiresIn = exportUrlExpiresIn
+    if exportSigningRoleArn:
+        credentials = client('sts').assume_role(
+            RoleArn=exportSigningRoleArn,
+            RoleSessionName='inzage-export',
+            DurationSeconds=max(900, exportUrlExpiresIn)).get('Credentials')
+        s3 = boto3.session.Session(
+            aws_access_key_id=credentials.get('AccessKeyId'),
+            aws_secret_access_key=credentials.get('SecretAccessKey'),
+            aws_session_token=credentials.get('SessionToken'),
+            region_name=s3.meta.region_name).client('s3', config=s3.meta.config)
+        expiresIn = min(expiresIn, int((credentials.get('Expiration') - datetime.now(timezone.utc)).total_seconds()))
+
+    url = s3.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': exportBucket.name, 'Key': key},
+        ExpiresIn=expiresIn)
+    return url, expiresIn
+
+# Buffers the written lines and uploads them as parts of a multipart upload once the part size is reached.
+# Small exports (a single part) are uploaded with a single PutObject.
+class ExportUpload:
+
+    def __init__(self, bucket, key):
+        self.s3 = bucket.meta.client
+        self.bucketName = bucket.name
+        self.key = key
+        self.buffer = bytearray()
+        self.uploadId = None
+        self.parts = []
+
+    def write(self, data):
+        self.buffer.extend(data)
+        if len(self.buffer) >= exportPartSize:
+            self.uploadPart()
+
+    def uploadPart(self):
+        if self.uploadId is None:
+            self.uploadId = self.s3.create_multipart_upload(Bucket=self.bucketName, Key=self.key, ContentType='application/x-ndjson').get('UploadId')
+        partNumber = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId, PartNumber=partNumber, Body=bytes(self.buffer))
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': partNumber})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.uploadId is None:
+            self.s3.put_object(Bucket=self.bucketName, Key=self.key, Body=bytes(self.buffer), ContentType='application/x-ndjson')
+            return
+        if len(self.buffer) > 0:
+            self.uploadPart()
+        self.s3.complete_multipart_upload(Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId, MultipartUpload={'Parts': self.parts})
+
+    def abort(self):
+        if self.uploadId is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId)
+            self.uploadId = None
+
+# objectTypeSoortIds of the subject and the filters (verwerkingsactiesQuery arguments) of the query string parameters
+def verwerkings_acties_filters(event):
+    queryStringParameters = event.get('queryStringParameters')
+    objectTypeSoortIds = subjectObjectTypeSoortIds(queryStringParameters.get('objectType'), queryStringParameters.get('soortObjectId'), queryStringParameters.get('objectId'))
+
+    return objectTypeSoortIds, {
+        'beginDatum': queryStringParameters.get('beginDatum'),
+        'eindDatum': queryStringParameters.get('eindDatum'),
+        'verwerkingsactiviteitId': queryStringParameters.get('verwerkingsactiviteitId'),
+    }
 
 # Parse the event object and extract relevant information.
 # After extraction, validates the object for valid parameter combinations.
@@ -103,7 +210,7 @@ def validate_params(params):
         if(params.get('parameters') == None):
             raise Exception("GET requests to /verwerkte-objecten should have query parameters")
 
-    if('/verwerkte-objecten/{verwerktObjectId}' in params.get('resource') and 'verwerktObjectId' not in params.get('parameters')):
-            raise Exception("GET requests to /verwerkingsacties/{verwerktObjectId} should have (required) query parameters")
+    if('/verwerkte-objecten/{verwerktObjectId}' in params.get('resource') and 'verwerktObjectId' not in (params.get('pathParameters') or {})):
+            raise Exception("GET requests to /verwerkte-objecten/{verwerktObjectId} should have (required) path parameters")
 
     return params
@@ -1,18 +1,22 @@
 import os
+from Shared.clients import lazyBucket, lazyTable, logColdStart
+from Shared.metrics import logMetrics
 from Shared.responses import internalServerErrorResponse
-import boto3
 from handler import handle_request
 import logging
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['DYNAMO_TABLE_NAME'])
+# The client is created on first use (and reused by warm invocations)
+table = lazyTable(os.environ['DYNAMO_TABLE_NAME'])
+exportBucket = lazyBucket(os.environ['EXPORT_BUCKET_NAME'])
 debug = os.getenv('ENABLE_VERBOSE_AND_SENSITIVE_LOGGING', 'false') == 'true'
 
+@logColdStart
+@logMetrics('inzage')
 def handler(event, context):
     if debug:
         print(event)
     try:
-        return handle_request(event, table)
+        return handle_request(event, table, exportBucket, context.get_remaining_time_in_millis)
     except Exception as e:
         logging.error(e)
-        return internalServerErrorResponse()
\ No newline at end of file
+        return internalServerErrorResponse()
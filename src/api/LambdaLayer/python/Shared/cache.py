@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# Least recently used cache with a time to live per entry.
+# Instances are meant to live on module level so they survive warm Lambda invocations.
+# The cache is thread safe, so it can be shared by lookups running on a thread pool.
+class LruTtlCache:
+
+    def __init__(self, maxSize=1024, ttl=3600):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Return the cached value for key, or default if the key is unknown or expired
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    # Store value for key, evicting the least recently used entries when the cache is full
+    def put(self, key, value):
+        if self.maxSize <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Hit/miss counters since the start of this Lambda container
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxSize': self.maxSize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+        }
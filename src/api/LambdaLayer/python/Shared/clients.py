@@ -0,0 +1,144 @@
+import functools
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import boto3
+from botocore.config import Config
+from Shared.metrics import instrumentClient
+
+# Start of the Lambda init phase, Shared.clients is the first import of every index.py
+initStarted = time.perf_counter()
+
+# Connection settings of the boto3 clients. The pool is shared by the threads of a handler
+# (verwerktObjectId lookups, PATCH updates), TCP keep-alive keeps the connections of a warm Lambda open.
+clientMaxPoolConnections = int(os.getenv('CLIENT_MAX_POOL_CONNECTIONS', '32'))
+clientConnectTimeout = int(os.getenv('CLIENT_CONNECT_TIMEOUT', '5'))
+clientReadTimeout = int(os.getenv('CLIENT_READ_TIMEOUT', '10'))
+clientMaxAttempts = int(os.getenv('CLIENT_MAX_ATTEMPTS', '3'))
+
+_clients = {}
+_resources = {}
+_creationTimes = {}
+_lock = threading.Lock()
+
+
+def clientConfig():
+    settings = {
+        'max_pool_connections': clientMaxPoolConnections,
+        'connect_timeout': clientConnectTimeout,
+        'read_timeout': clientReadTimeout,
+        'retries': { 'mode': 'standard', 'max_attempts': clientMaxAttempts },
+    }
+    try:
+        return Config(tcp_keepalive=True, **settings)
+    except TypeError: # botocore < 1.27 has no tcp_keepalive option
+        return Config(**settings)
+
+# Low-level client for a service, created on first use and reused by later (warm) invocations.
+# The client of a resource is reused, so both share a single connection pool.
+def client(serviceName):
+    if serviceName in _resources:
+        return _resources[serviceName].meta.client
+    return _create(_clients, serviceName, lambda: boto3.client(serviceName, config=clientConfig()))
+
+# boto3 resource for a service, created on first use and reused by later (warm) invocations
+def resource(serviceName):
+    return _create(_resources, serviceName, lambda: boto3.resource(serviceName, config=clientConfig()))
+
+def _create(instances, serviceName, factory):
+    instance = instances.get(serviceName)
+    if instance is None:
+        with _lock:
+            instance = instances.get(serviceName)
+            if instance is None:
+                started = time.perf_counter()
+                instance = factory()
+                instrumentClient(instance.meta.client if instances is _resources else instance)
+                instances[serviceName] = instance
+                _creationTimes[serviceName] = round((time.perf_counter() - started) * 1000, 1)
+    return instance
+
+# Proxy creating the wrapped object on first attribute access, so index.py can
+# define the table, bucket and queue on module level without creating any client.
+class LazyResource:
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+
+    def _resolve(self):
+        if self._instance is None:
+            self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+# Table on the low-level client with the fast (de)serialization of Shared.dynamodb
+def lazyTable(tableName):
+    from Shared.dynamodb import FastTable
+    return LazyResource(lambda: FastTable(client('dynamodb'), tableName))
+
+# Bucket on the low-level client, with the part of the boto3 Bucket resource the handlers use
+# (name, meta.client and put_object). Creating it does not load the resource model of S3.
+class ClientBucket:
+
+    def __init__(self, s3, bucketName):
+        self.name = bucketName
+        self.meta = SimpleNamespace(client=s3)
+
+    def put_object(self, **kwargs):
+        return self.meta.client.put_object(Bucket=self.name, **kwargs)
+
+# Queue on the low-level client, with the part of the boto3 Queue resource the handlers use.
+# Messages are received with meta.client.receive_message (plain dicts instead of Message resources).
+class ClientQueue:
+
+    def __init__(self, sqs, queueUrl):
+        self.url = queueUrl
+        self.meta = SimpleNamespace(client=sqs)
+
+    def send_message(self, **kwargs):
+        return self.meta.client.send_message(QueueUrl=self.url, **kwargs)
+
+    def send_messages(self, **kwargs):
+        return self.meta.client.send_message_batch(QueueUrl=self.url, **kwargs)
+
+    def delete_messages(self, **kwargs):
+        return self.meta.client.delete_message_batch(QueueUrl=self.url, **kwargs)
+
+    def change_message_visibility_batch(self, **kwargs):
+        return self.meta.client.change_message_visibility_batch(QueueUrl=self.url, **kwargs)
+
+def lazyBucket(bucketName):
+    return LazyResource(lambda: ClientBucket(client('s3'), bucketName))
+
+def lazyQueue(queueUrl):
+    return LazyResource(lambda: ClientQueue(client('sqs'), queueUrl))
+
+# Decorator for the Lambda handler, logs the init and first invocation timings (ms)
+# of a cold start, including the time it took to create each client.
+def logColdStart(handler):
+    coldStart = [True]
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if not coldStart[0]:
+            return handler(event, context)
+
+        coldStart[0] = False
+        invocationStarted = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            log = {
+                "init": round((invocationStarted - initStarted) * 1000, 1),
+                "firstInvocation": round((time.perf_counter() - invocationStarted) * 1000, 1),
+                "clients": dict(_creationTimes),
+            }
+            print('COLD START: ' + json.dumps(log))
+
+    return wrapper
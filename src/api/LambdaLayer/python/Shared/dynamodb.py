@@ -0,0 +1,145 @@
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+
+
+# Fast (de)serialization between DynamoDB attribute values and plain Python values.
+# Numbers become int/float instead of Decimal (so items can be passed to json.dumps),
+# sets become lists. The checks are ordered by how often the types occur in a verwerkingsactie:
+# mostly strings, and the verwerkteObjecten/verwerkteSoortenGegevens lists of maps.
+def deserialize(value):
+    if 'S' in value:
+        return value['S']
+    if 'M' in value:
+        return deserializeItem(value['M'])
+    if 'L' in value:
+        return [deserialize(element) for element in value['L']]
+    if 'N' in value:
+        return deserializeNumber(value['N'])
+    if 'BOOL' in value:
+        return value['BOOL']
+    if 'NULL' in value:
+        return None
+    if 'SS' in value:
+        return list(value['SS'])
+    if 'NS' in value:
+        return [deserializeNumber(number) for number in value['NS']]
+    if 'B' in value:
+        return value['B']
+    if 'BS' in value:
+        return list(value['BS'])
+    raise ValueError('Unknown DynamoDB attribute value: ' + str(value))
+
+def deserializeNumber(number):
+    if '.' in number or 'e' in number or 'E' in number:
+        return float(number)
+    return int(number)
+
+def deserializeItem(item):
+    return {name: value['S'] if 'S' in value else deserialize(value) for name, value in item.items()}
+
+def serialize(value):
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, dict):
+        return {'M': serializeItem(value)}
+    if isinstance(value, (list, tuple)):
+        return {'L': [serialize(element) for element in value]}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if isinstance(value, (int, float, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (set, frozenset)):
+        if all(isinstance(element, str) for element in value):
+            return {'SS': list(value)}
+        return {'NS': [str(element) for element in value]}
+    raise TypeError('Unsupported type for DynamoDB: ' + type(value).__name__)
+
+def serializeItem(item):
+    return {name: {'S': value} if isinstance(value, str) else serialize(value) for name, value in item.items()}
+
+# Convert boto3 conditions (Key/Attr) to expression strings and serialize the expression attribute values
+def expressionArguments(args):
+    args = dict(args)
+    builder = ConditionExpressionBuilder()
+    names = dict(args.get('ExpressionAttributeNames') or {})
+    values = dict(args.get('ExpressionAttributeValues') or {})
+    for name, isKeyCondition in (('KeyConditionExpression', True), ('FilterExpression', False), ('ConditionExpression', False)):
+        if isinstance(args.get(name), ConditionBase):
+            expression = builder.build_expression(args.get(name), is_key_condition=isKeyCondition)
+            args[name] = expression.condition_expression
+            names.update(expression.attribute_name_placeholders)
+            values.update(expression.attribute_value_placeholders)
+
+    if len(names) > 0:
+        args['ExpressionAttributeNames'] = names
+    if len(values) > 0:
+        args['ExpressionAttributeValues'] = serializeItem(values)
+    for name in ('Key', 'Item', 'ExclusiveStartKey'):
+        if args.get(name) is not None:
+            args[name] = serializeItem(args.get(name))
+    return args
+
+def deserializeResponse(response):
+    for name in ('Item', 'Attributes', 'LastEvaluatedKey'):
+        if name in response:
+            response[name] = deserializeItem(response[name])
+    if 'Items' in response:
+        response['Items'] = [deserializeItem(item) for item in response['Items']]
+    return response
+
+# Convert the Item (PutRequest) or Key (DeleteRequest) of BatchWriteItem requests
+def writeRequests(requests, convert):
+    return [{requestType: {name: convert(value) for name, value in body.items()}} for request in requests for requestType, body in request.items()]
+
+# Low-level client wrapper for the calls made through table.meta.client (BatchWriteItem)
+class FastClient:
+
+    def __init__(self, client):
+        self._client = client
+
+    def batch_write_item(self, RequestItems, **args):
+        requestItems = {tableName: writeRequests(requests, serializeItem) for tableName, requests in RequestItems.items()}
+        response = self._client.batch_write_item(RequestItems=requestItems, **args)
+        response['UnprocessedItems'] = {tableName: writeRequests(requests, deserializeItem) for tableName, requests in response.get('UnprocessedItems', {}).items()}
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+class FastTableMeta:
+
+    def __init__(self, client):
+        self.client = FastClient(client)
+
+# Drop-in replacement of the boto3 resource Table (for the calls used by the handlers) on the
+# low-level client, using the fast (de)serialization above instead of the TypeSerializer/TypeDeserializer.
+class FastTable:
+
+    def __init__(self, client, tableName):
+        self._client = client
+        self.name = tableName
+        self.table_name = tableName
+        self.meta = FastTableMeta(client)
+
+    def query(self, **args):
+        return deserializeResponse(self._client.query(TableName=self.name, **expressionArguments(args)))
+
+    def scan(self, **args):
+        return deserializeResponse(self._client.scan(TableName=self.name, **expressionArguments(args)))
+
+    def get_item(self, **args):
+        return deserializeResponse(self._client.get_item(TableName=self.name, **expressionArguments(args)))
+
+    def put_item(self, **args):
+        return deserializeResponse(self._client.put_item(TableName=self.name, **expressionArguments(args)))
+
+    def update_item(self, **args):
+        return deserializeResponse(self._client.update_item(TableName=self.name, **expressionArguments(args)))
+
+    def delete_item(self, **args):
+        return deserializeResponse(self._client.delete_item(TableName=self.name, **expressionArguments(args)))
@@ -0,0 +1,127 @@
+import hashlib
+import hmac
+import os
+import re
+
+from Shared.cache import LruTtlCache
+
+# Versioned hash schemes for objectIds (BSN):
+# - v1: sha3_256 of the objectId (unsalted), the default
+# - v2: HMAC-SHA256 (keyed) of the v1 hash, so existing v1 hashes can be migrated
+#   by rehashing the stored value, without reading the original objectIds
+HASH_SCHEME_V1 = 'v1'
+HASH_SCHEME_V2 = 'v2'
+HASH_SCHEMES = (HASH_SCHEME_V1, HASH_SCHEME_V2)
+
+# Hashes carry their scheme as prefix (v1:<hex>), so a hashed objectId is never mistaken for an objectId.
+# Hashes written before the prefix was introduced (migrate_hash_prefix.py) are unprefixed v1 hashes.
+HASH_PATTERN = re.compile(r'^(v[0-9]+):([0-9a-f]{64})$')
+# An unprefixed value can not be told apart from an objectId: any objectId of 64 lowercase hex characters
+# is taken for a legacy hash, and stored as v1:<objectId> instead of being hashed. This is consistent
+# (the same objectId always gets the same key) and matches how such objectIds were stored before the prefix
+# (as given, see legacyObjectId), but the objectId itself ends up in the table. Clients should send a prefixed hash.
+LEGACY_HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+# Scheme used for new hashes (and for hashing the objectId of a query)
+hashScheme = os.getenv('HASH_SCHEME', HASH_SCHEME_V1)
+
+# objectId -> hash never changes for a scheme, memoize the hashes of recent objectIds (across warm invocations)
+hashCache = LruTtlCache(
+    maxSize=int(os.getenv('HASH_CACHE_SIZE', '10000')),
+    ttl=int(os.getenv('HASH_CACHE_TTL', '86400')))
+
+_hashKey = None
+
+
+# Key of the v2 scheme, loaded lazily by the first v2 hash of a Lambda container (so during an invocation,
+# not the init phase) from the secret in HASH_KEY_SECRET_ARN, or from HASH_KEY (local use and tests).
+# Later (warm) invocations reuse it.
+def hashKey():
+    global _hashKey
+    if _hashKey is None:
+        secretArn = os.getenv('HASH_KEY_SECRET_ARN')
+        if secretArn:
+            from Shared.clients import client
+            key = client('secretsmanager').get_secret_value(SecretId=secretArn).get('SecretString')
+        else:
+            key = os.getenv('HASH_KEY')
+        if not key:
+            raise Exception('No hash key configured (HASH_KEY_SECRET_ARN or HASH_KEY) for hash scheme ' + HASH_SCHEME_V2)
+        _hashKey = key.encode('UTF-8')
+    return _hashKey
+
+def sha3Hash(objectId):
+    return hashlib.sha3_256(objectId.encode('UTF-8')).hexdigest()
+
+def formatHash(scheme, digest):
+    return scheme + ':' + digest
+
+# Split a hash into (scheme, digest), None if the value is not a hash (but an objectId)
+def parseHash(value):
+    match = HASH_PATTERN.match(value)
+    if match is not None:
+        return match.group(1), match.group(2)
+    if LEGACY_HASH_PATTERN.match(value) is not None:
+        return HASH_SCHEME_V1, value
+    return None
+
+def isHashed(value):
+    return parseHash(value) is not None
+
+# The objectId as it was stored before the prefix was introduced: objectIds shorter than
+# 10 characters were hashed (unprefixed v1), longer ones (hashed by the client or not) were stored as given.
+# None for prefixed hashes, those did not exist before.
+def legacyObjectId(objectId):
+    if HASH_PATTERN.match(objectId) is not None:
+        return None
+    if len(objectId) < 10:
+        return sha3Hash(objectId)
+    return objectId
+
+# Convert a hash (of any scheme, prefixed or legacy) into a hash of the given scheme.
+# Only v1 hashes can be converted into another scheme.
+def rehash(hashed, scheme=None):
+    scheme = scheme or hashScheme
+    parsed = parseHash(hashed)
+    if parsed is None:
+        raise ValueError('Not a hash: ' + hashed)
+    hashedScheme, digest = parsed
+    if hashedScheme == scheme:
+        return formatHash(scheme, digest)
+    if hashedScheme == HASH_SCHEME_V1 and scheme == HASH_SCHEME_V2:
+        return formatHash(scheme, hmac.new(hashKey(), digest.encode('ascii'), hashlib.sha256).hexdigest())
+    raise ValueError('Can not convert a ' + hashedScheme + ' hash into hash scheme ' + str(scheme))
+
+# Hash a single objectId using the (configured) hash scheme
+def hashObjectId(objectId, scheme=None):
+    scheme = scheme or hashScheme
+    key = (scheme, objectId)
+    hashed = hashCache.get(key)
+    if hashed is None:
+        hashed = rehash(formatHash(HASH_SCHEME_V1, sha3Hash(objectId)), scheme)
+        hashCache.put(key, hashed)
+    return hashed
+
+# Hash a list of objectIds in one call, each distinct objectId is hashed once.
+# Returns the hashes in the order of objectIds.
+def hashObjectIds(objectIds, scheme=None):
+    hashes = {}
+    for objectId in objectIds:
+        if objectId not in hashes:
+            hashes[objectId] = hashObjectId(objectId, scheme)
+    return [hashes[objectId] for objectId in objectIds]
+
+# The hash of an objectId in the (configured) hash scheme. Values that are already
+# hashed are converted to that scheme instead of being hashed again.
+def canonicalHash(value, scheme=None):
+    if isHashed(value):
+        return rehash(value, scheme)
+    return hashObjectId(value, scheme)
+
+# canonicalHash for a list of values (objectIds and/or hashes)
+def canonicalHashes(values, scheme=None):
+    hashes = {}
+    for value in values:
+        if value not in hashes:
+            hashes[value] = canonicalHash(value, scheme)
+    return [hashes[value] for value in values]
@@ -1,18 +1,45 @@
-import hashlib
 import json
+import os
+from Shared.hashing import HASH_SCHEME_V1, canonicalHash, legacyObjectId, parseHash
+from Shared.metrics import putMetric, setProperty
 
+# Until the existing items are migrated to the prefixed hash format (tools/migrate_hash_prefix.py),
+# the verwerkingsacties of a subject are read from its legacy objectTypeSoortId as well
+legacyHashLookup = os.getenv('LEGACY_HASH_LOOKUP', 'true') == 'true'
 
+
+# Hash an objectId using the configured hash scheme (see Shared.hashing),
+# an already hashed objectId is returned in that scheme instead of being hashed again
 def hashHelper(input):
-    # salt = secrets.token_hex(8)
-    h = hashlib.new('sha3_256')
-    h.update(bytes(input, encoding='UTF-8'))
-    # h.update(bytes(salt))
-    hash = h.hexdigest()
-    return hash
+    return canonicalHash(input)
+
+# objectTypeSoortIds the verwerkingsacties of a subject are stored under: the canonical one and,
+# with legacyHashLookup, the legacy one (see Shared.hashing.legacyObjectId). The objectId can be
+# a prefixed v1 hash as well (Inzage), its legacy form is the unprefixed hash.
+def subjectObjectTypeSoortIds(objectType, soortObjectId, objectId):
+    objectTypeSoortIds = [objectType + soortObjectId + hashHelper(objectId)]
+    legacyId = None
+    if legacyHashLookup:
+        legacyId = legacyObjectId(objectId)
+        if legacyId is None and parseHash(objectId)[0] == HASH_SCHEME_V1:
+            legacyId = parseHash(objectId)[1]
+    if legacyId is not None and objectType + soortObjectId + legacyId not in objectTypeSoortIds:
+        objectTypeSoortIds.append(objectType + soortObjectId + legacyId)
+    return objectTypeSoortIds
 
 def logApiCall(method, path):
     log = {
         "method": method,
         "path": path,
     }
-    print('API CALL: ' + json.dumps(log))
\ No newline at end of file
+    print('API CALL: ' + json.dumps(log))
+    setProperty('method', method)
+    setProperty('path', path)
+
+def logCacheStats(name, cache):
+    log = {
+        "cache": name,
+        **cache.stats(),
+    }
+    print('CACHE STATS: ' + json.dumps(log))
+    putMetric(name + 'CacheHitRate', round(log.get('hitRate') * 100, 2), 'Percent')
@@ -0,0 +1,139 @@
+import os
+
+from boto3.dynamodb.conditions import Key, Attr
+
+from Shared.pagination import decodeNextToken, encodeNextToken, queryPage
+
+# Global secondary indexes of the verwerkingen table (see DatabaseStack)
+OBJECT_TYPE_SOORT_ID_INDEX = 'objectTypeSoortId-index'
+OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX = 'objectTypeSoortId-tijdstip-index'
+OBJECT_TYPE_SOORT_ID_ACTIVITEIT_INDEX = 'objectTypeSoortId-verwerkingsactiviteitId-index'
+VERWERKT_OBJECT_ID_INDEX = 'verwerktObjectId-index'
+
+# Key attributes (all strings) of the table and of the indexes queried with a page limit.
+# The LastEvaluatedKey of an index query holds the key attributes of both the index and the table.
+TABLE_KEY_ATTRIBUTES = ('actieId', 'compositeSortKey')
+INDEX_KEY_ATTRIBUTES = {
+    OBJECT_TYPE_SOORT_ID_INDEX: ('objectTypeSoortId',),
+    OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX: ('objectTypeSoortId', 'tijdstip'),
+    OBJECT_TYPE_SOORT_ID_ACTIVITEIT_INDEX: ('objectTypeSoortIdActiviteit', 'tijdstip'),
+}
+
+# Sparse composite key attribute (objectTypeSoortId#verwerkingsactiviteitId), only set if the value is present
+OBJECT_TYPE_SOORT_ID_ACTIVITEIT = 'objectTypeSoortIdActiviteit'
+# verwerktObjectId of the verwerktObject an item is stored for (the objectTypeSoortId of the item),
+# projected from the nested verwerkteObjecten list so it can be used as key of the verwerktObjectId-index
+VERWERKT_OBJECT_ID = 'verwerktObjectId'
+
+# The objectTypeSoortId-verwerkingsactiviteitId-index is deployed after the objectTypeSoortId-tijdstip-index
+# (DynamoDB creates one GSI per table update), it is only queried once it exists (enableActiviteitIndex)
+activiteitIndexEnabled = os.getenv('ENABLE_ACTIVITEIT_INDEX', 'false') == 'true'
+
+
+def compositeKey(objectTypeSoortId, value):
+    return objectTypeSoortId + '#' + value
+
+# Attributes of an item that are only there to populate the (sparse) composite indexes
+def indexAttributes(item):
+    attributes = {}
+    objectTypeSoortId = item.get('objectTypeSoortId')
+    if not objectTypeSoortId:
+        return attributes
+    if item.get('verwerkingsactiviteitId'):
+        attributes[OBJECT_TYPE_SOORT_ID_ACTIVITEIT] = compositeKey(objectTypeSoortId, item.get('verwerkingsactiviteitId'))
+    verwerktObjectId = itemVerwerktObjectId(item)
+    if verwerktObjectId:
+        attributes[VERWERKT_OBJECT_ID] = verwerktObjectId
+    return attributes
+
+# verwerktObjectId of the verwerktObject matching the objectTypeSoortId of the item (None if there is none)
+def itemVerwerktObjectId(item):
+    for verwerktObject in item.get('verwerkteObjecten') or []:
+        objectTypeSoortId = (verwerktObject.get('objectType') or '') + (verwerktObject.get('soortObjectId') or '') + (verwerktObject.get('objectId') or '')
+        if objectTypeSoortId == item.get('objectTypeSoortId'):
+            return verwerktObject.get('verwerktObjectId')
+    return None
+
+# Add the composite index attributes to an item before it is written
+def addIndexAttributes(item):
+    item.update(indexAttributes(item))
+    return item
+
+# Attributes of a valid ExclusiveStartKey (nextToken) for a query on indexName
+def exclusiveStartKeyAttributes(indexName):
+    return set(TABLE_KEY_ATTRIBUTES + INDEX_KEY_ATTRIBUTES.get(indexName, ()))
+
+# Key condition on tijdstip for an (open ended) date range
+def tijdstipKeyCondition(beginDatum, eindDatum):
+    if beginDatum is not None and eindDatum is not None:
+        return Key('tijdstip').between(beginDatum, eindDatum)
+    if beginDatum is not None:
+        return Key('tijdstip').gte(beginDatum)
+    return Key('tijdstip').lte(eindDatum)
+
+# Build the query arguments for verwerkingsacties of a single object (objectTypeSoortId).
+# The most selective index for the given parameters is used:
+# - verwerkingsactiviteitId: objectTypeSoortId-verwerkingsactiviteitId-index (if enabled)
+# - date range only: objectTypeSoortId-tijdstip-index
+# Both have tijdstip as sort key, so a date range is part of the key condition and only
+# the items within the range are read. vertrouwelijkheid (set on every item, not selective enough
+# for an index of its own) and a verwerkingsactiviteitId without its index are applied as FilterExpression.
+def verwerkingsactiesQuery(objectTypeSoortId, beginDatum=None, eindDatum=None, verwerkingsactiviteitId=None, vertrouwelijkheid=None, activiteitIndex=None):
+    activiteitIndex = activiteitIndexEnabled if activiteitIndex is None else activiteitIndex
+    filters = []
+    if verwerkingsactiviteitId is not None and activiteitIndex:
+        indexName = OBJECT_TYPE_SOORT_ID_ACTIVITEIT_INDEX
+        keyCondition = Key(OBJECT_TYPE_SOORT_ID_ACTIVITEIT).eq(compositeKey(objectTypeSoortId, verwerkingsactiviteitId))
+    elif beginDatum is not None or eindDatum is not None or verwerkingsactiviteitId is not None or vertrouwelijkheid is not None:
+        indexName = OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX
+        keyCondition = Key('objectTypeSoortId').eq(objectTypeSoortId)
+        if verwerkingsactiviteitId is not None:
+            filters.append(Attr('verwerkingsactiviteitId').eq(verwerkingsactiviteitId))
+    else:
+        indexName = OBJECT_TYPE_SOORT_ID_INDEX
+        keyCondition = Key('objectTypeSoortId').eq(objectTypeSoortId)
+
+    if beginDatum is not None or eindDatum is not None:
+        keyCondition &= tijdstipKeyCondition(beginDatum, eindDatum)
+    if vertrouwelijkheid is not None:
+        filters.append(Attr('vertrouwelijkheid').eq(vertrouwelijkheid))
+
+    queryArgs = {
+        'IndexName': indexName,
+        'KeyConditionExpression': keyCondition,
+    }
+    if len(filters) > 0:
+        filterExpression = filters[0]
+        for condition in filters[1:]:
+            filterExpression &= condition
+        queryArgs['FilterExpression'] = filterExpression
+    return queryArgs
+
+# Query a page of the verwerkingsacties of a subject stored under several objectTypeSoortIds (partitions, see
+# Shared.helpers.subjectObjectTypeSoortIds), the partitions one after the other. A nextToken continues in the
+# partition of its key. Returns the items and the nextToken, raises ValueError for invalid tokens (see queryPage).
+def verwerkingsactiesPage(table, limit, objectTypeSoortIds, nextToken=None, remainingTimeMs=None, **filters):
+    queries = [verwerkingsactiesQuery(objectTypeSoortId, **filters) for objectTypeSoortId in objectTypeSoortIds]
+    indexName = queries[0].get('IndexName')
+    keyAttributes = exclusiveStartKeyAttributes(indexName)
+    partitionAttribute = INDEX_KEY_ATTRIBUTES.get(indexName)[0]
+    partitions = [compositeKey(objectTypeSoortId, filters.get('verwerkingsactiviteitId')) if partitionAttribute == OBJECT_TYPE_SOORT_ID_ACTIVITEIT else objectTypeSoortId
+        for objectTypeSoortId in objectTypeSoortIds]
+
+    start = 0
+    exclusiveStartKey = decodeNextToken(nextToken, keyAttributes)
+    if exclusiveStartKey is not None:
+        if exclusiveStartKey.get(partitionAttribute) not in partitions:
+            raise ValueError('Invalid nextToken')
+        start = partitions.index(exclusiveStartKey.get(partitionAttribute))
+
+    items = []
+    for index in range(start, len(queries)):
+        partitionItems, partitionToken = queryPage(table, limit - len(items), nextToken if index == start else None, keyAttributes, remainingTimeMs, **queries[index])
+        items.extend(partitionItems)
+        if partitionToken is not None:
+            return items, partitionToken
+        if len(items) >= limit and index < len(queries) - 1:
+            # Full at the end of a partition: the next page continues after its last item, so in the next partition
+            return items, encodeNextToken({attribute: items[-1].get(attribute) for attribute in keyAttributes})
+    return items, None
@@ -0,0 +1,172 @@
+import functools
+import json
+import os
+import threading
+import time
+
+# Metrics are written as CloudWatch Embedded Metric Format (EMF) log records,
+# CloudWatch extracts them from the log group without any metric filters.
+metricsNamespace = os.getenv('METRICS_NAMESPACE', 'Verwerkingenlogging')
+metricsEnabled = os.getenv('ENABLE_METRICS', 'true') == 'true'
+
+# EMF limits per record
+emfMaxMetrics = 100
+emfMaxValues = 100
+
+# DynamoDB operations returning ConsumedCapacity (with ReturnConsumedCapacity)
+READ_OPERATIONS = ('Query', 'Scan', 'GetItem', 'BatchGetItem', 'TransactGetItems')
+WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem', 'TransactWriteItems')
+
+# Display names of the instrumented services, used as metric name prefix
+SERVICE_NAMES = {
+    'dynamodb': 'DynamoDB',
+    'sqs': 'SQS',
+    's3': 'S3',
+}
+
+
+# Buffer of the metric values of a single invocation, flushed (printed) once at the end of the
+# invocation. Thread safe, calls made from a thread pool (lookups, PATCH updates) are recorded as well.
+# Values are only buffered during an invocation (logMetrics), not when the handlers are used by tools.
+class MetricsBuffer:
+
+    def __init__(self):
+        self.active = False
+        self.handlerName = None
+        self.properties = {}
+        self._units = {}
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def put(self, name, value, unit='None'):
+        with self._lock:
+            self._units.setdefault(name, unit)
+            self._values.setdefault(name, []).append(value)
+
+    # Sum all values of a metric into a single value (counters)
+    def add(self, name, value, unit='Count'):
+        with self._lock:
+            self._units.setdefault(name, unit)
+            values = self._values.setdefault(name, [0])
+            values[0] += value
+
+    def setProperty(self, name, value):
+        with self._lock:
+            self.properties[name] = value
+
+    # Create the EMF records for the buffered values and clear the buffer.
+    # Metrics with more values than allowed in a record are split over several records.
+    def records(self, timestamp=None):
+        with self._lock:
+            values = self._values
+            units = self._units
+            properties = self.properties
+            self._values = {}
+            self._units = {}
+            self.properties = {}
+
+        pending = {name: list(metricValues) for name, metricValues in values.items()}
+        records = []
+        while len(pending) > 0:
+            names = list(pending.keys())[:emfMaxMetrics]
+            record = dict(properties)
+            record.update({
+                '_aws': {
+                    'Timestamp': int((timestamp or time.time()) * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': metricsNamespace,
+                        'Dimensions': [['Handler']],
+                        'Metrics': [{'Name': name, 'Unit': units[name]} for name in names],
+                    }],
+                },
+                'Handler': self.handlerName or 'unknown',
+            })
+            for name in names:
+                metricValues = pending[name]
+                record[name] = metricValues[0] if len(metricValues) == 1 else metricValues[:emfMaxValues]
+                if len(metricValues) > emfMaxValues:
+                    pending[name] = metricValues[emfMaxValues:]
+                else:
+                    del pending[name]
+            records.append(record)
+        return records
+
+    def flush(self):
+        for record in self.records():
+            print(json.dumps(record, separators=(',', ':')))
+
+metrics = MetricsBuffer()
+
+def putMetric(name, value, unit='None'):
+    if metrics.active:
+        metrics.put(name, value, unit)
+
+def addMetric(name, value, unit='Count'):
+    if metrics.active:
+        metrics.add(name, value, unit)
+
+def setProperty(name, value):
+    if metrics.active:
+        metrics.setProperty(name, value)
+
+# Request the consumed capacity of DynamoDB calls, so it can be recorded
+def _requestConsumedCapacity(params, model, **kwargs):
+    if model.name in READ_OPERATIONS or model.name in WRITE_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+def _beforeCall(context, **kwargs):
+    context['metricsStarted'] = time.perf_counter()
+
+def _afterCall(model, parsed, context, **kwargs):
+    started = context.get('metricsStarted')
+    serviceName = model.service_model.service_name
+    prefix = SERVICE_NAMES.get(serviceName, serviceName)
+    addMetric(prefix + 'Calls', 1)
+    if started is not None:
+        putMetric(prefix + 'Duration', round((time.perf_counter() - started) * 1000, 2), 'Milliseconds')
+
+    if serviceName != 'dynamodb' or not isinstance(parsed, dict):
+        return
+    consumedCapacity = parsed.get('ConsumedCapacity')
+    if consumedCapacity is not None:
+        capacityUnits = sum(capacity.get('CapacityUnits', 0) for capacity in (consumedCapacity if isinstance(consumedCapacity, list) else [consumedCapacity]))
+        addMetric('ConsumedReadCapacity' if model.name in READ_OPERATIONS else 'ConsumedWriteCapacity', capacityUnits)
+    if 'ScannedCount' in parsed:
+        # Filter efficiency: items read (and paid for) vs. items returned after the FilterExpression
+        addMetric('ItemsReturned', parsed.get('Count', 0))
+        addMetric('ItemsScanned', parsed.get('ScannedCount'))
+
+# Record call counts, durations and (DynamoDB) consumed capacity of all calls made by a boto3 client
+def instrumentClient(client):
+    if not metricsEnabled:
+        return client
+    events = client.meta.events
+    serviceName = client.meta.service_model.service_name
+    if serviceName == 'dynamodb':
+        events.register('provide-client-params.dynamodb', _requestConsumedCapacity, unique_id='metrics-consumed-capacity')
+    events.register('before-call.' + serviceName, _beforeCall, unique_id='metrics-before-call')
+    events.register('after-call.' + serviceName, _afterCall, unique_id='metrics-after-call')
+    return client
+
+# Decorator for the Lambda handler, records the handler latency and
+# flushes the metrics of the invocation once, when the handler is done
+def logMetrics(handlerName):
+    def decorator(handler):
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if not metricsEnabled:
+                return handler(event, context)
+
+            metrics.handlerName = handlerName
+            metrics.active = True
+            started = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                putMetric('Latency', round((time.perf_counter() - started) * 1000, 2), 'Milliseconds')
+                metrics.active = False
+                metrics.flush()
+
+        return wrapper
+    return decorator
@@ -0,0 +1,97 @@
+import base64
+import binascii
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+# Page size used when no (valid) limit query parameter is given, and the maximum allowed limit
+DEFAULT_PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 1000
+# Budget of a page: at most PAGE_MAX_QUERIES queries, stopped when less than PAGE_TIME_MARGIN_MS of the
+# invocation is left. A page that reaches its budget is returned with the items found so far and a nextToken.
+PAGE_MAX_QUERIES = int(os.getenv('PAGE_MAX_QUERIES', '10'))
+PAGE_TIME_MARGIN_MS = int(os.getenv('PAGE_TIME_MARGIN_MS', '1000'))
+
+
+# Parse the limit query parameter, raises ValueError for invalid values
+def parseLimit(value):
+    if value is None:
+        return DEFAULT_PAGE_LIMIT
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit should be a positive number')
+    return min(limit, MAX_PAGE_LIMIT)
+
+# Create an opaque continuation token from a LastEvaluatedKey
+def encodeNextToken(lastEvaluatedKey):
+    if lastEvaluatedKey is None:
+        return None
+    data = json.dumps(lastEvaluatedKey, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(data.encode('UTF-8')).decode('ascii')
+
+# Decode a continuation token back into an ExclusiveStartKey, raises ValueError for invalid tokens.
+# If keyAttributes is given, the key should have exactly those (string) attributes, so a token
+# of another query (index) is rejected instead of failing the query.
+def decodeNextToken(nextToken, keyAttributes=None):
+    if nextToken is None:
+        return None
+    try:
+        key = json.loads(base64.urlsafe_b64decode(nextToken.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Invalid nextToken')
+    if not isinstance(key, dict):
+        raise ValueError('Invalid nextToken')
+    if keyAttributes is not None:
+        if set(key.keys()) != set(keyAttributes) or not all(isinstance(value, str) for value in key.values()):
+            raise ValueError('Invalid nextToken')
+    return key
+
+# Query a single page of at most limit items, starting at nextToken.
+# DynamoDB applies Limit before the FilterExpression and stops at 1 MB, so follow-up
+# queries are done until the page is filled, the results are exhausted or the budget of the page is used
+# (a filter that matches few items of a large history can take many queries). The page can then have
+# less than limit (or no) items, the client continues with the nextToken.
+# remainingTimeMs is the remaining time of the invocation (context.get_remaining_time_in_millis).
+# Returns the items and the token for the next page (None if there are no more items).
+# Raises ValueError for a nextToken that is invalid (see decodeNextToken) or rejected by DynamoDB.
+def queryPage(table, limit, nextToken=None, keyAttributes=None, remainingTimeMs=None, **queryArgs):
+    items = []
+    queries = 0
+    exclusiveStartKey = decodeNextToken(nextToken, keyAttributes)
+
+    while True:
+        args = dict(queryArgs, Limit=limit - len(items))
+        if exclusiveStartKey is not None:
+            args['ExclusiveStartKey'] = exclusiveStartKey
+        try:
+            response = table.query(**args)
+        except ClientError as error:
+            # Only the first query starts at the key of the token, the next ones at a LastEvaluatedKey
+            if nextToken is not None and len(items) == 0 and error.response.get('Error', {}).get('Code') == 'ValidationException':
+                raise ValueError('Invalid nextToken')
+            raise
+        items.extend(response.get('Items'))
+        queries += 1
+
+        exclusiveStartKey = response.get('LastEvaluatedKey')
+        if exclusiveStartKey is None or len(items) >= limit:
+            break
+        if queries >= PAGE_MAX_QUERIES or (remainingTimeMs is not None and remainingTimeMs() < PAGE_TIME_MARGIN_MS):
+            break
+
+    return items, encodeNextToken(exclusiveStartKey)
+
+# Generator yielding all items of a query, one page (of at most 1 MB) in memory at a time
+def queryItems(table, **queryArgs):
+    exclusiveStartKey = None
+    while True:
+        args = dict(queryArgs)
+        if exclusiveStartKey is not None:
+            args['ExclusiveStartKey'] = exclusiveStartKey
+        response = table.query(**args)
+        yield from response.get('Items')
+
+        exclusiveStartKey = response.get('LastEvaluatedKey')
+        if exclusiveStartKey is None:
+            return
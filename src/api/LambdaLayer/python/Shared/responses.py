@@ -1,15 +1,38 @@
-
 import json
+from datetime import date, datetime
+from decimal import Decimal
 from Shared.version import VERWERKINGENLOGGING_API_VERSION
 
-def successResponse(body, code=200):
+try:
+  import orjson # optional, faster encoder if it is part of the layer
+except ImportError:
+  orjson = None
+
+# Types json (and orjson) can not encode: Decimal (boto3 resource items), datetime and sets
+def jsonDefault(value):
+  if isinstance(value, Decimal):
+    return int(value) if value == value.to_integral_value() else float(value)
+  if isinstance(value, (datetime, date)):
+    return value.isoformat()
+  if isinstance(value, (set, frozenset)):
+    return list(value)
+  raise TypeError('Object of type ' + type(value).__name__ + ' is not JSON serializable')
+
+# Encode a response body (once). Responses are compressed by API Gateway (minCompressionSize)
+# for clients sending Accept-Encoding, so the body is returned as plain text.
+def encodeJson(body):
+  if orjson is not None:
+    return orjson.dumps(body, default=jsonDefault).decode('UTF-8')
+  return json.dumps(body, default=jsonDefault, separators=(',', ':'), ensure_ascii=False)
+
+def successResponse(body=None, code=200):
   responseBody = ''
   if body is not None:
-    responseBody = json.dumps(body)
+    responseBody = encodeJson(body)
   return {
     'statusCode': code,
-    'body': json.dumps(responseBody),
-    'headers': { 
+    'body': responseBody,
+    'headers': {
       "Content-Type": "application/json",
       "API-version": VERWERKINGENLOGGING_API_VERSION,
     }
@@ -31,8 +54,8 @@ def errorResponse(title, status):
   }
   return {
     'statusCode': status,
-    'body': json.dumps(problem),
-    'headers': { 
+    'body': encodeJson(problem),
+    'headers': {
       "Content-Type": "application/problem+json",
       "API-version": VERWERKINGENLOGGING_API_VERSION,
     },
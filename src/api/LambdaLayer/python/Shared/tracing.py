@@ -0,0 +1,89 @@
+import json
+import re
+import time
+import uuid
+
+from Shared.metrics import putMetric, setProperty
+
+# Correlation ids given by the client (X-Correlation-Id header) are only used if they look like an id
+CORRELATION_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+
+# The trace of the request handled by the Gen lambda (one request per invocation)
+_currentTrace = None
+
+
+def nowMs():
+    return int(time.time() * 1000)
+
+# Start the trace of an API request: the correlation id (from the X-Correlation-Id header or new)
+# and the time API Gateway received the request. Its message attributes are added to all queue messages.
+def startTrace(event):
+    global _currentTrace
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    correlationId = headers.get('x-correlation-id')
+    if correlationId is None or CORRELATION_ID_PATTERN.match(correlationId) is None:
+        correlationId = str(uuid.uuid4())
+    requestTime = (event.get('requestContext') or {}).get('requestTimeEpoch') or nowMs()
+
+    _currentTrace = {'correlationId': correlationId, 'requestTime': int(requestTime)}
+    setProperty('correlationId', correlationId)
+    return _currentTrace
+
+# SQS message attributes carrying the current trace, next to path
+def traceAttributes():
+    if _currentTrace is None:
+        return {}
+    return {
+        'correlationId': {'DataType': 'String', 'StringValue': _currentTrace.get('correlationId')},
+        'requestTime': {'DataType': 'Number', 'StringValue': str(_currentTrace.get('requestTime'))},
+    }
+
+# Trace of a received SQS record (lambda event format): (correlationId, requestTime, sentTime), None if it has none
+def messageTrace(record):
+    messageAttributes = record.get('messageAttributes') or {}
+    correlationId = (messageAttributes.get('correlationId') or {}).get('stringValue')
+    if correlationId is None:
+        return None
+    requestTime = (messageAttributes.get('requestTime') or {}).get('stringValue')
+    sentTime = (record.get('attributes') or {}).get('SentTimestamp')
+    return correlationId, int(requestTime) if requestTime else None, int(sentTime) if sentTime else None
+
+# Spans (ms) of the messages of a single request that were processed in one invocation:
+# - enqueue: API request received until the last message was sent to the queue (Gen lambda)
+# - queueDwell: first message sent until processing started (SQS and Lambda polling)
+# - write: time spent writing the messages to DynamoDB (Proc lambda)
+# - ingestLag: API request received until written, readable in DynamoDB
+def traceSpans(requestTime, sentTimes, processStarted, writeMs, written):
+    spans = {'write': writeMs}
+    if len(sentTimes) > 0:
+        spans['queueDwell'] = max(0, processStarted - min(sentTimes))
+        if requestTime is not None:
+            spans['enqueue'] = max(0, max(sentTimes) - requestTime)
+    if requestTime is not None:
+        spans['ingestLag'] = max(0, written - requestTime)
+    return spans
+
+# Log the spans of the traced messages and record them as metrics.
+# traces contains a messageTrace for each processed (not failed) message.
+def emitTraces(traces, processStarted, writeMs, written=None):
+    written = written or nowMs()
+    byCorrelationId = {}
+    for correlationId, requestTime, sentTime in traces:
+        trace = byCorrelationId.setdefault(correlationId, {'requestTime': requestTime, 'sentTimes': [], 'messages': 0})
+        trace['messages'] += 1
+        if sentTime is not None:
+            trace['sentTimes'].append(sentTime)
+
+    emitted = []
+    for correlationId, trace in byCorrelationId.items():
+        spans = traceSpans(trace.get('requestTime'), trace.get('sentTimes'), processStarted, writeMs, written)
+        log = {
+            'correlationId': correlationId,
+            'messages': trace.get('messages'),
+            'spans': spans,
+        }
+        print('TRACE: ' + json.dumps(log))
+        for name, value in spans.items():
+            putMetric(name[0].upper() + name[1:], value, 'Milliseconds')
+        emitted.append(log)
+    return emitted
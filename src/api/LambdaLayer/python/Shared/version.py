@@ -1 +1 @@
-VERWERKINGENLOGGING_API_VERSION = '0.9.0'
\ No newline at end of file
+VERWERKINGENLOGGING_API_VERSION = '0.10.0'
\ No newline at end of file
@@ -1,24 +1,186 @@
+import gzip
+import hashlib
 import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 from boto3.dynamodb.conditions import Key
+from Shared.indexes import addIndexAttributes
+from Shared.tracing import emitTraces, messageTrace, nowMs
+
+# DynamoDB limit for a single BatchWriteItem call
+batchWriteMaxItems = 25
+batchWriteMaxAttempts = int(os.getenv('BATCH_WRITE_MAX_ATTEMPTS', '5'))
+
+# Concurrent update_item calls for a PATCH, and the remaining Lambda time (ms)
+# at which a PATCH is checkpointed and continued in a new message (a quarter of the timeout, see QueueStack)
+patchMaxWorkers = int(os.getenv('PATCH_MAX_WORKERS', '16'))
+patchCheckpointMarginMs = int(os.getenv('PATCH_CHECKPOINT_MARGIN_MS', '30000'))
+
+# Dead-letter queue redrive: messages per process_message call, attempts (with backoff) within an invocation,
+# receives after which a message is quarantined and the remaining Lambda time (ms) at which the redrive stops
+redriveBatchSize = int(os.getenv('REDRIVE_BATCH_SIZE', '100'))
+redriveMaxAttempts = int(os.getenv('REDRIVE_MAX_ATTEMPTS', '3'))
+redriveMaxReceives = int(os.getenv('REDRIVE_MAX_RECEIVES', '10'))
+redriveTimeMarginMs = int(os.getenv('REDRIVE_TIME_MARGIN_MS', '60000'))
+redriveVisibilityTimeout = int(os.getenv('REDRIVE_VISIBILITY_TIMEOUT', '900'))
+
+# DynamoDB error codes of failures that succeed when retried later
+throttlingErrorCodes = ['ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded', 'InternalServerError']
+
+# Raised (recorded) for items that were still unprocessed by BatchWriteItem after the last attempt
+class UnprocessedItemError(Exception):
+    pass
 
 # Receives and processes the message. 
-# Trying to insert the message into the DynamoDB database.
-def process_message(event, table):
+# POST and PUT messages are written to the DynamoDB database in batches, PATCH messages one by one.
+# Raw event backups sent along with the messages ('queue' backup mode) are archived in S3.
+# Returns the messages that failed, so only those are redelivered by SQS (ReportBatchItemFailures).
+# If errors (dict) is given, the exception of each failed message is recorded in it by messageId.
+# Emits the spans (enqueue, queue dwell, write) of the traced messages, see Shared.tracing.
+def process_message(event, table, queue=None, remainingTime=None, bucket=None, errors=None):
     records = event.get('Records') # Get 'records' from queue message
+    processStarted = nowMs()
+    writeTime = [0.0] # seconds spent writing to DynamoDB
+
+    def timed(fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            writeTime[0] += time.perf_counter() - started
+
+    failedMessageIds = []
+    pendingWrites = [] # (messageId, item) tuples
+    backups = [] # (messageId, backup) tuples
+    backupsSent = [] # SentTimestamps of the messages with a backup
 
     for record in records:
-        body = json.loads(record.get('body'))
-        messageAttributes = record.get('messageAttributes')
+        messageId = record.get('messageId')
+        backup = (record.get('messageAttributes') or {}).get('backup')
+        if backup != None:
+            backups.append((messageId, backup.get('stringValue')))
+            sentTimestamp = (record.get('attributes') or {}).get('SentTimestamp')
+            if sentTimestamp != None:
+                backupsSent.append(int(sentTimestamp))
+        try:
+            body = json.loads(record.get('body'))
+            path = record.get('messageAttributes').get('path').get('stringValue')
 
-        if messageAttributes.get('path').get('stringValue') == 'POST':
-            post_verwerkings_acties(body, table)
-        
-        if messageAttributes.get('path').get('stringValue') == 'PATCH':
-            patch_verwerkings_acties(body, table)
+            if path == 'POST' or path == 'PUT':
+                # Batch requests send the POST messages of a verwerkingsactie as a single message (list)
+                for item in (body if isinstance(body, list) else [body]):
+                    pendingWrites.append((messageId, item))
 
-        if messageAttributes.get('path').get('stringValue') == 'PUT':
-            post_verwerkings_acties(body, table)
+            if path == 'PATCH':
+                # Write pending items first, the PATCH may apply to them
+                failedMessageIds.extend(timed(write_verwerkings_acties, pendingWrites, table, errors))
+                pendingWrites = []
+                timed(patch_verwerkings_acties, body, table, queue, remainingTime)
+        except Exception as e:
+            logging.error('Failed to process message ' + str(messageId) + ': ' + str(e))
+            failedMessageIds.append(messageId)
+            record_error(errors, messageId, e)
+
+    failedMessageIds.extend(timed(write_verwerkings_acties, pendingWrites, table, errors))
+    written = nowMs()
+
+    # A message is only done when its backup is archived, otherwise it is redelivered
+    if (len(backups) > 0):
+        try:
+            archive_backups(backups, bucket, min(backupsSent, default=None))
+        except Exception as e:
+            logging.error('Failed to archive backups: ' + str(e))
+            for messageId, _ in backups:
+                failedMessageIds.append(messageId)
+                record_error(errors, messageId, e)
+
+    failed = set(failedMessageIds)
+    traces = [messageTrace(record) for record in records if record.get('messageId') not in failed]
+    emitTraces([trace for trace in traces if trace is not None], processStarted, round(writeTime[0] * 1000, 2), written)
+
+    return {
+        'batchItemFailures': [{ 'itemIdentifier': messageId } for messageId in dict.fromkeys(failedMessageIds)]
+    }
+
+# Archive raw event backups ((messageId, backup) tuples) as a single gzipped JSONL object: one object per
+# processed batch of messages (invocation), not per time window. Objects are partitioned by the minute the first
+# message of the batch was sent (backups/yyyy/mm/dd/HH/MM/<hash>.jsonl.gz), so a minute can hold many objects.
+# Each line contains the backup key and raw event. backup_archive.py compacts them into the Parquet archive.
+# The name is derived from the messageIds, so a redelivered batch overwrites its archive instead of adding a copy.
+# Backups of messages that are redelivered in another batch are archived again, backup_archive.py skips those.
+def archive_backups(backups, bucket, sentTime=None):
+    moment = datetime.fromtimestamp(sentTime / 1000, timezone.utc) if sentTime != None else datetime.now(timezone.utc)
+    name = hashlib.sha256('\n'.join(sorted(messageId for messageId, _ in backups)).encode('UTF-8')).hexdigest()[:32]
+    key = moment.strftime('backups/%Y/%m/%d/%H/%M/') + name + '.jsonl.gz'
+    data = gzip.compress(('\n'.join(backup for _, backup in backups) + '\n').encode('UTF-8'))
+    bucket.put_object(
+        ContentType='application/x-ndjson',
+        ContentEncoding='gzip',
+        Key=key,
+        Body=data,
+    )
+    return key
+
+def record_error(errors, messageId, error):
+    if (errors != None):
+        errors.setdefault(messageId, error)
+
+# Write verwerkingsacties using BatchWriteItem in chunks of 25 items.
+# Returns the messageIds of the items that could not be written (with their exception in errors, if given).
+def write_verwerkings_acties(writes, table, errors=None):
+    # BatchWriteItem does not allow duplicate keys in one call, the last message for a key wins (as with put_item)
+    itemsByKey = {}
+    messageIdsByKey = {}
+    for messageId, item in writes:
+        key = (item.get('actieId'), item.get('compositeSortKey'))
+        itemsByKey[key] = addIndexAttributes(item)
+        messageIdsByKey.setdefault(key, []).append(messageId)
+
+    keys = list(itemsByKey.keys())
+    failedMessageIds = []
+    for start in range(0, len(keys), batchWriteMaxItems):
+        chunk = keys[start:start + batchWriteMaxItems]
+        try:
+            failedKeys = batch_write_items([itemsByKey[key] for key in chunk], table)
+        except Exception as e:
+            # The chunk is rejected as a whole (e.g. an invalid item), write the items one by one
+            # so only the poison message(s) are redelivered.
+            logging.error('Batch write failed, falling back to single writes: ' + str(e))
+            failedKeys = []
+            for key in chunk:
+                try:
+                    post_verwerkings_acties(itemsByKey[key], table)
+                except Exception as e:
+                    logging.error('Failed to write verwerkingsactie ' + str(key[0]) + ': ' + str(e))
+                    failedKeys.append(key)
+                    for messageId in messageIdsByKey[key]:
+                        record_error(errors, messageId, e)
+
+        for key in failedKeys:
+            failedMessageIds.extend(messageIdsByKey[key])
+            for messageId in messageIdsByKey[key]:
+                record_error(errors, messageId, UnprocessedItemError('Unprocessed item ' + str(key[0])))
+
+    return failedMessageIds
+
+# Write at most 25 items with BatchWriteItem, retrying UnprocessedItems with exponential backoff.
+# Returns the keys of the items that were still unprocessed after the last attempt.
+def batch_write_items(items, table):
+    requests = [{ 'PutRequest': { 'Item': item } } for item in items]
+
+    for attempt in range(batchWriteMaxAttempts):
+        if (attempt > 0):
+            time.sleep(0.05 * (2 ** attempt))
+        response = table.meta.client.batch_write_item(RequestItems={ table.name: requests })
+        requests = response.get('UnprocessedItems', {}).get(table.name, [])
+        if (len(requests) == 0):
+            return []
+
+    return [(request.get('PutRequest').get('Item').get('actieId'), request.get('PutRequest').get('Item').get('compositeSortKey')) for request in requests]
 
 
 # Post / Put verwerkingsacties
@@ -34,56 +196,77 @@ def post_verwerkings_acties(body, table):
         'headers': { "Content-Type": "application/json" }
     }
 
+# Build the update expression for the (optional) fields of a PATCH message
+def patch_update_expression(vertrouwelijkheid, bewaartermijn):
+    assignments = []
+    values = {}
+    if (vertrouwelijkheid != None):
+        assignments.append('vertrouwelijkheid= :vertrouwelijkheid')
+        values[':vertrouwelijkheid'] = vertrouwelijkheid
+    if (bewaartermijn != None):
+        assignments.append('bewaartermijn= :bewaartermijn')
+        values[':bewaartermijn'] = bewaartermijn
+
+    if (len(assignments) == 0):
+        return None, None
+    return 'SET ' + ', '.join(assignments), values
+
 # Patch verwerkingsacties
-def patch_verwerkings_acties(body, table):
+# Pages through the verwerkingId-index and applies the update to each page on a thread pool.
+# When the Lambda is about to time out, the position in the index (LastEvaluatedKey) is sent
+# as a checkpoint in a new PATCH message, so the PATCH resumes there instead of starting over.
+def patch_verwerkings_acties(body, table, queue=None, remainingTime=None):
     
     bodyJson = json.loads(body)
     verwerkingId = bodyJson.get('verwerkingId')
     vertrouwelijkheid = bodyJson.get('vertrouwelijkheid')
     bewaartermijn = bodyJson.get('bewaartermijn')
+    exclusiveStartKey = bodyJson.get('exclusiveStartKey') # checkpoint of an interrupted PATCH
 
-    verwerkingen = table.query(
-        IndexName='verwerkingId-index',
-        KeyConditionExpression=Key('verwerkingId').eq(verwerkingId)
-    )
-    response = []
-    for item in verwerkingen.get('Items'):
-        if (vertrouwelijkheid != None and bewaartermijn == None):
-            response.append(table.update_item(
-                Key={ 
-                    'actieId': item.get('actieId'),
-                    'compositeSortKey': item.get('compositeSortKey')
-                },
-                UpdateExpression="SET vertrouwelijkheid= :var1",
-                ExpressionAttributeValues={
-                    ':var1': vertrouwelijkheid
-                }
-            ))
-        if (vertrouwelijkheid == None and bewaartermijn != None):
-            response.append(table.update_item(
-                Key={ 
-                    'actieId': item.get('actieId'),
-                    'compositeSortKey': item.get('compositeSortKey')
-                },
-                UpdateExpression="SET bewaartermijn= :var1",
-                ExpressionAttributeValues={
-                    ':var1': bewaartermijn
-                }
-            ))
-        if (vertrouwelijkheid != None and bewaartermijn != None):
-            response.append(table.update_item(
-                Key={ 
-                    'actieId': item.get('actieId'),
-                    'compositeSortKey': item.get('compositeSortKey')
-                },
-                UpdateExpression="SET vertrouwelijkheid= :var1, bewaartermijn= :var2",
-                ExpressionAttributeValues={
-                    ':var1': vertrouwelijkheid,
-                    ':var2': bewaartermijn
-                }
-            ))
+    if (vertrouwelijkheid == None and bewaartermijn == None):
+        print('Nothing to patch!')
+        return {
+            'statusCode': 400,
+            'body': 'Nothing to patch!',
+            'headers': { "Content-Type": "text/plain" },
+            }
+
+    def update_item(item):
+        updateExpression, expressionAttributeValues = patch_update_expression(vertrouwelijkheid, bewaartermijn)
+        return table.update_item(
+            Key={ 
+                'actieId': item.get('actieId'),
+                'compositeSortKey': item.get('compositeSortKey')
+            },
+            UpdateExpression=updateExpression,
+            ExpressionAttributeValues=expressionAttributeValues
+        )
+
+    updated = 0
+    with ThreadPoolExecutor(max_workers=patchMaxWorkers) as executor:
+        while True:
+            queryArgs = {
+                'IndexName': 'verwerkingId-index',
+                'KeyConditionExpression': Key('verwerkingId').eq(verwerkingId),
+            }
+            if (exclusiveStartKey != None):
+                queryArgs['ExclusiveStartKey'] = exclusiveStartKey
+            verwerkingen = table.query(**queryArgs)
+
+            # list() to wait for the page to complete and raise any update error
+            updated += len(list(executor.map(update_item, verwerkingen.get('Items'))))
+
+            exclusiveStartKey = verwerkingen.get('LastEvaluatedKey')
+            if (exclusiveStartKey == None):
+                break
+
+            if (queue != None and remainingTime != None and remainingTime() < patchCheckpointMarginMs):
+                bodyJson.update({ 'exclusiveStartKey': exclusiveStartKey })
+                send_patch_checkpoint(bodyJson, queue)
+                print('PATCH checkpoint: ' + str(updated) + ' verwerkingsacties updated, continuing in new message')
+                break
         
-    if (response == []):
+    if (updated == 0 and bodyJson.get('exclusiveStartKey') == None):
         print('verwerkingId not found!')
         return {
             'statusCode': 400,
@@ -94,8 +277,150 @@ def patch_verwerkings_acties(body, table):
         print('Function completed!')
         return {
             'statusCode': 200,
-            'body': json.dumps(response),
+            'body': json.dumps({ 'verwerkingId': verwerkingId, 'updated': updated }),
             'headers': { "Content-Type": "application/json" },
         }
-    
 
+# Send the remainder of a PATCH as a new message (same format as the Gen lambda PATCH messages)
+def send_patch_checkpoint(bodyJson, queue):
+    queue.send_message(MessageBody=json.dumps(json.dumps(bodyJson)), MessageAttributes={
+        'path': {
+            'DataType': 'String',
+            'StringValue': 'PATCH'
+        }})
+
+# Classify the failure of a message: 'throttling' and 'retryable' messages are processed again,
+# 'validation' (rejected by DynamoDB) and 'poison' (unreadable) messages are quarantined.
+def classify_failure(error):
+    if (isinstance(error, UnprocessedItemError)):
+        return 'throttling'
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    if (code in throttlingErrorCodes):
+        return 'throttling'
+    if (code == 'ValidationException' or code == 'ConditionalCheckFailedException'):
+        return 'validation'
+    if (isinstance(error, (ValueError, KeyError, TypeError, AttributeError))):
+        return 'poison'
+    return 'retryable'
+
+# Convert a received SQS message (ReceiveMessage response) to the record format of the SQS lambda event
+def sqs_record(message):
+    return {
+        'messageId': message.get('MessageId'),
+        'receiptHandle': message.get('ReceiptHandle'),
+        'body': message.get('Body'),
+        'attributes': message.get('Attributes') or {},
+        'messageAttributes': {
+            name: { 'stringValue': attribute.get('StringValue'), 'dataType': attribute.get('DataType') }
+            for name, attribute in (message.get('MessageAttributes') or {}).items()
+        },
+    }
+
+# Receive at most redriveBatchSize messages from the dead-letter queue (10 per call)
+def receive_dead_letters(deadLetterQueue):
+    messages = []
+    while (len(messages) < redriveBatchSize):
+        received = deadLetterQueue.meta.client.receive_message(
+            QueueUrl=deadLetterQueue.url,
+            MaxNumberOfMessages=min(10, redriveBatchSize - len(messages)),
+            MessageAttributeNames=['All'],
+            AttributeNames=['ApproximateReceiveCount'],
+            VisibilityTimeout=redriveVisibilityTimeout,
+        ).get('Messages', [])
+        if (len(received) == 0):
+            break
+        messages.extend(received)
+    return [sqs_record(message) for message in messages]
+
+# Store a message that can not be processed in the quarantine/ prefix of the bucket
+def quarantine_message(record, reason, error, bucket):
+    data = {
+        'messageId': record.get('messageId'),
+        'reason': reason,
+        'error': str(error),
+        'receiveCount': record.get('attributes').get('ApproximateReceiveCount'),
+        'body': record.get('body'),
+        'messageAttributes': record.get('messageAttributes'),
+    }
+    bucket.put_object(
+        ContentType='application/json',
+        Key=datetime.now(timezone.utc).strftime('quarantine/%Y/%m/%d/') + record.get('messageId') + '.json',
+        Body=bytes(json.dumps(data).encode('UTF-8')),
+    )
+
+def delete_dead_letters(records, deadLetterQueue):
+    for start in range(0, len(records), 10):
+        deadLetterQueue.delete_messages(Entries=[{ 'Id': str(index), 'ReceiptHandle': record.get('receiptHandle') } for index, record in enumerate(records[start:start + 10])])
+
+# Leave the messages on the dead-letter queue, to be retried by a later redrive (exponential backoff on the receive count)
+def postpone_dead_letters(records, deadLetterQueue):
+    for start in range(0, len(records), 10):
+        deadLetterQueue.change_message_visibility_batch(Entries=[{
+            'Id': str(index),
+            'ReceiptHandle': record.get('receiptHandle'),
+            'VisibilityTimeout': min(43200, 60 * (2 ** min(10, int(record.get('attributes').get('ApproximateReceiveCount', '1'))))),
+        } for index, record in enumerate(records[start:start + 10])])
+
+# Process a batch of dead-lettered messages, retrying throttled and other retryable failures with backoff.
+# Processed and quarantined messages are deleted from the dead-letter queue. Returns the counts per outcome.
+def redrive_batch(records, deadLetterQueue, table, queue, bucket, remainingTime=None):
+    counts = { 'processed': 0, 'throttling': 0, 'retryable': 0, 'validation': 0, 'poison': 0 }
+    pending = records
+    for attempt in range(redriveMaxAttempts):
+        if (attempt > 0):
+            time.sleep(0.5 * (2 ** attempt))
+
+        errors = {}
+        response = process_message({ 'Records': pending }, table, queue, remainingTime, bucket, errors)
+        failedMessageIds = set(failure.get('itemIdentifier') for failure in response.get('batchItemFailures'))
+
+        processed = [record for record in pending if record.get('messageId') not in failedMessageIds]
+        delete_dead_letters(processed, deadLetterQueue)
+        counts['processed'] += len(processed)
+
+        retry = []
+        quarantined = []
+        for record in pending:
+            if (record.get('messageId') not in failedMessageIds):
+                continue
+            error = errors.get(record.get('messageId'))
+            reason = classify_failure(error)
+            if (reason == 'validation' or reason == 'poison'):
+                quarantine_message(record, reason, error, bucket)
+                quarantined.append(record)
+                counts[reason] += 1
+            else:
+                retry.append((record, reason, error))
+        delete_dead_letters(quarantined, deadLetterQueue)
+
+        pending = [record for record, _, _ in retry]
+        if (len(pending) == 0 or (remainingTime != None and remainingTime() < redriveTimeMarginMs)):
+            break
+
+    # Still failing: quarantine after too many receives, otherwise retry in a later redrive
+    postponed = []
+    exhausted = []
+    for record, reason, error in retry:
+        counts[reason] += 1
+        if (int(record.get('attributes').get('ApproximateReceiveCount', '1')) >= redriveMaxReceives):
+            quarantine_message(record, 'poison', error, bucket)
+            exhausted.append(record)
+        else:
+            postponed.append(record)
+    delete_dead_letters(exhausted, deadLetterQueue)
+    postpone_dead_letters(postponed, deadLetterQueue)
+
+    return counts
+
+# Redrive the dead-letter queue until it is empty (or the Lambda time is nearly up)
+def redrive_dead_letter_queue(deadLetterQueue, table, queue, bucket, remainingTime=None):
+    totals = { 'processed': 0, 'throttling': 0, 'retryable': 0, 'validation': 0, 'poison': 0 }
+    while (remainingTime == None or remainingTime() > redriveTimeMarginMs):
+        records = receive_dead_letters(deadLetterQueue)
+        if (len(records) == 0):
+            break
+        for outcome, count in redrive_batch(records, deadLetterQueue, table, queue, bucket, remainingTime).items():
+            totals[outcome] += count
+
+    print('REDRIVE: ' + json.dumps(totals))
+    return totals
@@ -1,18 +1,24 @@
+from Shared.clients import lazyBucket, lazyQueue, lazyTable, logColdStart
+from Shared.metrics import logMetrics
 import logging
 import os
-from Shared.responses import internalServerErrorResponse
-import boto3
 from handler import process_message
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['DYNAMO_TABLE_NAME'])
+# Clients are created on first use (and reused by warm invocations),
+# the queue and bucket are only needed for PATCH checkpoints and backups
+table = lazyTable(os.environ['DYNAMO_TABLE_NAME'])
+queue = lazyQueue(os.environ['SQS_URL'])
+bucket = lazyBucket(os.environ['S3_BACKUP_BUCKET_NAME'])
 debug = os.getenv('ENABLE_VERBOSE_AND_SENSITIVE_LOGGING', 'false') == 'true'
 
+@logColdStart
+@logMetrics('proc')
 def handler(event, context):
     if debug:
         print(event)
     try:
-        return process_message(event, table)
+        return process_message(event, table, queue, context.get_remaining_time_in_millis, bucket)
     except Exception as e:
         logging.error(e)
-        return internalServerErrorResponse()
\ No newline at end of file
+        # Raise, so the complete batch is retried by SQS
+        raise
@@ -0,0 +1,20 @@
+from Shared.clients import lazyBucket, lazyQueue, lazyTable, logColdStart
+from Shared.metrics import logMetrics
+import logging
+import os
+from handler import redrive_dead_letter_queue
+
+table = lazyTable(os.environ['DYNAMO_TABLE_NAME'])
+queue = lazyQueue(os.environ['SQS_URL'])
+deadLetterQueue = lazyQueue(os.environ['DLQ_URL'])
+bucket = lazyBucket(os.environ['S3_BACKUP_BUCKET_NAME'])
+
+# Scheduled: reprocess the messages on the dead-letter queue
+@logColdStart
+@logMetrics('redrive')
+def handler(event, context):
+    try:
+        return redrive_dead_letter_queue(deadLetterQueue, table, queue, bucket, context.get_remaining_time_in_millis)
+    except Exception as e:
+        logging.error(e)
+        raise
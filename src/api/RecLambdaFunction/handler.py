@@ -1,9 +1,12 @@
 from datetime import datetime
 import os
-from Shared.helpers import hashHelper, logApiCall
+from Shared.helpers import logApiCall, subjectObjectTypeSoortIds
+from Shared.indexes import verwerkingsactiesPage
+from Shared.pagination import parseLimit
 from Shared.responses import badRequestResponse, notFoundResponse, successResponse
 
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 
 debug = os.getenv('ENABLE_VERBOSE_AND_SENSITIVE_LOGGING', 'false') == 'true'
 
@@ -34,7 +37,7 @@ def validate_params(params):
     return params
 
 
-def handle_request(event, table):
+def handle_request(event, table, remainingTimeMs=None):
     params = parse_event(event)
 
     if (params['method'] == 'GET' and params.get('resource') == '/verwerkingsacties/{actieId}'):
@@ -43,7 +46,7 @@ def handle_request(event, table):
 
     if (params['method'] == 'GET' and params.get('resource') == '/verwerkingsacties'):
         logApiCall(params['method'], params.get('resource'))
-        return get_verwerkings_acties(event, table)
+        return get_verwerkings_acties(event, table, remainingTimeMs)
 
     if (params['method'] == 'DELETE' and params.get('resource') == '/verwerkingsacties/{actieId}'):
         logApiCall(params['method'], params.get('resource'))
@@ -71,77 +74,76 @@ def get_verwerkingsacties_actieid(event, table):
         return successResponse(msg)
 
 # Get verwerkingsacties based on given filter parameters
-def get_verwerkings_acties(event, table):
-    hashedObjectId = hashHelper(event.get('queryStringParameters').get('objectId'))
-    object_key = event.get('queryStringParameters').get('objectType') + event.get(
-        'queryStringParameters').get('soortObjectId') + hashedObjectId
-
-    attrs = None
-    if (event.get('queryStringParameters').get('beginDatum') != None or event.get('queryStringParameters').get('eindDatum') != None):
-        attrs = Attr("tijdstip").between(event.get('queryStringParameters').get(
-            'beginDatum'), event.get('queryStringParameters').get('eindDatum'))
-    if (event['queryStringParameters'].get('verwerkingsactiviteitId') != None):
-        if (attrs != None):
-            attrs &= Attr("verwerkingsactiviteitId").eq(
-                event.get('queryStringParameters').get('verwerkingsactiviteitId'))
-        else:
-            attrs = Attr("verwerkingsactiviteitId").eq(
-                event.get('queryStringParameters').get('verwerkingsactiviteitId'))
-    if (event['queryStringParameters'].get('vertrouwelijkheid') != None):
-        if (attrs != None):
-            attrs &= Attr("vertrouwelijkheid").eq(
-                event.get('queryStringParameters').get('vertrouwelijkheid'))
-        else:
-            attrs = Attr("vertrouwelijkheid").eq(
-                event.get('queryStringParameters').get('vertrouwelijkheid'))
-
-    if (attrs != None):
-        response = table.query(
-            IndexName='objectTypeSoortId-index',
-            KeyConditionExpression=Key('objectTypeSoortId').eq(object_key),
-            FilterExpression=attrs)
-    else:
-        response = table.query(
-            IndexName='objectTypeSoortId-index',
-            KeyConditionExpression=Key('objectTypeSoortId').eq(object_key))
+def get_verwerkings_acties(event, table, remainingTimeMs=None):
+    queryStringParameters = event.get('queryStringParameters')
+    # The canonical and (until the hash migration is done) legacy objectTypeSoortId of the subject
+    objectTypeSoortIds = subjectObjectTypeSoortIds(queryStringParameters.get('objectType'), queryStringParameters.get('soortObjectId'), queryStringParameters.get('objectId'))
+
+    try:
+        limit = parseLimit(event.get('queryStringParameters').get('limit'))
+        items, nextToken = verwerkingsactiesPage(table, limit, objectTypeSoortIds, queryStringParameters.get('nextToken'), remainingTimeMs,
+            beginDatum=queryStringParameters.get('beginDatum'),
+            eindDatum=queryStringParameters.get('eindDatum'),
+            verwerkingsactiviteitId=queryStringParameters.get('verwerkingsactiviteitId'),
+            vertrouwelijkheid=queryStringParameters.get('vertrouwelijkheid'),
+        )
+    except ValueError:
+        return badRequestResponse()
 
     # Remove objectTypeSoortId from return message
-    for item in response['Items']:
+    for item in items:
         item.pop('objectTypeSoortId')
 
-    return successResponse(response)
+    return successResponse({
+        'Items': items,
+        'Count': len(items),
+        'nextToken': nextToken,
+    })
 
 # Mark specific verwerkingsactie deleted based on actieId
+# Pages through the items of the actieId once and only updates the vervallen flag and
+# tijdstipRegistratie of each item, instead of rewriting the complete item.
+# Returns not found if the actieId has no items (left to update).
 def delete_verwerkingsacties_actieid(event, table):
-    response = table.query(
-        KeyConditionExpression=Key('actieId').eq(
-            event.get('pathParameters').get('actieId'))
-    )
-
-    for item in response.get('Items'):
-        if debug:
-            print(item) # TODO alternative implementation as described below
-
-    # TODO: Efficiency improvement --> another query not required. Data is already available using previous query.
-    for item in response.get('Items'):
-        response = table.query(
-            KeyConditionExpression=Key('actieId').eq(
-                item.get('actieId')) & Key('compositeSortKey').eq(item.get('compositeSortKey')),
-            ScanIndexForward=False,  # descending order
-            Limit=1  # top of list
-        )
-
-        # Get first (and only) item
-        item = response.get('Items')[0]
-
-        # Update tijdstipRegistratie and and vervallen flag
-        item.update({
-            'tijdstipRegistratie': datetime.now().isoformat(timespec='seconds'),
-            'vervallen': True
-        })
-
-        table.put_item(
-            Item=item
-        )
+    actieId = event.get('pathParameters').get('actieId')
+    tijdstipRegistratie = datetime.now().isoformat(timespec='seconds')
 
+    queryArgs = {
+        'KeyConditionExpression': Key('actieId').eq(actieId),
+        'ProjectionExpression': 'actieId, compositeSortKey',
+    }
+    updated = 0
+    while True:
+        response = table.query(**queryArgs)
+
+        for item in response.get('Items'):
+            if debug:
+                print(item)
+
+            # Update tijdstipRegistratie and vervallen flag (only if the item still exists)
+            try:
+                table.update_item(
+                    Key={
+                        'actieId': item.get('actieId'),
+                        'compositeSortKey': item.get('compositeSortKey')
+                    },
+                    UpdateExpression='SET vervallen= :vervallen, tijdstipRegistratie= :tijdstipRegistratie',
+                    ConditionExpression='attribute_exists(actieId)',
+                    ExpressionAttributeValues={
+                        ':vervallen': True,
+                        ':tijdstipRegistratie': tijdstipRegistratie
+                    }
+                )
+                updated += 1
+            except ClientError as error:
+                # Removed (expired) since the query, nothing left to update
+                if (error.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException'):
+                    raise
+
+        if (response.get('LastEvaluatedKey') == None):
+            break
+        queryArgs['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+
+    if (updated == 0):
+        return notFoundResponse()
     return successResponse()
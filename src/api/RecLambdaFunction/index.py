@@ -1,18 +1,21 @@
 import os
+from Shared.clients import lazyTable, logColdStart
+from Shared.metrics import logMetrics
 from Shared.responses import internalServerErrorResponse
-import boto3
 from handler import handle_request
 import logging
 
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table(os.environ['DYNAMO_TABLE_NAME'])
+# The client is created on first use (and reused by warm invocations)
+table = lazyTable(os.environ['DYNAMO_TABLE_NAME'])
 debug = os.getenv('ENABLE_VERBOSE_AND_SENSITIVE_LOGGING', 'false') == 'true'
 
+@logColdStart
+@logMetrics('rec')
 def handler(event, context):
     if debug:
         print(event)
     try:
-        return handle_request(event, table)
+        return handle_request(event, table, context.get_remaining_time_in_millis)
     except Exception as e:
         logging.error(e)
-        return internalServerErrorResponse()
\ No newline at end of file
+        return internalServerErrorResponse()
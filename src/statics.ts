@@ -42,6 +42,16 @@ export abstract class Statics {
    */
   static readonly verwerkingenTableIndex_objectTypeSoortId: string = 'objectTypeSoortId-index';
 
+  /**
+   * DynamoDB index name for objectTypeSoortId sorted by tijdstip (date range queries).
+   */
+  static readonly verwerkingenTableIndex_objectTypeSoortIdTijdstip: string = 'objectTypeSoortId-tijdstip-index';
+
+  /**
+   * DynamoDB (sparse) index name for objectTypeSoortId#verwerkingsactiviteitId sorted by tijdstip.
+   */
+  static readonly verwerkingenTableIndex_objectTypeSoortIdActiviteit: string = 'objectTypeSoortId-verwerkingsactiviteitId-index';
+
   /**
    * DynamoDB index name for verwerkingId.
    */
@@ -108,6 +118,11 @@ export abstract class Statics {
    */
   static readonly ssmName_dynamodbKmsKeyArn = '/cdk/verwerkingenlogging/dynamodb-key-arn';
 
+  /**
+   * ARN of the secret with the key of the v2 objectId hash scheme (HMAC)
+   */
+  static readonly ssmName_hashKeySecretArn = '/cdk/verwerkingenlogging/hash-key-secret-arn';
+
   /**
    * ARN of the log group for the Gen lambda
    */
@@ -123,6 +138,11 @@ export abstract class Statics {
    */
   static readonly ssmName_inzageLambdaLogGroupArn = '/cdk/verwerkingenlogging/inzage-lambda-loggroup-arn';
 
+  /**
+   * CloudWatch namespace of the (Embedded Metric Format) metrics of the lambdas, see Shared.metrics.
+   */
+  static readonly metricsNamespace: string = 'Verwerkingenlogging';
+
   // DNS Hosted zone ssm
   static readonly accountRootHostedZoneId: string = '/gemeente-nijmegen/account/hostedzone/id';
   static readonly accountRootHostedZoneName: string = '/gemeente-nijmegen/account/hostedzone/name';
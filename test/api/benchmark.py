@@ -0,0 +1,130 @@
+"""
+File: benchmark.py
+Description: Local benchmark harness for the verwerkingenlogging lambda handlers.
+
+Drives the Gen, Proc, Rec and Inzage handlers in the moto environment (environment.py) with synthetic
+workloads. Per handler/workload the p50/p99 latency, the number of boto calls per invocation and the
+peak memory are reported.
+
+Usage: python test/api/benchmark.py [--iterations 20] [--objects 1 10 50 200] [--history 500] [--table-api fast|resource] [--json report.json]
+"""
+#pylint: disable=wrong-import-position
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from aws_mock import mock_aws
+from environment import ACTIVITEITEN, Environment, get_event, post_event, seed_history, verwerkingsactie
+
+
+# Skewed (zipf like) citizen distribution: a few citizens are part of most verwerkingen
+class Citizens:
+
+    def __init__(self, count, skew=1.2, seed=42):
+        self.random = random.Random(seed)
+        self.ids = [str(100000000 + index) for index in range(count)]
+        self.weights = [1 / ((rank + 1) ** skew) for rank in range(count)]
+
+    def sample(self, count):
+        return self.random.choices(self.ids, weights=self.weights, k=count)
+
+    def popular(self):
+        return self.ids[0]
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+# Run fn for the given iterations and collect latency, boto calls and peak memory
+def measure(env, handler, workload, fn, iterations):
+    latencies = []
+    calls = Counter()
+    # The handlers log every API call, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            before = env.counter.snapshot()
+            start = time.perf_counter()
+            fn()
+            latencies.append((time.perf_counter() - start) * 1000)
+            calls.update(env.counter.snapshot() - before)
+
+        # Separate run for memory, tracemalloc slows down the measured latency
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'handler': handler,
+        'workload': workload,
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'boto_calls': {name: round(count / iterations, 2) for name, count in sorted(calls.items())},
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+def run(iterations=20, objectCounts=(1, 10, 50, 200), historySize=500, citizenCount=1000, tableApi='fast'):
+    results = []
+    with mock_aws():
+        env = Environment(tableApi)
+        citizens = Citizens(citizenCount)
+
+        for objectCount in objectCounts:
+            results.append(measure(env, 'gen', 'POST %d objects' % objectCount,
+                lambda: env.gen.handle_request(post_event(verwerkingsactie(citizens.sample(objectCount))), env.bucket, env.queue, env.handlerTable), iterations))
+
+            events = env.drain_queue()
+            pending = list(events)
+            results.append(measure(env, 'proc', 'process %d objects' % objectCount,
+                lambda: env.proc.process_message(pending.pop() if pending else events[0], env.handlerTable), max(1, min(iterations, len(events)))))
+
+        popular = citizens.popular()
+        seed_history(env, popular, historySize)
+        hashedObjectId = env.gen.objectId_check(verwerkingsactie([popular])).get('verwerkteObjecten')[0].get('objectId')
+        query = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': popular}
+        workloads = [
+            ('history', query),
+            ('history date range', dict(query, beginDatum='2023-03-01', eindDatum='2023-05-01')),
+            ('history activiteit', dict(query, verwerkingsactiviteitId=ACTIVITEITEN[1])),
+        ]
+        for name, parameters in workloads:
+            results.append(measure(env, 'rec', 'GET %s (%d items)' % (name, historySize),
+                lambda: env.rec.handle_request(get_event('/verwerkingsacties', parameters), env.handlerTable), iterations))
+            inzageParameters = dict(parameters, objectId=hashedObjectId)
+            results.append(measure(env, 'inzage', 'GET %s (%d items)' % (name, historySize),
+                lambda: env.inzage.handle_request(get_event('/verwerkte-objecten', inzageParameters), env.handlerTable), iterations))
+
+    return results
+
+def print_report(results):
+    print('%-8s %-40s %10s %10s %12s  %s' % ('handler', 'workload', 'p50 (ms)', 'p99 (ms)', 'memory (kb)', 'boto calls / invocation'))
+    for result in results:
+        calls = ', '.join(name + '=' + str(count) for name, count in result.get('boto_calls').items())
+        print('%-8s %-40s %10.2f %10.2f %12.1f  %s' % (result.get('handler'), result.get('workload'), result.get('p50_ms'), result.get('p99_ms'), result.get('peak_memory_kb'), calls))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the verwerkingenlogging lambda handlers')
+    parser.add_argument('--iterations', type=int, default=20, help='Invocations per workload')
+    parser.add_argument('--objects', type=int, nargs='+', default=[1, 10, 50, 200], help='Number of verwerkteObjecten per POST')
+    parser.add_argument('--history', type=int, default=500, help='Number of verwerkingsacties of the popular citizen')
+    parser.add_argument('--citizens', type=int, default=1000, help='Number of distinct citizens')
+    parser.add_argument('--table-api', choices=['fast', 'resource'], default='fast', help='Table passed to the handlers: Shared.dynamodb.FastTable or the boto3 resource Table')
+    parser.add_argument('--json', help='Write the report as json to this file')
+    args = parser.parse_args()
+
+    report = run(args.iterations, args.objects, args.history, args.citizens, args.table_api)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, indent=2)
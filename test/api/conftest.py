@@ -0,0 +1,19 @@
+"""
+File: conftest.py
+Description: The moto environment (environment.py) of the api tests, new for each test (env) or shared
+by the tests of a module that only read it (module_env)
+"""
+import pytest
+
+from aws_mock import mock_aws
+from environment import Environment
+
+
+@pytest.fixture
+def env(aws):
+    return Environment()
+
+@pytest.fixture(scope='module')
+def module_env():
+    with mock_aws():
+        yield Environment()
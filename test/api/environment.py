@@ -0,0 +1,174 @@
+"""
+File: environment.py
+Description: The AWS resources of the verwerkingenlogging lambdas in moto: the verwerkingen table (with all GSIs),
+the S3 backup bucket and the SQS queue, the lambda handlers and the request events they receive.
+Used by the api tests (conftest.py) and the benchmark (benchmark.py); the caller starts mock_aws.
+"""
+#pylint: disable=wrong-import-position
+import importlib.util
+import json
+import os
+import sys
+from collections import Counter
+
+# The test table has all indexes (INDEXES), including the staged objectTypeSoortId-verwerkingsactiviteitId-index
+os.environ.setdefault('ENABLE_ACTIVITEIT_INDEX', 'true')
+
+import boto3
+
+API_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../src/api')
+sys.path.append(os.path.join(API_DIR, 'LambdaLayer/python'))
+
+from Shared.dynamodb import FastTable
+from Shared.indexes import addIndexAttributes
+
+TABLE_NAME = 'verwerkingen-table-v4'
+BUCKET_NAME = 'verwerkingen-backup-bucket'
+QUEUE_NAME = 'verwerkingen-queue'
+
+# (indexName, partitionKey, sortKey), keep in sync with DatabaseStack
+INDEXES = [
+    ('objectTypeSoortId-index', 'objectTypeSoortId', None),
+    ('verwerkingId-index', 'verwerkingId', None),
+    ('verwerktObjectId-index', 'verwerktObjectId', None),
+    ('objectTypeSoortId-tijdstip-index', 'objectTypeSoortId', 'tijdstip'),
+    ('objectTypeSoortId-verwerkingsactiviteitId-index', 'objectTypeSoortIdActiviteit', 'tijdstip'),
+]
+
+ACTIVITEITEN = ['5f0bef4c-f66f-4311-84a5-19e8bf359eaf', 'c5b9f4e7-8c79-41b9-91e2-6268419cb167', '4b698de3-ffba-45e7-8697-a283ec863db2']
+
+
+# Each lambda has a handler.py, load them under a unique module name
+def load_handler(lambdaName):
+    spec = importlib.util.spec_from_file_location(lambdaName + '_handler', os.path.join(API_DIR, lambdaName, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def key_schema(partitionKey, sortKey=None):
+    schema = [{'AttributeName': partitionKey, 'KeyType': 'HASH'}]
+    if sortKey is not None:
+        schema.append({'AttributeName': sortKey, 'KeyType': 'RANGE'})
+    return schema
+
+# Counts all boto calls (per service and operation) made with the session
+class BotoCallCounter:
+
+    def __init__(self, session):
+        self.calls = Counter()
+        session.events.register('before-call.*.*', self._count)
+
+    def _count(self, model, **kwargs):
+        self.calls[model.service_model.service_name + '.' + model.name] += 1
+
+    def snapshot(self):
+        return Counter(self.calls)
+
+# The AWS resources used by the handlers, created in moto
+class Environment:
+
+    def __init__(self, tableApi='fast'):
+        session = boto3.Session()
+        self.counter = BotoCallCounter(session)
+        attributes = {'actieId', 'compositeSortKey'}
+        for _, partitionKey, sortKey in INDEXES:
+            attributes.update(name for name in (partitionKey, sortKey) if name is not None)
+
+        self.table = session.resource('dynamodb').create_table(
+            TableName=TABLE_NAME,
+            KeySchema=key_schema('actieId', 'compositeSortKey'),
+            AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in sorted(attributes)],
+            GlobalSecondaryIndexes=[{
+                'IndexName': indexName,
+                'KeySchema': key_schema(partitionKey, sortKey),
+                'Projection': {'ProjectionType': 'ALL'},
+            } for indexName, partitionKey, sortKey in INDEXES],
+            BillingMode='PAY_PER_REQUEST',
+        )
+        # The table passed to the handlers: low-level client (as in the lambdas) or the boto3 resource
+        self.handlerTable = FastTable(session.client('dynamodb'), TABLE_NAME) if tableApi == 'fast' else self.table
+        self.bucket = session.resource('s3').create_bucket(
+            Bucket=BUCKET_NAME,
+            CreateBucketConfiguration={'LocationConstraint': session.region_name},
+        )
+        self.queue = session.resource('sqs').create_queue(QueueName=QUEUE_NAME)
+
+        self.gen = load_handler('GenLambdaFunction')
+        self.proc = load_handler('ProcLambdaFunction')
+        self.rec = load_handler('RecLambdaFunction')
+        self.inzage = load_handler('InzageLambdaFunction')
+
+    # Receive all messages from the queue as SQS lambda events of at most 10 records
+    def drain_queue(self):
+        events = []
+        while True:
+            messages = self.queue.receive_messages(MaxNumberOfMessages=10, MessageAttributeNames=['All'], AttributeNames=['All'])
+            if len(messages) == 0:
+                return events
+            events.append({'Records': [sqs_record(message) for message in messages]})
+            self.queue.delete_messages(Entries=[{'Id': str(index), 'ReceiptHandle': message.receipt_handle} for index, message in enumerate(messages)])
+
+def sqs_record(message):
+    return {
+        'messageId': message.message_id,
+        'body': message.body,
+        'attributes': message.attributes,
+        'messageAttributes': {
+            name: {'stringValue': attribute.get('StringValue'), 'dataType': attribute.get('DataType')}
+            for name, attribute in (message.message_attributes or {}).items()
+        },
+    }
+
+def verwerkingsactie(objectIds, tijdstip='2024-04-05T14:35:42+01:00', activiteit=ACTIVITEITEN[0]):
+    return {
+        'actieNaam': 'Zoeken personen',
+        'handelingNaam': 'Intake',
+        'verwerkingId': '48086bf2-11b7-4603-9526-67d7c3bb6587',
+        'verwerkingNaam': 'Huishoudelijke ondersteuning',
+        'verwerkingsactiviteitId': activiteit,
+        'verwerkingsactiviteitUrl': 'https://verwerkingsactiviteiten-api.vng.cloud/api/v1/verwerkingsactiviteiten/' + activiteit,
+        'vertrouwelijkheid': 'normaal',
+        'bewaartermijn': 'P10Y',
+        'uitvoerder': '00000001821002193000',
+        'systeem': 'FooBarApp v2.1',
+        'gebruiker': '123456789',
+        'gegevensbron': 'FooBar Database Publiekszaken',
+        'tijdstip': tijdstip,
+        'verwerkteObjecten': [{
+            'objectType': 'persoon',
+            'soortObjectId': 'BSN',
+            'objectId': objectId,
+            'betrokkenheid': 'Getuige',
+            'verwerkteSoortenGegevens': [{'soortGegeven': 'BSN'}],
+        } for objectId in objectIds],
+    }
+
+def post_event(body):
+    return {
+        'httpMethod': 'POST',
+        'resource': '/verwerkingsacties',
+        'body': json.dumps(body),
+        'queryStringParameters': None,
+        'pathParameters': None,
+    }
+
+def get_event(resource, queryStringParameters=None, pathParameters=None):
+    return {
+        'httpMethod': 'GET',
+        'resource': resource,
+        'body': None,
+        'queryStringParameters': queryStringParameters,
+        'pathParameters': pathParameters,
+    }
+
+# Write a history of verwerkingsacties for a single citizen, directly into the table
+def seed_history(env, objectId, size):
+    with env.table.batch_writer() as batch:
+        for index in range(size):
+            body = verwerkingsactie([objectId], tijdstip='2023-%02d-%02dT12:00:00+01:00' % (index % 12 + 1, index % 28 + 1), activiteit=ACTIVITEITEN[index % len(ACTIVITEITEN)])
+            item = env.gen.objectId_check(body)
+            item = env.gen.verwerktObjectId_check(item, env.table)
+            actieId = 'history-%06d' % index
+            message = env.gen.generate_post_message(item.get('verwerkteObjecten')[0], item, actieId, 'https://example.com/' + actieId, '2023-01-01T00:00:00')
+            addIndexAttributes(message)
+            batch.put_item(Item=message)
@@ -0,0 +1,143 @@
+"""
+File: test_batch.py
+Description: POST /verwerkingsacties/batch returns a result (200, 400 or 500) for each verwerkingsactie,
+each verwerkingsactie is enqueued all-or-nothing
+"""
+import json
+
+from environment import verwerkingsactie
+
+
+def batch_event(body):
+    return {
+        'httpMethod': 'POST',
+        'resource': '/verwerkingsacties/batch',
+        'body': json.dumps(body),
+        'queryStringParameters': None,
+        'pathParameters': None,
+    }
+
+def post_batch(env, body):
+    response = env.gen.handle_request(batch_event(body), env.bucket, env.queue, env.table)
+    assert response['statusCode'] == 200
+    return json.loads(response['body'])['results']
+
+# The queued messages by actieId, a message per verwerkingsactie containing an item for each verwerktObject
+def queued(env):
+    messages = {}
+    for event in env.drain_queue():
+        for record in event['Records']:
+            items = json.loads(record['body'])
+            messages.setdefault(items[0]['actieId'], []).append(items)
+    return messages
+
+def test_results_per_verwerkingsactie(env):
+    results = post_batch(env, [verwerkingsactie(['111111111', '222222222']), {'invalid': True}, verwerkingsactie(['333333333'])])
+
+    assert [result['status'] for result in results] == [200, 400, 200]
+    assert [result['index'] for result in results] == [0, 1, 2]
+    for result in (results[0], results[2]):
+        assert result['url'].endswith('/verwerkingsacties/' + result['actieId'])
+
+    messages = queued(env)
+    assert len(messages[results[0]['actieId']]) == 1
+    assert len(messages[results[0]['actieId']][0]) == 2
+    assert len(messages[results[2]['actieId']][0]) == 1
+
+def test_processing_writes_all_items_of_a_verwerkingsactie(env):
+    results = post_batch(env, [verwerkingsactie(['111111111', '222222222', '333333333'])])
+    for event in env.drain_queue():
+        assert env.proc.process_message(event, env.handlerTable) == {'batchItemFailures': []}
+
+    items = env.table.scan()['Items']
+    assert len(items) == 3
+    assert {item['actieId'] for item in items} == {results[0]['actieId']}
+
+def test_failed_entries_are_500(env, monkeypatch):
+    sendMessages = env.queue.send_messages
+
+    # SQS fails the entry of the second verwerkingsactie
+    def send_messages(Entries):
+        response = sendMessages(Entries=[entry for entry in Entries if entry['Id'] != '1'])
+        failed = [{'Id': entry['Id'], 'SenderFault': True, 'Code': 'InvalidParameterValue'} for entry in Entries if entry['Id'] == '1']
+        return dict(response, Failed=response.get('Failed', []) + failed)
+
+    monkeypatch.setattr(env.queue, 'send_messages', send_messages)
+    results = post_batch(env, [verwerkingsactie(['111111111']), verwerkingsactie(['222222222', '333333333']), verwerkingsactie(['444444444'])])
+
+    assert [result['status'] for result in results] == [200, 500, 200]
+    assert 'actieId' not in results[1]
+    # Nothing of the failed verwerkingsactie is enqueued
+    assert set(queued(env).keys()) == {results[0]['actieId'], results[2]['actieId']}
+    # and a restore of the backup does not recreate it
+    assert stored_backup(env)['actieIds'] == [results[0]['actieId'], None, results[2]['actieId']]
+
+# SQS fails the entries of the verwerkingsacties with the given objectIds
+def failing_send(env, monkeypatch, objectIds):
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    sendMessages = env.queue.send_messages
+
+    def send_messages(Entries):
+        failed = [entry for entry in Entries if any(objectId in entry['MessageBody'] for objectId in objectIds)]
+        accepted = [entry for entry in Entries if entry not in failed]
+        response = sendMessages(Entries=accepted) if len(accepted) > 0 else {}
+        return dict(response, Failed=response.get('Failed', []) + [{'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError'} for entry in failed])
+
+    monkeypatch.setattr(env.queue, 'send_messages', send_messages)
+
+def stored_backup(env):
+    summaries = list(env.bucket.objects.filter(Prefix='batch/'))
+    assert len(summaries) == 1
+    return json.loads(summaries[0].get()['Body'].read())
+
+def hashed(env, objectId):
+    return env.gen.objectId_check(verwerkingsactie([objectId]))['verwerkteObjecten'][0]['objectId']
+
+# In queue backup mode the backup sent along with the first message only lists the enqueued verwerkingsacties
+def test_queue_backup_leaves_out_failed_entries(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'backupMode', 'queue')
+    failing_send(env, monkeypatch, [hashed(env, '222222222')])
+    results = post_batch(env, [verwerkingsactie(['111111111']), verwerkingsactie(['222222222']), verwerkingsactie(['333333333'])])
+
+    assert [result['status'] for result in results] == [200, 500, 200]
+    records = [record for event in env.drain_queue() for record in event['Records'] if 'backup' in record['messageAttributes']]
+    assert len(records) == 1
+    backup = json.loads(records[0]['messageAttributes']['backup']['stringValue'])['event']
+    assert backup['actieIds'] == [results[0]['actieId'], None, results[2]['actieId']]
+    assert sorted(backup['verwerktObjectIds'].keys()) == sorted('persoonBSN' + hashed(env, objectId) for objectId in ('111111111', '333333333'))
+    assert list(env.bucket.objects.all()) == []
+
+# When the first message (carrying the backup) is not enqueued, the backup is stored in S3 without it
+def test_queue_backup_of_failed_first_entry_is_stored(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'backupMode', 'queue')
+    failing_send(env, monkeypatch, [hashed(env, '111111111')])
+    results = post_batch(env, [verwerkingsactie(['111111111']), verwerkingsactie(['222222222'])])
+
+    assert [result['status'] for result in results] == [500, 200]
+    assert stored_backup(env)['actieIds'] == [None, results[1]['actieId']]
+
+def test_failed_calls_only_fail_their_batch(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    sendMessages = env.queue.send_messages
+    calls = []
+
+    # The second SendMessageBatch call fails as a whole
+    def send_messages(Entries):
+        calls.append(len(Entries))
+        if len(calls) == 2:
+            raise Exception('Read timeout')
+        return sendMessages(Entries=Entries)
+
+    monkeypatch.setattr(env.queue, 'send_messages', send_messages)
+    results = post_batch(env, [verwerkingsactie([str(100000000 + index)]) for index in range(12)])
+
+    assert calls == [10, 2]
+    assert [result['status'] for result in results] == [200] * 10 + [500] * 2
+    assert len(queued(env)) == 10
+
+def test_too_large_verwerkingsactie_is_400(env):
+    large = verwerkingsactie([str(100000000 + index) for index in range(300)])
+    results = post_batch(env, [large, verwerkingsactie(['111111111'])])
+
+    assert [result['status'] for result in results] == [400, 200]
+    assert set(queued(env).keys()) == {results[1]['actieId']}
@@ -0,0 +1,33 @@
+"""
+File: test_benchmark.py
+Description: Run a small benchmark workload and guard the number of boto calls per handler
+"""
+import pytest
+
+from benchmark import print_report, run
+
+
+@pytest.fixture(scope='module')
+def report():
+    results = run(iterations=2, objectCounts=(1, 20), historySize=30, citizenCount=50)
+    print_report(results)
+    return {(result['handler'], result['workload']): result for result in results}
+
+# The messages of a verwerkingsactie are sent as a single (list) message
+def test_post_sends_messages_in_batches(report):
+    calls = report[('gen', 'POST 20 objects')]['boto_calls']
+    assert calls['sqs.SendMessageBatch'] == 1
+    assert calls['s3.PutObject'] == 1
+    assert calls.get('dynamodb.Query', 0) <= 20
+
+# The messages of both POSTs (2 x 20 items) are received in a single event
+def test_process_writes_in_batches(report):
+    calls = report[('proc', 'process 20 objects')]['boto_calls']
+    assert calls['dynamodb.BatchWriteItem'] == 2
+    assert calls.get('dynamodb.PutItem', 0) == 0
+
+# A single query per partition of the subject: the canonical one and the legacy one (LEGACY_HASH_LOOKUP)
+@pytest.mark.parametrize('handler', ['rec', 'inzage'])
+@pytest.mark.parametrize('workload', ['GET history (30 items)', 'GET history date range (30 items)', 'GET history activiteit (30 items)'])
+def test_get_one_query_per_partition(report, handler, workload):
+    assert report[(handler, workload)]['boto_calls'] == {'dynamodb.Query': 2.0}
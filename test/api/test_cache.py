@@ -0,0 +1,147 @@
+"""
+File: test_cache.py
+Description: Shared.cache.LruTtlCache: LRU eviction, TTL expiry and thread safety, and the
+verwerktObjectId cache of the Gen lambda that is reused across (warm) invocations
+"""
+import json
+import threading
+
+import pytest
+
+from environment import post_event, verwerkingsactie
+from Shared import cache
+from Shared.cache import LruTtlCache
+
+OBJECT_IDS = ['111111111', '222222222', '333333333']
+
+
+# Clock of the cache (time.monotonic), moved forward by the tests
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+def test_lru_eviction():
+    lru = LruTtlCache(maxSize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    # Reading a makes b the least recently used entry
+    assert lru.get('a') == 1
+    lru.put('c', 3)
+
+    assert lru.get('b') is None
+    assert lru.get('a') == 1 and lru.get('c') == 3
+    assert len(lru) == 2
+    assert lru.stats()['evictions'] == 1
+
+def test_put_existing_key_refreshes_entry():
+    lru = LruTtlCache(maxSize=2)
+    lru.put('a', 1)
+    lru.put('b', 2)
+    lru.put('a', 10)
+    lru.put('c', 3)
+
+    assert lru.get('a') == 10
+    assert lru.get('b') is None
+
+def test_ttl_expiry(clock):
+    lru = LruTtlCache(maxSize=10, ttl=60)
+    lru.put('a', 1)
+    clock[0] += 59
+    assert lru.get('a') == 1
+
+    clock[0] += 2
+    assert lru.get('a', 'expired') == 'expired'
+    # Expired entries are removed on read
+    assert len(lru) == 0
+    assert lru.stats()['hits'] == 1 and lru.stats()['misses'] == 1
+
+def test_disabled_cache():
+    lru = LruTtlCache(maxSize=0)
+    lru.put('a', 1)
+    assert lru.get('a') is None and len(lru) == 0
+
+def test_stats():
+    lru = LruTtlCache(maxSize=10)
+    assert lru.stats()['hitRate'] == 0.0
+    lru.put('a', 1)
+    lru.get('a')
+    lru.get('b')
+    assert lru.stats() == {'size': 1, 'maxSize': 10, 'hits': 1, 'misses': 1, 'evictions': 0, 'hitRate': 0.5}
+
+def test_thread_safety():
+    lru = LruTtlCache(maxSize=100)
+    threadCount = 8
+    operations = 2000
+    barrier = threading.Barrier(threadCount)
+    errors = []
+
+    def worker(number):
+        try:
+            barrier.wait()
+            for index in range(operations):
+                key = (number * operations + index) % 300
+                lru.put(key, key)
+                value = lru.get(key)
+                assert value is None or value == key
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(threadCount)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(lru) == 100
+    stats = lru.stats()
+    assert stats['hits'] + stats['misses'] == threadCount * operations
+
+# Table counting the queries on the objectTypeSoortId-index (verwerktObjectId lookups)
+class LookupCountingTable:
+
+    def __init__(self, table):
+        self.table = table
+        self.lookups = 0
+
+    def query(self, **queryArgs):
+        if queryArgs.get('IndexName') == 'objectTypeSoortId-index':
+            self.lookups += 1
+        return self.table.query(**queryArgs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+def post(env, table):
+    env.gen.handle_request(post_event(verwerkingsactie(OBJECT_IDS)), env.bucket, env.queue, table)
+    events = env.drain_queue()
+    for event in events:
+        env.proc.process_message(event, env.handlerTable)
+    verwerktObjectIds = {}
+    for event in events:
+        for record in event['Records']:
+            for message in json.loads(record['body']):
+                for verwerktObject in message['verwerkteObjecten']:
+                    verwerktObjectIds[verwerktObject['objectId']] = verwerktObject['verwerktObjectId']
+    return verwerktObjectIds
+
+def test_verwerkt_object_ids_are_reused_across_invocations(env, clock):
+    table = LookupCountingTable(env.handlerTable)
+
+    # New objects: looked up with their key and their legacy key (LEGACY_HASH_LOOKUP)
+    first = post(env, table)
+    assert len(first) == len(OBJECT_IDS)
+    lookups = table.lookups
+    assert lookups == 2 * len(OBJECT_IDS)
+
+    # The next (warm) invocation gets the ids from the cache, without lookups
+    assert post(env, table) == first
+    assert table.lookups == lookups
+    assert env.gen.verwerktObjectIdCache.stats()['hits'] >= len(OBJECT_IDS)
+
+    # Once expired, the ids are looked up (and found) in the table again
+    clock[0] += env.gen.verwerktObjectIdCache.ttl + 1
+    assert post(env, table) == first
+    assert table.lookups == lookups + len(OBJECT_IDS)
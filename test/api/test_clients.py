@@ -0,0 +1,82 @@
+"""
+File: test_clients.py
+Description: Shared.clients: clients created on first use and shared by warm invocations, and the cold start log
+"""
+import json
+
+import pytest
+
+from environment import TABLE_NAME, post_event, verwerkingsactie
+from Shared import clients
+
+
+@pytest.fixture
+def fresh(env, monkeypatch):
+    monkeypatch.setattr(clients, '_clients', {})
+    monkeypatch.setattr(clients, '_resources', {})
+    monkeypatch.setattr(clients, '_creationTimes', {})
+    return env
+
+def test_lazy_proxies_create_clients_on_first_use(fresh):
+    table = clients.lazyTable(TABLE_NAME)
+    bucket = clients.lazyBucket(fresh.bucket.name)
+    queue = clients.lazyQueue(fresh.queue.url)
+    assert clients._clients == {} and clients._resources == {}
+
+    assert table.name == TABLE_NAME
+    assert list(clients._clients.keys()) == ['dynamodb']
+    assert queue.url == fresh.queue.url
+    assert bucket.name == fresh.bucket.name
+    # S3 and SQS are low-level clients as well, no resource models are loaded
+    assert sorted(clients._clients.keys()) == ['dynamodb', 's3', 'sqs']
+    assert clients._resources == {}
+    assert sorted(clients._creationTimes.keys()) == ['dynamodb', 's3', 'sqs']
+
+    # Later (warm) invocations reuse the instances
+    dynamodb = clients.client('dynamodb')
+    assert table._client is dynamodb
+    assert clients.lazyTable(TABLE_NAME)._client is dynamodb
+
+# The handlers run on the client backed bucket and queue as they do on the boto3 resources
+def test_handlers_use_client_bucket_and_queue(fresh):
+    bucket = clients.lazyBucket(fresh.bucket.name)
+    queue = clients.lazyQueue(fresh.queue.url)
+    response = fresh.gen.handle_request(post_event(verwerkingsactie(['111111111', '222222222'])), bucket, queue, fresh.table)
+    actieId = json.loads(response['body'])['actieId']
+
+    records = [record for event in fresh.drain_queue() for record in event['Records']]
+    assert [item['actieId'] for record in records for item in json.loads(record['body'])] == [actieId] * 2
+    if fresh.gen.backupMode == 'sync':
+        assert json.loads(fresh.bucket.Object(actieId).get()['Body'].read())['verwerktObjectIds'] != {}
+
+def test_client_of_resource_is_shared(fresh):
+    sqs = clients.resource('sqs')
+    assert clients.client('sqs') is sqs.meta.client
+    assert 'sqs' not in clients._clients
+
+def test_cold_start_is_logged_once(fresh, capsys, monkeypatch):
+    monkeypatch.setattr(clients, 'initStarted', clients.time.perf_counter())
+
+    @clients.logColdStart
+    def handler(event, context):
+        clients.client('dynamodb')
+        return event
+
+    assert handler('first', None) == 'first'
+    assert handler('second', None) == 'second'
+
+    logs = [line for line in capsys.readouterr().out.splitlines() if line.startswith('COLD START: ')]
+    assert len(logs) == 1
+    log = json.loads(logs[0][len('COLD START: '):])
+    assert log['init'] >= 0 and log['firstInvocation'] >= 0
+    assert list(log['clients'].keys()) == ['dynamodb']
+
+def test_cold_start_is_logged_when_the_handler_fails(capsys):
+
+    @clients.logColdStart
+    def handler(event, context):
+        raise ValueError('failed')
+
+    with pytest.raises(ValueError):
+        handler({}, None)
+    assert 'COLD START: ' in capsys.readouterr().out
@@ -0,0 +1,107 @@
+"""
+File: test_delete.py
+Description: DELETE /verwerkingsacties/{actieId} marks all items of the actieId vervallen,
+page by page with a conditional update, and is not found for unknown actieIds
+"""
+import pytest
+from botocore.exceptions import ClientError
+
+from environment import post_event, verwerkingsactie
+
+OBJECT_IDS = ['111111111', '222222222', '333333333', '444444444', '555555555']
+
+
+@pytest.fixture
+def env(env):
+    env.gen.handle_request(post_event(verwerkingsactie(OBJECT_IDS)), env.bucket, env.queue, env.table)
+    for event in env.drain_queue():
+        env.proc.process_message(event, env.handlerTable)
+    return env
+
+# Table returning query results in pages of pageSize items, so a DELETE spans several pages
+class PagedTable:
+
+    def __init__(self, table, pageSize):
+        self.table = table
+        self.pageSize = pageSize
+        self.queries = []
+
+    def query(self, **queryArgs):
+        self.queries.append(queryArgs)
+        return self.table.query(Limit=self.pageSize, **queryArgs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+def delete_event(actieId):
+    return {
+        'httpMethod': 'DELETE',
+        'resource': '/verwerkingsacties/{actieId}',
+        'body': None,
+        'queryStringParameters': None,
+        'pathParameters': {'actieId': actieId},
+    }
+
+def actie_id(env):
+    return env.table.scan()['Items'][0]['actieId']
+
+def test_delete_marks_all_pages_vervallen(env):
+    table = PagedTable(env.handlerTable, 2)
+    response = env.rec.handle_request(delete_event(actie_id(env)), table)
+
+    assert response['statusCode'] == 200
+    assert response['body'] == ''
+    assert response['headers']['Content-Type'] == 'application/json'
+    assert len(table.queries) == 3
+    assert table.queries[1]['ExclusiveStartKey'] is not None
+
+    items = env.table.scan()['Items']
+    assert len(items) == len(OBJECT_IDS)
+    assert all(item['vervallen'] is True for item in items)
+    assert len(set(item['tijdstipRegistratie'] for item in items)) == 1
+    # Only the flag and tijdstipRegistratie are updated
+    assert all(item['verwerkingId'] == '48086bf2-11b7-4603-9526-67d7c3bb6587' for item in items)
+
+def test_delete_unknown_actie_is_not_found(env):
+    response = env.rec.handle_request(delete_event('unknown'), env.handlerTable)
+
+    assert response['statusCode'] == 404
+    assert not any(item.get('vervallen') for item in env.table.scan()['Items'])
+
+# Items removed between the query and the update are skipped (conditional update)
+def test_delete_skips_removed_items(env):
+    items = env.table.scan()['Items']
+    removed = items[0]
+    table = PagedTable(env.handlerTable, 10)
+    query = table.query
+    def queryThenRemove(**queryArgs):
+        response = query(**queryArgs)
+        env.table.delete_item(Key={'actieId': removed['actieId'], 'compositeSortKey': removed['compositeSortKey']})
+        return response
+    table.query = queryThenRemove
+
+    assert env.rec.handle_request(delete_event(removed['actieId']), table)['statusCode'] == 200
+    remaining = env.table.scan()['Items']
+    assert len(remaining) == len(OBJECT_IDS) - 1
+    assert all(item['vervallen'] is True for item in remaining)
+
+def test_delete_of_removed_items_is_not_found(env):
+    actieId = actie_id(env)
+    table = PagedTable(env.handlerTable, 10)
+    query = table.query
+    def queryThenRemove(**queryArgs):
+        response = query(**queryArgs)
+        for item in response['Items']:
+            env.table.delete_item(Key={'actieId': item['actieId'], 'compositeSortKey': item['compositeSortKey']})
+        return response
+    table.query = queryThenRemove
+
+    assert env.rec.handle_request(delete_event(actieId), table)['statusCode'] == 404
+
+def test_delete_fails_on_other_errors(env):
+    class FailingTable(PagedTable):
+        def update_item(self, **updateArgs):
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Throttled'}}, 'UpdateItem')
+
+    with pytest.raises(ClientError):
+        env.rec.handle_request(delete_event(actie_id(env)), FailingTable(env.handlerTable, 10))
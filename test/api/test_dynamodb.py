@@ -0,0 +1,61 @@
+"""
+File: test_dynamodb.py
+Description: Shared.dynamodb: (de)serialization and the FastTable against the boto3 resource Table
+"""
+import json
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeSerializer
+
+from environment import seed_history
+from Shared.dynamodb import deserializeItem, serializeItem
+
+ITEM = {
+    'actieId': 'actie',
+    'compositeSortKey': 'persoonBSNhash#2024-01-01T00:00:00',
+    'bewaartermijn': 10,
+    'score': 0.5,
+    'vervallen': True,
+    'gebruiker': None,
+    'verwerkteObjecten': [{'objectType': 'persoon', 'verwerkteSoortenGegevens': [{'soortGegeven': 'BSN'}]}],
+}
+
+def test_serialization_matches_boto3():
+    serializer = TypeSerializer()
+    typed = {name: serializer.serialize(Decimal(str(value)) if isinstance(value, float) else value) for name, value in ITEM.items()}
+    assert serializeItem(ITEM) == typed
+    assert deserializeItem(typed) == ITEM
+
+@pytest.fixture(scope='module')
+def env(module_env):
+    seed_history(module_env, '999999999', 20)
+    return module_env
+
+def test_fast_table_query(env):
+    queryArgs = {
+        'IndexName': 'objectTypeSoortId-tijdstip-index',
+        'KeyConditionExpression': Key('objectTypeSoortId').eq(env.table.scan(Limit=1)['Items'][0]['objectTypeSoortId']) & Key('tijdstip').gte('2023-06'),
+        'FilterExpression': Attr('vertrouwelijkheid').eq('normaal'),
+    }
+    expected = env.table.query(**queryArgs)
+    response = env.handlerTable.query(**queryArgs)
+
+    assert response['Count'] == expected['Count'] > 0
+    assert response['Items'] == expected['Items']
+    json.dumps(response['Items']) # no Decimals
+
+def test_fast_table_write(env):
+    env.handlerTable.put_item(Item=ITEM)
+    env.handlerTable.update_item(
+        Key={'actieId': 'actie', 'compositeSortKey': ITEM['compositeSortKey']},
+        UpdateExpression='SET bewaartermijn= :bewaartermijn',
+        ExpressionAttributeValues={':bewaartermijn': 20},
+        ConditionExpression='attribute_exists(actieId)',
+    )
+    env.handlerTable.meta.client.batch_write_item(RequestItems={env.handlerTable.name: [{'PutRequest': {'Item': dict(ITEM, actieId='actie-2')}}]})
+
+    item = env.handlerTable.get_item(Key={'actieId': 'actie', 'compositeSortKey': ITEM['compositeSortKey']})['Item']
+    assert item == dict(ITEM, bewaartermijn=20)
+    assert env.handlerTable.get_item(Key={'actieId': 'actie-2', 'compositeSortKey': ITEM['compositeSortKey']})['Item'] == dict(ITEM, actieId='actie-2')
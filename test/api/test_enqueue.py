@@ -0,0 +1,118 @@
+"""
+File: test_enqueue.py
+Description: POST and PUT /verwerkingsacties send the messages of a verwerkingsactie as list messages,
+all-or-nothing: a failed request has enqueued nothing, so it can be retried without duplicates
+"""
+import json
+
+import pytest
+
+from environment import post_event, verwerkingsactie
+
+LARGE = [str(100000000 + index) for index in range(300)]
+
+
+def queued_items(env):
+    return [item for event in env.drain_queue() for record in event['Records'] for item in json.loads(record['body'])]
+
+def put_event(actieId, body):
+    return {
+        'httpMethod': 'PUT',
+        'resource': '/verwerkingsacties/{actieId}',
+        'body': json.dumps(body),
+        'queryStringParameters': None,
+        'pathParameters': {'actieId': actieId},
+    }
+
+# SQS fails the entries for which fail(attempt, entry) is true
+def failing_send(env, monkeypatch, fail):
+    sendMessages = env.queue.send_messages
+    attempts = []
+
+    def send_messages(Entries):
+        attempts.append(len(Entries))
+        failed = [entry for entry in Entries if fail(len(attempts), entry)]
+        accepted = [entry for entry in Entries if entry not in failed]
+        response = sendMessages(Entries=accepted) if len(accepted) > 0 else {}
+        return dict(response, Failed=response.get('Failed', []) + [{'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError'} for entry in failed])
+
+    monkeypatch.setattr(env.queue, 'send_messages', send_messages)
+    return attempts
+
+def test_post_is_a_single_list_message(env):
+    response = env.gen.handle_request(post_event(verwerkingsactie(['111111111', '222222222', '333333333'])), env.bucket, env.queue, env.table)
+    actieId = json.loads(response['body'])['actieId']
+
+    events = env.drain_queue()
+    records = [record for event in events for record in event['Records']]
+    assert len(records) == 1
+    assert [item['actieId'] for item in json.loads(records[0]['body'])] == [actieId] * 3
+
+def test_failed_post_enqueues_nothing(env, monkeypatch):
+    failing_send(env, monkeypatch, lambda attempt, entry: True)
+
+    with pytest.raises(Exception, match='Failed to enqueue'):
+        env.gen.handle_request(post_event(verwerkingsactie(['111111111', '222222222'])), env.bucket, env.queue, env.table)
+    assert queued_items(env) == []
+
+def test_large_verwerkingsactie_is_split_over_list_messages(env):
+    messages = env.gen.verwerkingsactie_messages([{'objectId': objectId, 'padding': 'x' * 2000} for objectId in LARGE])
+    assert len(messages) > 1
+    assert [msg['objectId'] for message in messages for msg in message] == LARGE
+    assert all(len(json.dumps(message).encode('UTF-8')) + env.gen.sqsAttributesMaxBytes <= env.gen.sqsBatchMaxBytes for message in messages)
+
+# The messages that were not accepted are sent again, until all messages are enqueued
+def test_split_verwerkingsactie_retries_failed_messages(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    attempts = failing_send(env, monkeypatch, lambda attempt, entry: attempt == 1 and entry['Id'] == '0')
+
+    response = env.gen.handle_request(post_event(verwerkingsactie(LARGE)), env.bucket, env.queue, env.table)
+    assert response['statusCode'] == 200
+    # The list messages are sent in calls of at most 256 KB, only the failed first message is sent again
+    assert attempts[-1] == 1 and len(attempts) > 2
+    items = queued_items(env)
+    assert len(items) == len(LARGE)
+    assert len({item['compositeSortKey'] for item in items}) == len(LARGE)
+
+# Messages that are still not accepted after the last round do not fail the request, the others are enqueued
+def test_split_verwerkingsactie_partly_enqueued(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    failing_send(env, monkeypatch, lambda attempt, entry: entry['Id'] == '0')
+
+    msgs = [{'actieId': 'actie-1', 'objectId': objectId, 'padding': 'x' * 2000} for objectId in LARGE]
+    messages = env.gen.verwerkingsactie_messages(msgs)
+    assert env.gen.enqueue_verwerkingsactie(msgs, env.queue, 'POST', env.bucket) == 1
+    assert len(queued_items(env)) == len(LARGE) - len(messages[0])
+
+def test_put_is_a_single_list_message_with_its_backup(env):
+    body = dict(verwerkingsactie(['111111111', '222222222']), actieId='actie-1')
+    response = env.gen.handle_request(put_event('actie-1', body), env.bucket, env.queue, env.table)
+    assert response['statusCode'] == 200
+
+    items = queued_items(env)
+    assert [item['actieId'] for item in items] == ['actie-1'] * 2
+    assert len({item['objectTypeSoortId'] for item in items}) == 2
+    # The backup of a PUT is the list of its messages
+    backup = json.loads(env.bucket.Object('actie-1').get()['Body'].read())
+    assert backup == items
+
+# In queue backup mode the backup is sent along with the first message, when only that one is not enqueued
+# the backup is stored in S3 instead
+def test_backup_is_stored_when_the_first_message_is_not_enqueued(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'backupMode', 'queue')
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    failing_send(env, monkeypatch, lambda attempt, entry: entry['Id'] == '0')
+
+    msgs = [{'actieId': 'actie-1', 'objectId': objectId, 'padding': 'x' * 2000} for objectId in LARGE]
+    event = post_event(verwerkingsactie(['111111111']))
+    assert env.gen.enqueue_verwerkingsactie(msgs, env.queue, 'POST', env.bucket, ('actie-1', event)) == 1
+    assert json.loads(env.bucket.Object('actie-1').get()['Body'].read()) == event
+
+def test_backup_is_not_stored_when_the_first_message_is_enqueued(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'backupMode', 'queue')
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    failing_send(env, monkeypatch, lambda attempt, entry: LARGE[-1] in entry['MessageBody'])
+
+    msgs = [{'actieId': 'actie-1', 'objectId': objectId, 'padding': 'x' * 2000} for objectId in LARGE]
+    assert env.gen.enqueue_verwerkingsactie(msgs, env.queue, 'POST', env.bucket, ('actie-1', post_event(verwerkingsactie(['111111111'])))) == 1
+    assert [summary.key for summary in env.bucket.objects.all()] == []
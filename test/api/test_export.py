@@ -0,0 +1,111 @@
+"""
+File: test_export.py
+Description: GET /verwerkte-objecten/export streams the verwerkingsacties as NDJSON to S3
+"""
+import json
+from urllib.parse import parse_qs, urlparse
+
+import boto3
+import pytest
+
+from environment import get_event, seed_history
+
+PARAMETERS = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '999999999'}
+
+@pytest.fixture(scope='module')
+def env(module_env):
+    module_env.exportBucket = boto3.resource('s3').create_bucket(
+        Bucket='verwerkingen-export-bucket', CreateBucketConfiguration={'LocationConstraint': module_env.bucket.meta.client.meta.region_name})
+    seed_history(module_env, PARAMETERS['objectId'], 50)
+    return module_env
+
+def export(env):
+    hashedObjectId = env.gen.objectId_check({'verwerkteObjecten': [dict(PARAMETERS)]})['verwerkteObjecten'][0]['objectId']
+    event = get_event('/verwerkte-objecten/export', dict(PARAMETERS, objectId=hashedObjectId))
+    response = env.inzage.handle_request(event, env.handlerTable, env.exportBucket)
+    assert response['statusCode'] == 200
+
+    body = json.loads(response['body'])
+    data = env.exportBucket.Object(body['exportId']).get()['Body'].read().decode('UTF-8')
+    lines = [json.loads(line) for line in data.splitlines()]
+    assert body['Count'] == len(lines) == 50
+    assert body['url'].startswith('https://')
+    assert all('objectTypeSoortId' not in line for line in lines)
+    return lines
+
+def test_export_single_object(env):
+    export(env)
+
+def exports(env):
+    objects = [summary.key for summary in env.exportBucket.objects.filter(Prefix='exports/')]
+    uploads = env.exportBucket.meta.client.list_multipart_uploads(Bucket=env.exportBucket.name).get('Uploads', [])
+    return objects, uploads
+
+def export_event(env):
+    hashedObjectId = env.gen.objectId_check({'verwerkteObjecten': [dict(PARAMETERS)]})['verwerkteObjecten'][0]['objectId']
+    return get_event('/verwerkte-objecten/export', dict(PARAMETERS, objectId=hashedObjectId))
+
+# Record the multipart uploads that are aborted
+def record_aborts(env, monkeypatch):
+    aborted = []
+    abort = env.inzage.ExportUpload.abort
+    def recordingAbort(upload):
+        aborted.append(upload.uploadId is not None)
+        abort(upload)
+    monkeypatch.setattr(env.inzage.ExportUpload, 'abort', recordingAbort)
+    return aborted
+
+def test_export_aborted_when_time_runs_out(env, monkeypatch):
+    before = exports(env)
+    aborted = record_aborts(env, monkeypatch)
+    # Small parts, so the multipart upload is started before the time runs out
+    monkeypatch.setattr(env.inzage, 'exportPartSize', 1024)
+    monkeypatch.setattr(env.inzage, 'exportTimeMarginMs', 5000)
+    remaining = iter(range(30000, 0, -1000))
+
+    response = env.inzage.handle_request(export_event(env), env.handlerTable, env.exportBucket, lambda: next(remaining))
+    assert response['statusCode'] == 422
+    assert aborted == [True]
+    assert exports(env) == before
+
+def test_export_aborted_on_failure(env, monkeypatch):
+    before = exports(env)
+    aborted = record_aborts(env, monkeypatch)
+    monkeypatch.setattr(env.inzage, 'exportPartSize', 1024)
+    def failingQueryItems(table, **queryArgs):
+        items = env.table.scan()['Items']
+        yield from items[:20]
+        raise Exception('Query failed')
+    monkeypatch.setattr(env.inzage, 'queryItems', failingQueryItems)
+
+    with pytest.raises(Exception, match='Query failed'):
+        env.inzage.handle_request(export_event(env), env.handlerTable, env.exportBucket, lambda: 30000)
+    assert aborted == [True]
+    assert exports(env) == before
+
+def test_export_url_signed_with_signing_role(env, monkeypatch):
+    role = boto3.client('iam').create_role(RoleName='inzage-export-signing-role', AssumeRolePolicyDocument='{}')['Role']
+    monkeypatch.setattr(env.inzage, 'exportSigningRoleArn', role['Arn'])
+    monkeypatch.setattr(env.inzage, 'exportUrlExpiresIn', 1800)
+
+    response = env.inzage.handle_request(export_event(env), env.handlerTable, env.exportBucket)
+    body = json.loads(response['body'])
+    query = parse_qs(urlparse(body['url']).query)
+    assert 0 < body['expiresIn'] <= 1800
+    assert query['X-Amz-Expires'] == [str(body['expiresIn'])]
+    assert 'X-Amz-Security-Token' in query
+    # Signed with the credentials of the role, not those of the Lambda
+    credentials = boto3.session.Session().get_credentials()
+    assert not query['X-Amz-Credential'][0].startswith(credentials.access_key + '/')
+
+def test_export_multipart(env, monkeypatch):
+    expected = export(env)
+    monkeypatch.setattr(env.inzage, 'exportPartSize', 5 * 1024 * 1024)
+    # Parts must be at least 5 MiB, so pad the lines of the seeded history
+    for item in env.table.scan()['Items']:
+        env.table.update_item(
+            Key={'actieId': item['actieId'], 'compositeSortKey': item['compositeSortKey']},
+            UpdateExpression='SET opmerking = :opmerking',
+            ExpressionAttributeValues={':opmerking': 'x' * 200 * 1024})
+    lines = export(env)
+    assert [line['actieId'] for line in lines] == [line['actieId'] for line in expected]
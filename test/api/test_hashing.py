@@ -0,0 +1,194 @@
+"""
+File: test_hashing.py
+Description: Shared.hashing: memoized, batched and versioned objectId hashing, and the migration
+of existing items to the prefixed hash format
+"""
+#pylint: disable=wrong-import-position
+import hashlib
+import hmac
+import json
+import os
+import sys
+
+import pytest
+
+from environment import get_event, verwerkingsactie
+from Shared import hashing, helpers
+from Shared.helpers import hashHelper
+from Shared.indexes import addIndexAttributes
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../tools'))
+
+from migrate_hash_prefix import migrate
+
+
+@pytest.fixture
+def hashKey(monkeypatch):
+    monkeypatch.setenv('HASH_KEY', 'test-key')
+    monkeypatch.setattr(hashing, '_hashKey', None)
+    hashing.hashCache.clear()
+    yield b'test-key'
+    hashing.hashCache.clear()
+
+def test_v1_is_prefixed():
+    expected = 'v1:' + hashlib.new('sha3_256', b'999999999').hexdigest()
+    assert hashHelper('999999999') == hashing.hashObjectId('999999999', hashing.HASH_SCHEME_V1) == expected
+
+def test_hashed_values_are_not_hashed_again():
+    hashed = hashHelper('999999999')
+    assert hashHelper(hashed) == hashed
+    # unprefixed (legacy) hashes get the prefix
+    assert hashHelper(hashed[len('v1:'):]) == hashed
+    # long objectIds are hashed as well
+    assert hashing.isHashed(hashHelper('12345678901234')) and not hashing.isHashed('12345678901234')
+
+# A raw objectId that looks like a legacy hash (64 hex characters) is not hashed, it is stored with the
+# prefix: the key stays the same as before the prefix (stored as given), and is stable across requests.
+def test_hex_objectIds_are_taken_for_legacy_hashes():
+    objectId = 'ab' * 32
+    assert hashing.parseHash(objectId) == (hashing.HASH_SCHEME_V1, objectId)
+    assert hashHelper(objectId) == hashHelper(objectId) == 'v1:' + objectId
+    assert hashing.legacyObjectId(objectId) == objectId
+    # Only lowercase hex of exactly 64 characters
+    assert not hashing.isHashed(objectId.upper()) and not hashing.isHashed(objectId[1:])
+
+def test_batch_and_memo():
+    hashing.hashCache.clear()
+    hashes = hashing.hashObjectIds(['1', '2', '1'])
+    assert hashes == [hashHelper('1'), hashHelper('2'), hashHelper('1')]
+    assert hashes[0] == hashes[2] != hashes[1]
+    assert hashing.hashCache.stats()['size'] == 2
+
+def test_v2_is_keyed_hash_of_v1(hashKey):
+    v1 = hashing.hashObjectId('999999999', hashing.HASH_SCHEME_V1)
+    v2 = hashing.hashObjectId('999999999', hashing.HASH_SCHEME_V2)
+    assert v2 == 'v2:' + hmac.new(hashKey, v1[len('v1:'):].encode('ascii'), hashlib.sha256).hexdigest()
+    # Stored v1 hashes can be migrated without the original objectId
+    assert hashing.rehash(v1, hashing.HASH_SCHEME_V2) == v2
+    assert hashing.canonicalHash(v1[len('v1:'):], hashing.HASH_SCHEME_V2) == v2
+    with pytest.raises(ValueError):
+        hashing.rehash(v1, 'v3')
+    with pytest.raises(ValueError):
+        hashing.rehash(v2, hashing.HASH_SCHEME_V1)
+
+# Items as written before the prefix: an unprefixed hash and a (long) objectId that was not hashed
+def legacy_item(env, actieId, objectId, verwerktObjectId=None, tijdstipRegistratie='2023-01-01T00:00:00', otherObjectIds=()):
+    verwerkteObjecten = [dict(verwerkingsactie([id])['verwerkteObjecten'][0], verwerktObjectId='object-' + id[:8]) for id in [objectId, *otherObjectIds]]
+    if verwerktObjectId is not None:
+        verwerkteObjecten[0]['verwerktObjectId'] = verwerktObjectId
+    for verwerktObject in verwerkteObjecten:
+        objectTypeSoortId = 'persoonBSN' + verwerktObject['objectId']
+        item = dict(verwerkingsactie([]), actieId=actieId, verwerkteObjecten=verwerkteObjecten, tijdstipRegistratie=tijdstipRegistratie,
+            objectTypeSoortId=objectTypeSoortId, compositeSortKey=objectTypeSoortId + '#' + tijdstipRegistratie)
+        env.table.put_item(Item=addIndexAttributes(item))
+
+def test_migrate_hash_prefix(env):
+    legacy_item(env, 'actie-1', hashHelper('999999999')[len('v1:'):])
+    legacy_item(env, 'actie-2', '12345678901234')
+    env.gen.handle_request(
+        dict(get_event('/verwerkingsacties'), httpMethod='POST', body=json.dumps(verwerkingsactie(['999999999']))),
+        env.bucket, env.queue, env.handlerTable)
+    for event in env.drain_queue():
+        env.proc.process_message(event, env.handlerTable)
+
+    # The subject is not migrated yet, the new verwerkingsactie gets the verwerktObjectId of its legacy items
+    posted = [item for item in env.table.scan()['Items'] if item['actieId'] != 'actie-1' and item['actieId'] != 'actie-2']
+    assert posted[0]['verwerktObjectId'] == 'object-' + hashHelper('999999999')[len('v1:'):][:8]
+
+    assert migrate(env.table.name, totalSegments=2) == (3, 2)
+    assert migrate(env.table.name, totalSegments=2) == (3, 0)
+
+    items = {item['actieId']: item for item in env.table.scan()['Items']}
+    assert len(items) == 3
+    assert items['actie-2']['objectTypeSoortId'] == 'persoonBSN' + hashHelper('12345678901234')
+    assert items['actie-2']['compositeSortKey'] == items['actie-2']['objectTypeSoortId'] + '#2023-01-01T00:00:00'
+    assert items['actie-2']['verwerktObjectId'] == 'object-12345678'
+    assert len(set(item['verwerktObjectId'] for item in items.values() if item['actieId'] != 'actie-2')) == 1
+
+    # All verwerkingsacties of the subject are in a single partition
+    parameters = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '999999999'}
+    response = json.loads(env.rec.handle_request(get_event('/verwerkingsacties', parameters), env.handlerTable)['body'])
+    assert response['Count'] == 2
+
+def test_legacy_lookup_of_long_objectIds(env):
+    legacy_item(env, 'actie-1', '12345678901234')
+    body = verwerkingsactie(['12345678901234'])
+    env.gen.handle_request(dict(get_event('/verwerkingsacties'), httpMethod='POST', body=json.dumps(body)), env.bucket, env.queue, env.handlerTable)
+    messages = [msg for event in env.drain_queue() for record in event['Records'] for msg in json.loads(record['body'])]
+    assert messages[0]['verwerkteObjecten'][0]['verwerktObjectId'] == 'object-12345678'
+
+    # Without the legacy lookup (migration done) the subject gets a new verwerktObjectId
+    env.gen.legacyHashLookup = False
+    env.gen.verwerktObjectIdCache.clear()
+    env.gen.handle_request(dict(get_event('/verwerkingsacties'), httpMethod='POST', body=json.dumps(body)), env.bucket, env.queue, env.handlerTable)
+    messages = [msg for event in env.drain_queue() for record in event['Records'] for msg in json.loads(record['body'])]
+    assert messages[0]['verwerkteObjecten'][0]['verwerktObjectId'] != 'object-12345678'
+
+def post_and_process(env, objectIds):
+    env.gen.handle_request(dict(get_event('/verwerkingsacties'), httpMethod='POST', body=json.dumps(verwerkingsactie(objectIds))), env.bucket, env.queue, env.handlerTable)
+    for event in env.drain_queue():
+        env.proc.process_message(event, env.handlerTable)
+
+def read_pages(env, handler, resource, parameters, limit):
+    pages = []
+    nextToken = None
+    while True:
+        pageParameters = dict(parameters, limit=str(limit), **({'nextToken': nextToken} if nextToken is not None else {}))
+        body = json.loads(handler.handle_request(get_event(resource, pageParameters), env.handlerTable)['body'])
+        pages.append([item['actieId'] for item in body['Items']])
+        nextToken = body['nextToken']
+        if nextToken is None:
+            return pages
+
+# Until the migration is done, Rec and Inzage read the unmigrated (legacy) items of a subject as well
+@pytest.mark.parametrize('resource, objectId', [('/verwerkingsacties', '999999999'), ('/verwerkte-objecten', hashHelper('999999999'))])
+def test_reads_include_unmigrated_items(env, monkeypatch, resource, objectId):
+    handler = env.rec if resource == '/verwerkingsacties' else env.inzage
+    legacy_item(env, 'actie-1', hashHelper('999999999')[len('v1:'):])
+    legacy_item(env, 'actie-2', hashHelper('999999999')[len('v1:'):], tijdstipRegistratie='2023-02-01T00:00:00')
+    post_and_process(env, ['999999999'])
+    parameters = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': objectId}
+
+    # The canonical partition first, then the legacy one. A page that is full at the end of
+    # the canonical partition continues in the legacy partition.
+    for limit, pageCount in [(1, 3), (2, 2), (3, 1)]:
+        pages = read_pages(env, handler, resource, parameters, limit)
+        assert len(pages) == pageCount
+        actieIds = [actieId for page in pages for actieId in page]
+        assert len(actieIds) == 3 and {'actie-1', 'actie-2'} < set(actieIds)
+        assert set(pages[-1]) & {'actie-1', 'actie-2'}
+
+    monkeypatch.setattr(helpers, 'legacyHashLookup', False)
+    assert [actieId for page in read_pages(env, handler, resource, parameters, 10) for actieId in page] == [actieIds[0]]
+
+# Merged partitions get a single verwerktObjectId: that of the oldest item of the subject
+def test_migrate_merges_verwerkt_object_ids(env, tmp_path):
+    legacy_item(env, 'actie-1', '12345678901234', 'object-old', '2023-01-01T00:00:00')
+    # Written under the canonical key (with another verwerktObjectId), together with another subject
+    legacy_item(env, 'actie-2', hashHelper('12345678901234'), 'object-new', '2023-02-01T00:00:00', [hashHelper('888888888')])
+    mergeFile = str(tmp_path / 'merge.txt')
+
+    assert migrate(env.table.name, totalSegments=2, mergeFile=mergeFile) == (3, 1)
+    assert not os.path.exists(mergeFile)
+
+    items = env.table.scan()['Items']
+    objectTypeSoortId = 'persoonBSN' + hashHelper('12345678901234')
+    assert {item['verwerktObjectId'] for item in items if item['objectTypeSoortId'] == objectTypeSoortId} == {'object-old'}
+    # In the items of the other subject of the verwerkingsactie as well
+    other = next(item for item in items if item['objectTypeSoortId'] != objectTypeSoortId)
+    assert other['verwerktObjectId'] == 'object-' + hashHelper('888888888')[:8]
+    assert {verwerktObject['objectId']: verwerktObject['verwerktObjectId'] for verwerktObject in other['verwerkteObjecten']} == {
+        hashHelper('12345678901234'): 'object-old',
+        hashHelper('888888888'): 'object-' + hashHelper('888888888')[:8],
+    }
+
+# Partitions merged by a run that was interrupted before the merge are merged by the next run
+def test_migrate_merges_partitions_of_merge_file(env, tmp_path):
+    legacy_item(env, 'actie-1', hashHelper('12345678901234'), 'object-old', '2023-01-01T00:00:00')
+    legacy_item(env, 'actie-2', hashHelper('12345678901234'), 'object-new', '2023-02-01T00:00:00')
+    mergeFile = tmp_path / 'merge.txt'
+    mergeFile.write_text('persoonBSN' + hashHelper('12345678901234') + '\n')
+
+    assert migrate(env.table.name, totalSegments=2, mergeFile=str(mergeFile)) == (2, 0)
+    assert {item['verwerktObjectId'] for item in env.table.scan()['Items']} == {'object-old'}
+    assert not mergeFile.exists()
@@ -0,0 +1,112 @@
+"""
+File: test_indexes.py
+Description: Shared.indexes.verwerkingsactiesQuery chooses the index and key condition for the filter
+parameters, with and without the objectTypeSoortId-verwerkingsactiviteitId-index
+"""
+import pytest
+from boto3.dynamodb.conditions import Attr, Key
+
+from environment import ACTIVITEITEN, seed_history
+from Shared import indexes
+from Shared.helpers import hashHelper
+from Shared.indexes import verwerkingsactiesQuery
+from Shared.pagination import queryItems
+
+OBJECT_KEY = 'persoonBSN' + hashHelper('999999999')
+BEGIN = '2023-03-01'
+EIND = '2023-06-01'
+ACTIVITEIT = ACTIVITEITEN[1]
+ACTIVITEIT_KEY = OBJECT_KEY + '#' + ACTIVITEIT
+
+def test_no_filters():
+    assert verwerkingsactiesQuery(OBJECT_KEY) == {
+        'IndexName': indexes.OBJECT_TYPE_SOORT_ID_INDEX,
+        'KeyConditionExpression': Key('objectTypeSoortId').eq(OBJECT_KEY),
+    }
+
+@pytest.mark.parametrize('beginDatum, eindDatum, tijdstipCondition', [
+    (BEGIN, EIND, Key('tijdstip').between(BEGIN, EIND)),
+    (BEGIN, None, Key('tijdstip').gte(BEGIN)),
+    (None, EIND, Key('tijdstip').lte(EIND)),
+])
+def test_date_range_is_key_condition(beginDatum, eindDatum, tijdstipCondition):
+    assert verwerkingsactiesQuery(OBJECT_KEY, beginDatum, eindDatum) == {
+        'IndexName': indexes.OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX,
+        'KeyConditionExpression': Key('objectTypeSoortId').eq(OBJECT_KEY) & tijdstipCondition,
+    }
+
+@pytest.mark.parametrize('beginDatum, eindDatum, tijdstipCondition', [
+    (None, None, None),
+    (BEGIN, EIND, Key('tijdstip').between(BEGIN, EIND)),
+    (BEGIN, None, Key('tijdstip').gte(BEGIN)),
+    (None, EIND, Key('tijdstip').lte(EIND)),
+])
+def test_activiteit_index(beginDatum, eindDatum, tijdstipCondition):
+    keyCondition = Key(indexes.OBJECT_TYPE_SOORT_ID_ACTIVITEIT).eq(ACTIVITEIT_KEY)
+    if tijdstipCondition is not None:
+        keyCondition &= tijdstipCondition
+    assert verwerkingsactiesQuery(OBJECT_KEY, beginDatum, eindDatum, ACTIVITEIT, activiteitIndex=True) == {
+        'IndexName': indexes.OBJECT_TYPE_SOORT_ID_ACTIVITEIT_INDEX,
+        'KeyConditionExpression': keyCondition,
+    }
+
+# Without the activiteit index (not deployed yet) the activiteit is a filter on the tijdstip index
+@pytest.mark.parametrize('beginDatum, eindDatum, tijdstipCondition', [
+    (None, None, None),
+    (BEGIN, EIND, Key('tijdstip').between(BEGIN, EIND)),
+    (BEGIN, None, Key('tijdstip').gte(BEGIN)),
+    (None, EIND, Key('tijdstip').lte(EIND)),
+])
+def test_activiteit_without_index(beginDatum, eindDatum, tijdstipCondition):
+    keyCondition = Key('objectTypeSoortId').eq(OBJECT_KEY)
+    if tijdstipCondition is not None:
+        keyCondition &= tijdstipCondition
+    assert verwerkingsactiesQuery(OBJECT_KEY, beginDatum, eindDatum, ACTIVITEIT, activiteitIndex=False) == {
+        'IndexName': indexes.OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX,
+        'KeyConditionExpression': keyCondition,
+        'FilterExpression': Attr('verwerkingsactiviteitId').eq(ACTIVITEIT),
+    }
+
+def test_vertrouwelijkheid_is_filter():
+    assert verwerkingsactiesQuery(OBJECT_KEY, vertrouwelijkheid='normaal') == {
+        'IndexName': indexes.OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX,
+        'KeyConditionExpression': Key('objectTypeSoortId').eq(OBJECT_KEY),
+        'FilterExpression': Attr('vertrouwelijkheid').eq('normaal'),
+    }
+    assert verwerkingsactiesQuery(OBJECT_KEY, verwerkingsactiviteitId=ACTIVITEIT, vertrouwelijkheid='normaal', activiteitIndex=False)['FilterExpression'] == \
+        Attr('verwerkingsactiviteitId').eq(ACTIVITEIT) & Attr('vertrouwelijkheid').eq('normaal')
+    assert verwerkingsactiesQuery(OBJECT_KEY, verwerkingsactiviteitId=ACTIVITEIT, vertrouwelijkheid='normaal', activiteitIndex=True)['FilterExpression'] == \
+        Attr('vertrouwelijkheid').eq('normaal')
+
+def test_activiteit_index_defaults_to_configuration(monkeypatch):
+    monkeypatch.setattr(indexes, 'activiteitIndexEnabled', False)
+    assert verwerkingsactiesQuery(OBJECT_KEY, verwerkingsactiviteitId=ACTIVITEIT)['IndexName'] == indexes.OBJECT_TYPE_SOORT_ID_TIJDSTIP_INDEX
+    monkeypatch.setattr(indexes, 'activiteitIndexEnabled', True)
+    assert verwerkingsactiesQuery(OBJECT_KEY, verwerkingsactiviteitId=ACTIVITEIT)['IndexName'] == indexes.OBJECT_TYPE_SOORT_ID_ACTIVITEIT_INDEX
+
+# Both paths return the items matching the filters, as filtering all items of the object would
+@pytest.mark.parametrize('filters', [
+    {},
+    {'beginDatum': BEGIN, 'eindDatum': EIND},
+    {'beginDatum': BEGIN},
+    {'eindDatum': EIND},
+    {'verwerkingsactiviteitId': ACTIVITEIT},
+    {'verwerkingsactiviteitId': ACTIVITEIT, 'beginDatum': BEGIN, 'eindDatum': EIND},
+    {'verwerkingsactiviteitId': ACTIVITEIT, 'beginDatum': BEGIN},
+    {'verwerkingsactiviteitId': ACTIVITEIT, 'eindDatum': EIND},
+    {'verwerkingsactiviteitId': ACTIVITEIT, 'vertrouwelijkheid': 'normaal'},
+])
+def test_query_results(env, filters):
+    seed_history(env, '999999999', 24)
+    seed_history(env, '888888888', 6)
+    items = [item for item in env.table.scan()['Items'] if item['objectTypeSoortId'] == OBJECT_KEY]
+    expected = sorted(
+        item['actieId'] for item in items
+        if item['tijdstip'] >= filters.get('beginDatum', '')
+        and item['tijdstip'] <= filters.get('eindDatum', '9999')
+        and item['verwerkingsactiviteitId'] == filters.get('verwerkingsactiviteitId', item['verwerkingsactiviteitId']))
+    assert 0 < len(expected) < 24 or filters == {}
+
+    for activiteitIndex in (True, False):
+        queryArgs = verwerkingsactiesQuery(OBJECT_KEY, activiteitIndex=activiteitIndex, **filters)
+        assert sorted(item['actieId'] for item in queryItems(env.handlerTable, **queryArgs)) == expected
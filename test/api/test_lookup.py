@@ -0,0 +1,71 @@
+"""
+File: test_lookup.py
+Description: verwerktObjectId lookups of the Gen lambda: a single item is read per object,
+and the parallel lookup of several objects resolves the same ids as looking them up one by one
+"""
+import pytest
+
+from environment import post_event, verwerkingsactie
+
+OBJECT_IDS = ['111111111', '222222222', '333333333', '444444444']
+
+
+@pytest.fixture
+def env(env):
+    # Several verwerkingsacties per object, so the objectTypeSoortId-index has more than one item per key
+    for _ in range(3):
+        env.gen.handle_request(post_event(verwerkingsactie(OBJECT_IDS)), env.bucket, env.queue, env.table)
+        for event in env.drain_queue():
+            env.proc.process_message(event, env.handlerTable)
+    env.gen.verwerktObjectIdCache.clear()
+    return env
+
+# Table recording the arguments of all queries
+class RecordingTable:
+
+    def __init__(self, table):
+        self.table = table
+        self.queries = []
+
+    def query(self, **queryArgs):
+        self.queries.append(queryArgs)
+        return self.table.query(**queryArgs)
+
+def object_keys(env, objectIds):
+    item = env.gen.objectId_check(verwerkingsactie(objectIds))
+    return [env.gen.object_type_soort_id(verwerktObject) for verwerktObject in item.get('verwerkteObjecten')]
+
+def test_lookup_reads_a_single_item(env):
+    table = RecordingTable(env.handlerTable)
+    key = object_keys(env, OBJECT_IDS[:1])[0]
+
+    assert env.gen.lookup_verwerktObjectId(key, table) is not None
+    assert table.queries[0]['Limit'] == 1
+    assert env.gen.lookup_verwerktObjectId(object_keys(env, ['999999999'])[0], table) is None
+
+def test_parallel_lookup_equals_sequential_lookup(env, monkeypatch):
+    keys = object_keys(env, OBJECT_IDS + ['999999999'])
+    sequential = {key: env.gen.lookup_verwerktObjectId(key, env.handlerTable) for key in keys}
+    assert len(set(verwerktObjectId for verwerktObjectId in sequential.values() if verwerktObjectId is not None)) == len(OBJECT_IDS)
+
+    # Duplicate keys are looked up once, on the thread pool
+    monkeypatch.setattr(env.gen, 'lookupMaxWorkers', 3)
+    table = RecordingTable(env.handlerTable)
+    parallel = env.gen.lookup_verwerktObjectIds(keys + keys[:2], table)
+    assert parallel == sequential
+    assert len(table.queries) == len(keys)
+
+    # Resolved ids are cached, only the unknown object is looked up again
+    table = RecordingTable(env.handlerTable)
+    assert env.gen.lookup_verwerktObjectIds(keys, table) == sequential
+    assert len(table.queries) == 1
+
+def test_lookup_of_a_single_pending_key(env):
+    keys = object_keys(env, OBJECT_IDS[:2])
+    resolvedIds = {keys[0]: 'resolved-before'}
+    table = RecordingTable(env.handlerTable)
+
+    result = env.gen.lookup_verwerktObjectIds(keys + [keys[1]], table, resolvedIds)
+    assert result[keys[0]] == 'resolved-before'
+    assert result[keys[1]] == env.gen.lookup_verwerktObjectId(keys[1], env.handlerTable)
+    assert len(table.queries) == 1
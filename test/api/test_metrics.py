@@ -0,0 +1,56 @@
+"""
+File: test_metrics.py
+Description: Shared.metrics: buffered Embedded Metric Format records, flushed once per invocation
+"""
+import contextlib
+import io
+import json
+
+import boto3
+
+from environment import TABLE_NAME, get_event, seed_history
+from Shared import metrics
+from Shared.dynamodb import FastTable
+
+
+def invoke(handler):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        handler({}, None)
+    return [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{"')]
+
+def test_records_are_flushed_once_per_invocation(env):
+    seed_history(env, '999999999', 10)
+    table = FastTable(metrics.instrumentClient(boto3.client('dynamodb')), TABLE_NAME)
+    hashedObjectId = env.gen.objectId_check({'verwerkteObjecten': [{'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '999999999'}]})['verwerkteObjecten'][0]['objectId']
+    parameters = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': hashedObjectId, 'vertrouwelijkheid': 'normaal'}
+
+    @metrics.logMetrics('rec')
+    def handler(event, context):
+        return env.rec.handle_request(get_event('/verwerkingsacties', parameters), table)
+
+    records = invoke(handler)
+    assert len(records) == 1
+    record = records[0]
+    assert record['Handler'] == 'rec'
+    assert record['path'] == '/verwerkingsacties'
+    # A query of the canonical and of the legacy partition of the subject (LEGACY_HASH_LOOKUP)
+    assert record['DynamoDBCalls'] == 2
+    assert record['ItemsReturned'] == record['ItemsScanned'] == 10
+    assert record['Latency'] > 0
+    assert record['ConsumedReadCapacity'] > 0
+    names = {metric['Name'] for metric in record['_aws']['CloudWatchMetrics'][0]['Metrics']}
+    assert {'Latency', 'DynamoDBCalls', 'DynamoDBDuration', 'ItemsReturned', 'ItemsScanned'} <= names
+
+    # Nothing is buffered outside of an invocation
+    env.rec.handle_request(get_event('/verwerkingsacties', parameters), table)
+    assert metrics.metrics.records() == []
+
+def test_large_records_are_split():
+    buffer = metrics.MetricsBuffer()
+    for index in range(250):
+        buffer.put('DynamoDBDuration', index, 'Milliseconds')
+    buffer.add('DynamoDBCalls', 250)
+    records = buffer.records()
+    assert [len(record['DynamoDBDuration']) for record in records] == [100, 100, 50]
+    assert records[0]['DynamoDBCalls'] == 250 and 'DynamoDBCalls' not in records[1]
@@ -0,0 +1,140 @@
+"""
+File: test_pagination.py
+Description: GET /verwerkingsacties and /verwerkte-objecten return pages of at most limit items,
+continued with the nextToken of the previous page. Invalid limits and tokens are a bad request (400).
+"""
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from environment import ACTIVITEITEN, get_event, seed_history
+from Shared import pagination
+from Shared.pagination import MAX_PAGE_LIMIT, encodeNextToken, parseLimit
+
+PARAMETERS = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '999999999'}
+HISTORY_SIZE = 7
+
+@pytest.fixture(scope='module')
+def env(module_env):
+    seed_history(module_env, PARAMETERS['objectId'], HISTORY_SIZE)
+    seed_history(module_env, '888888888', 2)
+    return module_env
+
+def rec_request(env, parameters):
+    return env.rec.handle_request(get_event('/verwerkingsacties', parameters), env.handlerTable)
+
+def inzage_request(env, parameters):
+    hashedObjectId = env.gen.objectId_check({'verwerkteObjecten': [dict(PARAMETERS)]})['verwerkteObjecten'][0]['objectId']
+    return env.inzage.handle_request(get_event('/verwerkte-objecten', dict(parameters, objectId=hashedObjectId)), env.handlerTable)
+
+REQUESTS = [rec_request, inzage_request]
+
+# Request all pages, returns the actieIds of each page
+def pages(env, request, parameters, limit):
+    result = []
+    nextToken = None
+    while True:
+        pageParameters = dict(parameters, limit=str(limit))
+        if nextToken is not None:
+            pageParameters['nextToken'] = nextToken
+        response = request(env, pageParameters)
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['Count'] == len(body['Items']) <= limit
+        result.append([item['actieId'] for item in body['Items']])
+        nextToken = body['nextToken']
+        if nextToken is None:
+            return result
+
+def test_parse_limit():
+    assert parseLimit(None) == MAX_PAGE_LIMIT
+    assert parseLimit('5') == 5
+    assert parseLimit(str(MAX_PAGE_LIMIT + 1)) == MAX_PAGE_LIMIT
+    for value in ('0', '-1', 'abc', ''):
+        with pytest.raises(ValueError):
+            parseLimit(value)
+
+@pytest.mark.parametrize('request_', REQUESTS)
+@pytest.mark.parametrize('limit', ['0', '-5', 'abc'])
+def test_invalid_limit(env, request_, limit):
+    assert request_(env, dict(PARAMETERS, limit=limit))['statusCode'] == 400
+
+@pytest.mark.parametrize('request_', REQUESTS)
+@pytest.mark.parametrize('parameters', [
+    {},
+    {'beginDatum': '2023-02-01T00:00:00+01:00'},
+    {'verwerkingsactiviteitId': ACTIVITEITEN[0]},
+])
+def test_next_token_round_trip(env, request_, parameters):
+    parameters = dict(PARAMETERS, **parameters)
+    allItems = json.loads(request_(env, parameters)['body'])
+    assert allItems['nextToken'] is None
+
+    result = pages(env, request_, parameters, 2)
+    assert len(result) > 1
+    assert all(len(page) == 2 for page in result[:-1])
+    actieIds = [actieId for page in result for actieId in page]
+    assert len(actieIds) == len(set(actieIds))
+    assert sorted(actieIds) == sorted(item['actieId'] for item in allItems['Items'])
+
+@pytest.mark.parametrize('request_', REQUESTS)
+@pytest.mark.parametrize('nextToken', [
+    'not a token',
+    encodeNextToken(['actieId']),
+    encodeNextToken({'foo': 'bar'}),
+    encodeNextToken({'actieId': {'S': 'history-000001'}, 'compositeSortKey': 'key', 'objectTypeSoortId': 'persoonBSN'}),
+])
+def test_invalid_next_token(env, request_, nextToken):
+    assert request_(env, dict(PARAMETERS, nextToken=nextToken))['statusCode'] == 400
+
+# A token of another query (index) has other key attributes
+@pytest.mark.parametrize('request_', REQUESTS)
+def test_next_token_of_another_query(env, request_):
+    firstPage = json.loads(request_(env, dict(PARAMETERS, beginDatum='2023-01-01T00:00:00+01:00', limit='2'))['body'])
+    assert firstPage['nextToken'] is not None
+
+    assert request_(env, dict(PARAMETERS, nextToken=firstPage['nextToken']))['statusCode'] == 400
+
+# A token DynamoDB rejects (ValidationException) is a bad request as well
+def test_next_token_rejected_by_dynamodb(env):
+    class RejectingTable:
+        def query(self, **queryArgs):
+            raise ClientError({'Error': {'Code': 'ValidationException', 'Message': 'The provided starting key is invalid'}}, 'Query')
+
+    firstPage = json.loads(rec_request(env, dict(PARAMETERS, limit='2'))['body'])
+    response = env.rec.handle_request(get_event('/verwerkingsacties', dict(PARAMETERS, nextToken=firstPage['nextToken'])), RejectingTable())
+    assert response['statusCode'] == 400
+
+# Table counting the queries, returning pages of pageSize items
+class CountingTable:
+
+    def __init__(self, table, pageSize):
+        self.table = table
+        self.pageSize = pageSize
+        self.queries = 0
+
+    def query(self, **queryArgs):
+        self.queries += 1
+        return self.table.query(**dict(queryArgs, Limit=min(queryArgs.get('Limit'), self.pageSize)))
+
+# A page that uses its budget (queries or time) is returned with the items found so far and a nextToken
+@pytest.mark.parametrize('budget', ['queries', 'time'])
+def test_page_budget(env, monkeypatch, budget):
+    table = CountingTable(env.handlerTable, 1)
+    remainingTimeMs = None
+    if budget == 'queries':
+        monkeypatch.setattr(pagination, 'PAGE_MAX_QUERIES', 3)
+    else:
+        remainingTimeMs = lambda: pagination.PAGE_TIME_MARGIN_MS - 1 if table.queries >= 2 else 10000
+
+    response = env.rec.handle_request(get_event('/verwerkingsacties', dict(PARAMETERS, limit='5')), table, remainingTimeMs)
+    body = json.loads(response['body'])
+    assert table.queries == (3 if budget == 'queries' else 2)
+    assert body['Count'] == table.queries
+    assert body['nextToken'] is not None
+
+    # The next page continues after the items of the shortened page
+    response = env.rec.handle_request(get_event('/verwerkingsacties', dict(PARAMETERS, limit='5', nextToken=body['nextToken'])), env.handlerTable)
+    actieIds = [item['actieId'] for item in body['Items']] + [item['actieId'] for item in json.loads(response['body'])['Items']]
+    assert len(set(actieIds)) == len(actieIds) == HISTORY_SIZE
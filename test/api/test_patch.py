@@ -0,0 +1,92 @@
+"""
+File: test_patch.py
+Description: PATCH messages update all pages of the verwerkingId-index, and are checkpointed
+(continued in a new message) when the Lambda is about to time out
+"""
+import json
+
+import pytest
+
+from environment import post_event, verwerkingsactie
+
+VERWERKING_ID = '48086bf2-11b7-4603-9526-67d7c3bb6587'
+
+
+@pytest.fixture
+def env(env):
+    env.gen.handle_request(post_event(verwerkingsactie(['111111111', '222222222', '333333333', '444444444', '555555555'])), env.bucket, env.queue, env.table)
+    for event in env.drain_queue():
+        env.proc.process_message(event, env.handlerTable)
+    return env
+
+# Table returning query results in pages of pageSize items, so a PATCH spans several pages
+class PagedTable:
+
+    def __init__(self, table, pageSize):
+        self.table = table
+        self.pageSize = pageSize
+        self.queries = []
+
+    def query(self, **queryArgs):
+        self.queries.append(queryArgs)
+        return self.table.query(Limit=self.pageSize, **queryArgs)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+def patch_body(exclusiveStartKey=None):
+    body = {'verwerkingId': VERWERKING_ID, 'vertrouwelijkheid': 'vertrouwelijk'}
+    if exclusiveStartKey is not None:
+        body['exclusiveStartKey'] = exclusiveStartKey
+    return json.dumps(body)
+
+def vertrouwelijkheden(env):
+    return sorted(item['vertrouwelijkheid'] for item in env.table.scan()['Items'])
+
+def test_patch_updates_all_pages(env):
+    table = PagedTable(env.handlerTable, 2)
+    response = env.proc.patch_verwerkings_acties(patch_body(), table, env.queue, lambda: 10 ** 6)
+
+    assert json.loads(response['body'])['updated'] == 5
+    assert len(table.queries) == 3
+    assert vertrouwelijkheden(env) == ['vertrouwelijk'] * 5
+    assert env.drain_queue() == []
+
+def test_patch_checkpoint_when_time_runs_out(env, monkeypatch):
+    monkeypatch.setattr(env.proc, 'patchCheckpointMarginMs', 1000)
+    table = PagedTable(env.handlerTable, 2)
+    response = env.proc.patch_verwerkings_acties(patch_body(), table, env.queue, lambda: 999)
+
+    # Only the first page is updated, the rest is continued in a new PATCH message
+    assert json.loads(response['body'])['updated'] == 2
+    assert vertrouwelijkheden(env).count('vertrouwelijk') == 2
+    events = env.drain_queue()
+    assert len(events) == 1
+    record = events[0]['Records'][0]
+    assert record['messageAttributes']['path']['stringValue'] == 'PATCH'
+    checkpoint = json.loads(json.loads(record['body']))
+    assert checkpoint['verwerkingId'] == VERWERKING_ID
+    assert checkpoint['exclusiveStartKey'] is not None
+
+    # The checkpoint message resumes after the first page
+    result = env.proc.process_message(events[0], table, env.queue, lambda: 10 ** 6)
+    assert result == {'batchItemFailures': []}
+    assert table.queries[1]['ExclusiveStartKey'] == checkpoint['exclusiveStartKey']
+    assert vertrouwelijkheden(env) == ['vertrouwelijk'] * 5
+    assert env.drain_queue() == []
+
+def test_patch_resume_from_exclusive_start_key(env):
+    table = PagedTable(env.handlerTable, 2)
+    firstPage = table.query(IndexName='verwerkingId-index', KeyConditionExpression=env.proc.Key('verwerkingId').eq(VERWERKING_ID))
+
+    response = env.proc.patch_verwerkings_acties(patch_body(firstPage['LastEvaluatedKey']), table)
+
+    assert json.loads(response['body'])['updated'] == 3
+    assert vertrouwelijkheden(env).count('vertrouwelijk') == 3
+
+def test_patch_no_checkpoint_with_enough_time(env):
+    table = PagedTable(env.handlerTable, 2)
+    response = env.proc.patch_verwerkings_acties(patch_body(), table, env.queue, lambda: env.proc.patchCheckpointMarginMs)
+
+    assert json.loads(response['body'])['updated'] == 5
+    assert env.drain_queue() == []
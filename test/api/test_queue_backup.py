@@ -0,0 +1,69 @@
+"""
+File: test_queue_backup.py
+Description: Queue backup mode: the raw event is sent along with the queue message (backup attribute)
+and archived by the processing lambda as a gzipped JSONL object
+"""
+import gzip
+import json
+
+import pytest
+
+from environment import post_event, verwerkingsactie
+
+
+@pytest.fixture
+def env(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'backupMode', 'queue')
+    return env
+
+def post(env, objectIds):
+    response = env.gen.handle_request(post_event(verwerkingsactie(objectIds)), env.bucket, env.queue, env.table)
+    return json.loads(response['body'])['actieId']
+
+def archived(env):
+    objects = [summary for summary in env.bucket.objects.all() if summary.key.startswith('backups/')]
+    return {summary.key: [json.loads(line) for line in gzip.decompress(summary.get()['Body'].read()).decode('UTF-8').splitlines()] for summary in objects}
+
+def test_backup_is_sent_along_with_the_first_message(env):
+    actieId = post(env, ['111111111', '222222222'])
+
+    records = [record for event in env.drain_queue() for record in event['Records']]
+    backups = [record['messageAttributes'].get('backup') for record in records]
+    assert len([backup for backup in backups if backup is not None]) == 1
+    backup = json.loads(next(backup for backup in backups if backup is not None)['stringValue'])
+    assert backup['key'] == actieId
+    assert json.loads(backup['event']['body']) == verwerkingsactie(['111111111', '222222222'])
+    # Not stored in S3 by the Gen lambda
+    assert [summary.key for summary in env.bucket.objects.all()] == []
+
+def test_backups_are_archived_as_gzipped_jsonl(env):
+    actieIds = [post(env, ['111111111']), post(env, ['222222222'])]
+    events = env.drain_queue()
+    for event in events:
+        assert env.proc.process_message(event, env.handlerTable, bucket=env.bucket) == {'batchItemFailures': []}
+
+    objects = archived(env)
+    assert sorted(line['key'] for lines in objects.values() for line in lines) == sorted(actieIds)
+    assert all(key.endswith('.jsonl.gz') for key in objects)
+    assert env.table.scan()['Count'] == 2
+
+    # A redelivered batch overwrites its archive instead of adding a copy
+    for event in events:
+        env.proc.process_message(event, env.handlerTable, bucket=env.bucket)
+    assert archived(env) == objects
+
+def test_failed_archive_fails_the_messages_with_a_backup(env, monkeypatch):
+    post(env, ['111111111', '222222222'])
+    events = env.drain_queue()
+    records = [record for event in events for record in event['Records']]
+    backupMessageIds = [record['messageId'] for record in records if 'backup' in record['messageAttributes']]
+
+    def put_object(**kwargs):
+        raise Exception('S3 unavailable')
+
+    monkeypatch.setattr(env.bucket, 'put_object', put_object)
+    result = env.proc.process_message({'Records': records}, env.handlerTable, bucket=env.bucket)
+
+    # Only the message with the backup is redelivered, all items are written
+    assert result == {'batchItemFailures': [{'itemIdentifier': messageId} for messageId in backupMessageIds]}
+    assert env.table.scan()['Count'] == 2
@@ -0,0 +1,51 @@
+"""
+File: test_redrive.py
+Description: Redrive the dead-letter queue: reprocess the retryable messages and quarantine the poison messages
+"""
+import boto3
+import pytest
+
+from environment import post_event, verwerkingsactie
+
+
+@pytest.fixture
+def env(env):
+    env.deadLetterQueue = boto3.resource('sqs').create_queue(QueueName='verwerkingen-dead-letter-queue')
+    return env
+
+# Move the messages of the queue to the dead-letter queue (as SQS does after maxReceiveCount)
+def dead_letter(env):
+    count = 0
+    while True:
+        messages = env.queue.receive_messages(MaxNumberOfMessages=10, MessageAttributeNames=['All'])
+        if len(messages) == 0:
+            return count
+        env.deadLetterQueue.send_messages(Entries=[{
+            'Id': str(index),
+            'MessageBody': message.body,
+            'MessageAttributes': message.message_attributes,
+        } for index, message in enumerate(messages)])
+        env.queue.delete_messages(Entries=[{'Id': str(index), 'ReceiptHandle': message.receipt_handle} for index, message in enumerate(messages)])
+        count += len(messages)
+
+def test_redrive_dead_letter_queue(env):
+    env.gen.handle_request(post_event(verwerkingsactie(['111111111', '222222222', '333333333'])), env.bucket, env.queue, env.table)
+    # The verwerkingsactie is a single (list) message
+    assert dead_letter(env) == 1
+
+    env.deadLetterQueue.send_message(MessageBody='not a message', MessageAttributes={'path': {'DataType': 'String', 'StringValue': 'POST'}})
+    env.deadLetterQueue.send_message(MessageBody='{}')
+
+    totals = env.proc.redrive_dead_letter_queue(env.deadLetterQueue, env.table, env.queue, env.bucket)
+
+    assert totals == {'processed': 1, 'throttling': 0, 'retryable': 0, 'validation': 0, 'poison': 2}
+    assert env.table.scan()['Count'] == 3
+    assert len(list(env.bucket.objects.filter(Prefix='quarantine/'))) == 2
+    assert env.deadLetterQueue.receive_messages(MaxNumberOfMessages=10) == []
+
+def test_classify_failure(env):
+    throttled = type('ClientError', (Exception,), {'response': {'Error': {'Code': 'ProvisionedThroughputExceededException'}}})()
+    assert env.proc.classify_failure(throttled) == 'throttling'
+    assert env.proc.classify_failure(env.proc.UnprocessedItemError()) == 'throttling'
+    assert env.proc.classify_failure(ValueError('invalid json')) == 'poison'
+    assert env.proc.classify_failure(Exception('connection reset')) == 'retryable'
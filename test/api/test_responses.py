@@ -0,0 +1,28 @@
+"""
+File: test_responses.py
+Description: Responses are encoded once, including Decimal and datetime values
+"""
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from environment import get_event, seed_history
+from Shared.responses import badRequestResponse, successResponse
+
+
+def test_success_response_is_encoded_once():
+    response = successResponse({'bewaartermijn': Decimal('10'), 'score': Decimal('0.5'), 'tijdstip': datetime(2024, 1, 1, 12)})
+    assert json.loads(response['body']) == {'bewaartermijn': 10, 'score': 0.5, 'tijdstip': '2024-01-01T12:00:00'}
+    assert successResponse()['body'] == ''
+    assert json.loads(badRequestResponse()['body']) == {'title': 'Bad request', 'status': 400}
+
+def test_get_responses_are_encoded_once(env):
+    seed_history(env, '999999999', 3)
+    parameters = {'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '999999999'}
+
+    rec = json.loads(env.rec.handle_request(get_event('/verwerkingsacties', parameters), env.handlerTable)['body'])
+    assert rec['Count'] == 3
+
+    hashedObjectId = env.gen.objectId_check({'verwerkteObjecten': [dict(parameters)]})['verwerkteObjecten'][0]['objectId']
+    inzage = json.loads(env.inzage.handle_request(get_event('/verwerkte-objecten', dict(parameters, objectId=hashedObjectId)), env.handlerTable)['body'])
+    assert inzage['Items'] == rec['Items']
@@ -0,0 +1,112 @@
+"""
+File: test_sync_write.py
+Description: POST /verwerkingsacties with X-Write-Mode: sync writes directly to DynamoDB when the queue is healthy,
+and falls back to the queue otherwise
+"""
+import json
+
+import pytest
+
+from environment import get_event, post_event, verwerkingsactie
+
+
+@pytest.fixture
+def env(env, monkeypatch):
+    monkeypatch.setitem(env.gen.queueHealth, 'checked', 0.0)
+    return env
+
+def post(env, objectIds, writeMode=None):
+    event = post_event(verwerkingsactie(objectIds))
+    if writeMode is not None:
+        event['headers'] = {'X-Write-Mode': writeMode}
+    response = env.gen.handle_request(event, env.bucket, env.queue, env.handlerTable)
+    return response['headers']['X-Write-Mode'], json.loads(response['body'])['actieId']
+
+def stored_items(env, actieId):
+    return env.table.query(KeyConditionExpression='actieId = :actieId', ExpressionAttributeValues={':actieId': actieId})['Items']
+
+def without_ids(item):
+    return {name: value for name, value in item.items() if name not in ('actieId', 'url', 'tijdstipRegistratie', 'compositeSortKey')}
+
+def test_sync_write_is_readable_immediately(env):
+    writeMode, actieId = post(env, ['111111111', '222222222'], 'sync')
+    assert writeMode == 'sync'
+    assert env.drain_queue() == []
+    response = env.rec.handle_request(get_event('/verwerkingsacties/{actieId}', pathParameters={'actieId': actieId}), env.handlerTable)
+    assert response['statusCode'] == 200
+    # The backup is stored in S3
+    assert env.bucket.Object(actieId).get()['ContentLength'] > 0
+
+    # Same items as written by the processing lambda
+    writeMode, queuedActieId = post(env, ['111111111', '222222222'])
+    assert writeMode == 'queue'
+    for event in env.drain_queue():
+        env.proc.process_message(event, env.handlerTable)
+    assert sorted(map(without_ids, stored_items(env, actieId)), key=str) == sorted(map(without_ids, stored_items(env, queuedActieId)), key=str)
+    assert len(stored_items(env, actieId)) == 2
+
+def test_unhealthy_queue_falls_back_to_queue(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'syncWriteMaxQueueDepth', 0)
+    env.queue.send_message(MessageBody='{}')
+    writeMode, actieId = post(env, ['111111111'], 'sync')
+    assert writeMode == 'queue'
+    assert stored_items(env, actieId) == []
+
+def test_large_requests_fall_back_to_queue(env, monkeypatch):
+    monkeypatch.setattr(env.gen, 'syncWriteMaxItems', 1)
+    assert post(env, ['111111111', '222222222'], 'sync')[0] == 'queue'
+
+def test_failed_sync_write_falls_back_to_queue(env, monkeypatch):
+    def throttled(**kwargs):
+        raise Exception('ProvisionedThroughputExceededException')
+    monkeypatch.setattr(env.handlerTable.meta.client, 'batch_write_item', throttled)
+    writeMode, actieId = post(env, ['111111111'], 'sync')
+    assert writeMode == 'queue'
+    messages = [record for event in env.drain_queue() for record in event['Records']]
+    assert [msg['actieId'] for record in messages for msg in json.loads(record['body'])] == [actieId]
+
+# BatchWriteItem writes the first item only and returns the others as UnprocessedItems
+def partly_written(env, monkeypatch):
+    client = env.handlerTable.meta.client
+    batchWriteItem = client.batch_write_item
+
+    def batch_write_item(RequestItems):
+        tableName, requests = list(RequestItems.items())[0]
+        batchWriteItem(RequestItems={tableName: requests[:1]})
+        return {'UnprocessedItems': {tableName: requests[1:]}}
+
+    monkeypatch.setattr(client, 'batch_write_item', batch_write_item)
+
+def test_partial_sync_write_enqueues_the_rest(env, monkeypatch):
+    partly_written(env, monkeypatch)
+    writeMode, actieId = post(env, ['111111111', '222222222', '333333333'], 'sync')
+    assert writeMode == 'queue'
+    written = [item['compositeSortKey'] for item in stored_items(env, actieId)]
+    assert len(written) == 1
+    messages = [record for event in env.drain_queue() for record in event['Records']]
+    queued = [msg['compositeSortKey'] for record in messages for msg in json.loads(record['body'])]
+    assert len(queued) == 2 and written[0] not in queued
+
+# The client gets the actieId of the written items instead of an error (its retry would duplicate them),
+# the items that cannot be enqueued either are restored from the backup
+def test_partial_sync_write_does_not_fail_when_the_queue_fails(env, monkeypatch):
+    partly_written(env, monkeypatch)
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    monkeypatch.setattr(env.queue, 'send_messages', lambda Entries: {'Failed': [{'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError'} for entry in Entries]})
+
+    writeMode, actieId = post(env, ['111111111', '222222222'], 'sync')
+    assert writeMode == 'queue'
+    assert len(stored_items(env, actieId)) == 1
+    assert env.drain_queue() == []
+    assert json.loads(env.bucket.Object(actieId).get()['Body'].read())['tijdstipRegistratie'] is not None
+
+def test_failed_sync_write_fails_when_the_queue_fails(env, monkeypatch):
+    def throttled(**kwargs):
+        raise Exception('ProvisionedThroughputExceededException')
+    monkeypatch.setattr(env.handlerTable.meta.client, 'batch_write_item', throttled)
+    monkeypatch.setattr(env.gen, 'sqsBatchMaxAttempts', 1)
+    monkeypatch.setattr(env.queue, 'send_messages', lambda Entries: {'Failed': [{'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError'} for entry in Entries]})
+
+    # Nothing is written, the client can retry the request
+    with pytest.raises(Exception, match='Failed to enqueue'):
+        post(env, ['111111111'], 'sync')
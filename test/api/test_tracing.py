@@ -0,0 +1,42 @@
+"""
+File: test_tracing.py
+Description: The correlation id of a request is carried from the Gen lambda over SQS to the Proc lambda,
+which emits the enqueue, queue dwell and write spans
+"""
+import contextlib
+import io
+import json
+import time
+
+from environment import post_event, verwerkingsactie
+
+
+def process(env):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for event in env.drain_queue():
+            env.proc.process_message(event, env.handlerTable)
+    return [json.loads(line[len('TRACE: '):]) for line in output.getvalue().splitlines() if line.startswith('TRACE: ')]
+
+def test_spans_per_correlation_id(env):
+    requestTime = int(time.time() * 1000) - 1000
+    event = dict(post_event(verwerkingsactie(['111111111', '222222222'])),
+        headers={'X-Correlation-Id': 'request-1'}, requestContext={'requestTimeEpoch': requestTime})
+    env.gen.handle_request(event, env.bucket, env.queue, env.handlerTable)
+    env.gen.handle_request(post_event(verwerkingsactie(['333333333'])), env.bucket, env.queue, env.handlerTable)
+
+    traces = {trace['correlationId']: trace for trace in process(env)}
+    assert len(traces) == 2
+    trace = traces.pop('request-1')
+    # The messages of a verwerkingsactie are sent as a single (list) message
+    assert trace['messages'] == 1
+    assert set(trace['spans']) == {'enqueue', 'queueDwell', 'write', 'ingestLag'}
+    assert trace['spans']['ingestLag'] >= 1000
+    assert trace['spans']['ingestLag'] >= trace['spans']['enqueue']
+    # A new correlation id is created if the client does not send one
+    assert list(traces.values())[0]['messages'] == 1
+
+def test_invalid_correlation_id_is_replaced(env):
+    event = dict(post_event(verwerkingsactie(['111111111'])), headers={'x-correlation-id': 'not a valid id'})
+    env.gen.handle_request(event, env.bucket, env.queue, env.handlerTable)
+    assert process(env)[0]['correlationId'] != 'not a valid id'
@@ -0,0 +1,49 @@
+"""
+File: test_verwerkt_object_id.py
+Description: GET /verwerkte-objecten/{verwerktObjectId} is a key lookup on the verwerktObjectId-index
+"""
+#pylint: disable=wrong-import-position
+import json
+import os
+import sys
+
+from environment import get_event, seed_history
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../tools'))
+
+from backfill_index_attributes import backfill
+
+
+def get_verwerkt_object(env, verwerktObjectId):
+    event = get_event('/verwerkte-objecten/{verwerktObjectId}', pathParameters={'verwerktObjectId': verwerktObjectId})
+    return env.inzage.handle_request(event, env.handlerTable)
+
+def test_get_by_verwerkt_object_id(env):
+    seed_history(env, '999999999', 5)
+    seed_history(env, '888888888', 1)
+    items = env.table.scan()['Items']
+    verwerktObjectIds = {item['verwerktObjectId'] for item in items}
+    assert len(verwerktObjectIds) == 2
+
+    for item in items:
+        response = get_verwerkt_object(env, item['verwerktObjectId'])
+        assert response['statusCode'] == 200
+        body = json.loads(response['body'])
+        assert body['verwerktObjectId'] == item['verwerktObjectId']
+        assert body['verwerkteObjecten'][0]['verwerktObjectId'] == item['verwerktObjectId']
+        assert 'objectTypeSoortId' not in body
+
+    assert get_verwerkt_object(env, 'unknown')['statusCode'] == 404
+
+def test_backfill_verwerkt_object_id(env):
+    seed_history(env, '999999999', 3)
+    for item in env.table.scan()['Items']:
+        env.table.update_item(
+            Key={'actieId': item['actieId'], 'compositeSortKey': item['compositeSortKey']},
+            UpdateExpression='REMOVE verwerktObjectId')
+    verwerktObjectId = item['verwerktObjectId']
+    assert get_verwerkt_object(env, verwerktObjectId)['statusCode'] == 404
+
+    assert backfill(env.table.name, totalSegments=2) == (3, 3)
+    assert backfill(env.table.name, totalSegments=2) == (3, 0)
+    assert get_verwerkt_object(env, verwerktObjectId)['statusCode'] == 200
@@ -0,0 +1,21 @@
+"""
+File: aws_mock.py
+Description: Fake AWS credentials and region for moto, and mock_aws for both moto 5 and moto < 5 (Pipfile.lock).
+Imported by the test conftest.py and by the standalone benchmark (test/api/benchmark.py).
+"""
+import contextlib
+import os
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-central-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+try:
+    from moto import mock_aws
+except ImportError: # moto < 5
+    from moto import mock_dynamodb, mock_s3, mock_sqs
+
+    @contextlib.contextmanager
+    def mock_aws():
+        with mock_dynamodb(), mock_s3(), mock_sqs():
+            yield
@@ -0,0 +1,13 @@
+"""
+File: conftest.py
+Description: Shared fixtures of the api and tools tests: all AWS calls go to moto
+"""
+import pytest
+
+from aws_mock import mock_aws
+
+
+@pytest.fixture
+def aws():
+    with mock_aws():
+        yield
@@ -1,5 +1,6 @@
 import { App } from 'aws-cdk-lib';
-import { Template } from 'aws-cdk-lib/assertions';
+import { Match, Template } from 'aws-cdk-lib/assertions';
+import { ApiStack } from '../src/ApiStack';
 import { PipelineStack } from '../src/PipelineStack';
 import { Statics } from '../src/statics';
 
@@ -42,4 +43,56 @@ test('MainPipelineExists', () => {
   });
   const template = Template.fromStack(stack);
   template.resourceCountIs('AWS::CodePipeline::Pipeline', 1);
-});
\ No newline at end of file
+});
+
+function apiStack(hashScheme?: 'v1' | 'v2') {
+  const app = new App();
+  return new ApiStack(app, 'api', {
+    configuration: {
+      branchName: 'test',
+      codeStarConnectionArn: Statics.gnBuildCodeStarConnectionArn,
+      buildEnvironment: testEnv,
+      targetEnvironment: testEnv,
+      hashScheme: hashScheme,
+    },
+    env: testEnv,
+  });
+}
+
+test('ApiStackSnapshot', () => {
+  const template = Template.fromStack(apiStack('v2'));
+  expect(template.toJSON()).toMatchSnapshot();
+});
+
+test('LambdasCanReadHashKeySecret', () => {
+  const template = Template.fromStack(apiStack('v2'));
+  const hashingEnvironment = {
+    Environment: {
+      Variables: Match.objectLike({
+        HASH_SCHEME: 'v2',
+        HASH_KEY_SECRET_ARN: Match.anyValue(),
+      }),
+    },
+  };
+  for (const description of ['Receive calls and place on queue', 'Responsible for get and delete verwerkingsacties', 'Responsible for providing verwerkingen on inzage request']) {
+    template.hasResourceProperties('AWS::Lambda::Function', { Description: description, ...hashingEnvironment });
+  }
+  template.hasResourceProperties('AWS::IAM::Policy', {
+    PolicyDocument: {
+      Statement: Match.arrayWith([
+        Match.objectLike({
+          Action: Match.arrayWith(['secretsmanager:GetSecretValue']),
+          Effect: 'Allow',
+        }),
+      ]),
+    },
+  });
+});
+
+test('HashSchemeDefaultsToV1', () => {
+  const template = Template.fromStack(apiStack());
+  template.hasResourceProperties('AWS::Lambda::Function', {
+    Description: 'Responsible for get and delete verwerkingsacties',
+    Environment: { Variables: Match.objectLike({ HASH_SCHEME: 'v1' }) },
+  });
+});
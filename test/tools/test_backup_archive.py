@@ -0,0 +1,104 @@
+"""
+File: test_backup_archive.py
+Description: Archive sync and queue mode backups and read them back by tijdstip range and objectTypeSoortId
+"""
+#pylint: disable=wrong-import-position
+import gzip
+import json
+import os
+import sys
+
+import boto3
+import pytest
+
+pytest.importorskip('pyarrow')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../tools'))
+
+from backup_archive import MANIFEST_KEY, object_type_soort_id, read_archive, write_archive
+
+
+def verwerkingsactie(objectId, tijdstip):
+    return {
+        'actieNaam': 'Zoeken personen',
+        'verwerkingId': 'verwerking-' + objectId,
+        'verwerkingsactiviteitId': 'activiteit',
+        'vertrouwelijkheid': 'normaal',
+        'tijdstip': tijdstip,
+        'verwerkteObjecten': [{'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': objectId, 'verwerkteSoortenGegevens': []}],
+    }
+
+def post_event(body):
+    return {'httpMethod': 'POST', 'resource': '/verwerkingsacties', 'body': json.dumps(body)}
+
+@pytest.fixture
+def bucket(aws):
+    return boto3.resource('s3').create_bucket(Bucket='verwerkingen-backup-bucket', CreateBucketConfiguration={'LocationConstraint': 'eu-central-1'})
+
+def test_write_and_read_archive(bucket):
+    # Sync backup mode: an object per request
+    bucket.put_object(Key='actie-1', Body=json.dumps(post_event(verwerkingsactie('111111111', '2024-01-01T10:00:00'))))
+    bucket.put_object(Key='batch/batch-1', Body=json.dumps(post_event([
+        verwerkingsactie('222222222', '2024-01-02T10:00:00'),
+        verwerkingsactie('333333333', '2024-02-01T10:00:00'),
+    ])))
+    # Queue backup mode: gzipped JSONL archived by the processing lambda
+    lines = [json.dumps({'key': 'actie-4', 'event': post_event(verwerkingsactie('111111111', '2024-03-01T10:00:00'))})]
+    bucket.put_object(Key='backups/2024/03/01/10/00/part.jsonl.gz', Body=gzip.compress(('\n'.join(lines) + '\n').encode('UTF-8')))
+
+    assert write_archive(bucket, deleteSource=True) == (3, 4)
+    # Three date partitions and one event file
+    assert sorted(summary.key.split('/')[0] for summary in bucket.objects.all() if summary.key != MANIFEST_KEY) == ['archive'] * 5
+
+    january = read_archive(bucket, '2024-01-01', '2024-01-31T23:59:59').to_pylist()
+    assert sorted(row['key'] for row in january) == ['actie-1', 'batch/batch-1']
+
+    objectTypeSoortId = object_type_soort_id({'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': '111111111'})
+    rows = read_archive(bucket, objectTypeSoortId=objectTypeSoortId, columns=['key', 'tijdstip']).to_pylist()
+    assert rows == [{'key': 'actie-1', 'tijdstip': '2024-01-01T10:00:00'}, {'key': 'actie-4', 'tijdstip': '2024-03-01T10:00:00'}]
+
+    assert read_archive(bucket, '2025-01-01').num_rows == 0
+
+def test_event_is_stored_once_per_backup(bucket):
+    event = post_event([verwerkingsactie('222222222', '2024-01-02T10:00:00'), verwerkingsactie('333333333', '2024-01-02T11:00:00')])
+    bucket.put_object(Key='batch/batch-1', Body=json.dumps(event))
+    write_archive(bucket)
+
+    manifest = json.loads(bucket.Object(MANIFEST_KEY).get()['Body'].read())
+    assert [(part['sources'], part['backups']) for part in manifest['events']] == [(1, 1)]
+    rows = read_archive(bucket, columns=['tijdstip', 'event']).to_pylist()
+    assert sorted(row['tijdstip'] for row in rows) == ['2024-01-02T10:00:00', '2024-01-02T11:00:00']
+    assert all(json.loads(row['event']) == event for row in rows)
+
+def test_archive_is_incremental(bucket):
+    bucket.put_object(Key='actie-1', Body=json.dumps(post_event(verwerkingsactie('111111111', '2024-01-01T10:00:00'))))
+    write_archive(bucket, deleteSource=True)
+    bucket.put_object(Key='actie-2', Body=json.dumps(post_event(verwerkingsactie('111111111', '2024-01-01T11:00:00'))))
+    write_archive(bucket, deleteSource=True)
+
+    manifest = json.loads(bucket.Object(MANIFEST_KEY).get()['Body'].read())
+    assert len(manifest['parts']) == 2
+    assert read_archive(bucket).num_rows == 2
+
+def test_archived_sources_are_skipped(bucket):
+    bucket.put_object(Key='actie-1', Body=json.dumps(post_event(verwerkingsactie('111111111', '2024-01-01T10:00:00'))))
+    assert write_archive(bucket) == (1, 1)
+    bucket.put_object(Key='actie-2', Body=json.dumps(post_event(verwerkingsactie('111111111', '2024-01-01T11:00:00'))))
+
+    # The sources are kept (no deleteSource), only the new one is archived
+    assert write_archive(bucket) == (1, 1)
+    assert write_archive(bucket) == (0, 0)
+    assert sorted(row['key'] for row in read_archive(bucket, columns=['key']).to_pylist()) == ['actie-1', 'actie-2']
+
+def test_redelivered_backups_are_archived_once(bucket):
+    line = json.dumps({'key': 'actie-1', 'event': post_event(verwerkingsactie('111111111', '2024-03-01T10:00:00'))})
+    other = json.dumps({'key': 'actie-2', 'event': post_event(verwerkingsactie('222222222', '2024-03-01T10:00:00'))})
+    # The message of actie-1 was redelivered in another batch, and archived again by the processing lambda
+    bucket.put_object(Key='backups/2024/03/01/10/00/a.jsonl.gz', Body=gzip.compress((line + '\n').encode('UTF-8')))
+    bucket.put_object(Key='backups/2024/03/01/10/01/b.jsonl.gz', Body=gzip.compress((line + '\n' + other + '\n').encode('UTF-8')))
+
+    assert write_archive(bucket) == (2, 2)
+    assert sorted(row['key'] for row in read_archive(bucket, columns=['key']).to_pylist()) == ['actie-1', 'actie-2']
+
+    bucket.put_object(Key='backups/2024/03/01/10/02/c.jsonl.gz', Body=gzip.compress((line + '\n').encode('UTF-8')))
+    assert write_archive(bucket) == (1, 0)
@@ -0,0 +1,154 @@
+"""
+File: test_restore_backups.py
+Description: Restore the items of POST and batch POST requests from their S3 backups
+"""
+#pylint: disable=wrong-import-position
+import json
+import os
+import sys
+
+import boto3
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../tools'))
+
+import restore_backups
+from restore_backups import RateLimiter, gen, restore, restore_items
+
+
+def verwerkingsactie(objectIds):
+    return {
+        'actieNaam': 'Zoeken personen',
+        'verwerkingId': 'verwerking',
+        'verwerkingsactiviteitId': 'activiteit',
+        'vertrouwelijkheid': 'normaal',
+        'tijdstip': '2024-01-01T10:00:00',
+        'verwerkteObjecten': [{'objectType': 'persoon', 'soortObjectId': 'BSN', 'objectId': objectId, 'verwerkteSoortenGegevens': [{'soortGegeven': 'BSN'}]} for objectId in objectIds],
+    }
+
+def post_event(resource, body):
+    return {'httpMethod': 'POST', 'resource': resource, 'body': json.dumps(body), 'queryStringParameters': None, 'pathParameters': None}
+
+@pytest.fixture
+def environment(aws):
+    table = boto3.resource('dynamodb').create_table(
+        TableName='verwerkingen-table-v4',
+        KeySchema=[{'AttributeName': 'actieId', 'KeyType': 'HASH'}, {'AttributeName': 'compositeSortKey', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name in ['actieId', 'compositeSortKey', 'objectTypeSoortId']],
+        GlobalSecondaryIndexes=[{
+            'IndexName': 'objectTypeSoortId-index',
+            'KeySchema': [{'AttributeName': 'objectTypeSoortId', 'KeyType': 'HASH'}],
+            'Projection': {'ProjectionType': 'ALL'},
+        }],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    bucket = boto3.resource('s3').create_bucket(Bucket='verwerkingen-backup-bucket', CreateBucketConfiguration={'LocationConstraint': 'eu-central-1'})
+    queue = boto3.resource('sqs').create_queue(QueueName='verwerkingen-queue')
+    return table, bucket, queue
+
+def queued_items(queue):
+    items = []
+    while True:
+        messages = queue.receive_messages(MaxNumberOfMessages=10)
+        if len(messages) == 0:
+            return items
+        for message in messages:
+            body = json.loads(message.body)
+            items.extend(body if isinstance(body, list) else [body]) # batch requests send a list per verwerkingsactie
+        queue.delete_messages(Entries=[{'Id': str(index), 'ReceiptHandle': message.receipt_handle} for index, message in enumerate(messages)])
+
+def test_restore_recreates_items(environment, tmp_path):
+    table, bucket, queue = environment
+    gen.handle_request(post_event('/verwerkingsacties', verwerkingsactie(['111111111', '222222222'])), bucket, queue, table)
+    gen.handle_request(post_event('/verwerkingsacties/batch', [verwerkingsactie(['111111111']), {'invalid': True}, verwerkingsactie(['333333333'])]), bucket, queue, table)
+    queued = queued_items(queue)
+    expected = {(item['actieId'], item['compositeSortKey']) for item in queued}
+
+    checkpointFile = str(tmp_path / 'checkpoint.json')
+    metrics = restore(bucket, table, pageSize=1, checkpointFile=checkpointFile, failuresFile=str(tmp_path / 'failures.txt'))
+    assert metrics == {'sources': 2, 'items': 4, 'failed': 0}
+
+    items = table.scan()['Items']
+    assert {(item['actieId'], item['compositeSortKey']) for item in items} == expected
+
+    # The same object gets the same verwerktObjectId in all restored items
+    verwerktObjectIds = {}
+    for item in items:
+        for verwerktObject in item['verwerkteObjecten']:
+            verwerktObjectIds.setdefault(verwerktObject['objectId'], set()).add(verwerktObject['verwerktObjectId'])
+    assert len(verwerktObjectIds) == 3
+    assert all(len(ids) == 1 for ids in verwerktObjectIds.values())
+    # and the verwerktObjectId it had (stored in the backup), although the table was empty
+    assert verwerktObjectIds == {verwerktObject['objectId']: {verwerktObject['verwerktObjectId']} for item in queued for verwerktObject in item['verwerkteObjecten']}
+
+    # Continuing from the checkpoint has nothing left to restore
+    assert restore(bucket, table, checkpointFile=checkpointFile) == metrics
+    assert table.scan()['Count'] == 4
+
+def test_restore_from_archive(environment, tmp_path):
+    pytest.importorskip('pyarrow')
+    from backup_archive import write_archive
+
+    table, bucket, queue = environment
+    gen.handle_request(post_event('/verwerkingsacties/batch', [verwerkingsactie(['111111111']), verwerkingsactie(['222222222', '333333333'])]), bucket, queue, table)
+    expected = {(item['actieId'], item['compositeSortKey']) for item in queued_items(queue)}
+    write_archive(bucket, deleteSource=True)
+
+    metrics = restore(bucket, table, fromArchive=True, checkpointFile=str(tmp_path / 'checkpoint.json'))
+    assert metrics == {'sources': 1, 'items': 3, 'failed': 0}
+    assert {(item['actieId'], item['compositeSortKey']) for item in table.scan()['Items']} == expected
+
+def test_restore_replays_deletes(environment, tmp_path):
+    table, bucket, queue = environment
+    gen.handle_request(post_event('/verwerkingsacties/batch', [verwerkingsactie(['111111111']), verwerkingsactie(['222222222'])]), bucket, queue, table)
+    actieIds = sorted(set(item['actieId'] for item in queued_items(queue)))
+    deletesFile = tmp_path / 'deletes.txt'
+    deletesFile.write_text(actieIds[0] + '\n')
+
+    sourcesFile = tmp_path / 'sources.txt'
+    sourcesFile.write_text(''.join(summary.key + '\n' for summary in bucket.objects.all()))
+    metrics = restore(bucket, table, sourcesFile=str(sourcesFile), deletesFile=str(deletesFile))
+    assert metrics == {'sources': 1, 'items': 2, 'failed': 0}
+
+    vervallen = {item['actieId']: item.get('vervallen', False) for item in table.scan()['Items']}
+    assert vervallen == {actieIds[0]: True, actieIds[1]: False}
+
+# PUT backups are the list of messages of the verwerkingsactie (older backups: the message of a single verwerktObject)
+def test_restore_put_backups():
+    messages = [{'actieId': 'actie-1', 'compositeSortKey': 'a'}, {'actieId': 'actie-1', 'compositeSortKey': 'b'}]
+    assert restore_items('actie-1', messages, None, None) == messages
+    assert restore_items('actie-1', messages[0], None, None) == [messages[0]]
+
+# Clock of the rate limiter, sleeping moves it forward
+class FakeTime:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+# A rate below the chunk size (25 items per BatchWriteItem) waits for the chunk instead of spinning forever
+def test_rate_limiter_below_chunk_size(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(restore_backups, 'time', clock)
+    limiter = RateLimiter(10)
+
+    limiter.acquire(25)
+    assert clock.now == pytest.approx(1001.5)
+    limiter.acquire(25)
+    assert clock.now == pytest.approx(1004.0)
+
+def test_rate_limiter(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(restore_backups, 'time', clock)
+    limiter = RateLimiter(100)
+
+    for _ in range(4):
+        limiter.acquire(25)
+    assert clock.now == 1000.0
+    limiter.acquire(50)
+    assert clock.now == pytest.approx(1000.5)
@@ -0,0 +1,56 @@
+"""
+File: backfill_index_attributes.py
+Description: Backfill the (sparse) index attributes on existing items of the verwerkingen table,
+including the top-level verwerktObjectId used by the verwerktObjectId-index.
+
+New items get these attributes from the processing lambda (Shared.indexes.addIndexAttributes),
+items written before an index was introduced are updated by this script.
+
+Usage: python tools/backfill_index_attributes.py --table verwerkingen-table-v4 [--segments 8] [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+# Use the shared code from the lambda layer
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src/api/LambdaLayer/python'))
+
+from Shared.indexes import indexAttributes
+from table_scan import parallel_scan
+
+
+# Update the index attributes of a single item, if they are missing or outdated
+def backfill_item(item, table, dryRun=False):
+    attributes = {name: value for name, value in indexAttributes(item).items() if item.get(name) != value}
+    if len(attributes) == 0:
+        return False
+
+    if not dryRun:
+        names = list(attributes.keys())
+        table.update_item(
+            Key={
+                'actieId': item.get('actieId'),
+                'compositeSortKey': item.get('compositeSortKey'),
+            },
+            UpdateExpression='SET ' + ', '.join('#attr' + str(index) + '= :attr' + str(index) for index in range(len(names))),
+            ExpressionAttributeNames={'#attr' + str(index): name for index, name in enumerate(names)},
+            ExpressionAttributeValues={':attr' + str(index): attributes[name] for index, name in enumerate(names)},
+            ConditionExpression='attribute_exists(actieId)',
+        )
+    return True
+
+# Backfill the whole table using a parallel scan
+def backfill(tableName, totalSegments=8, dryRun=False):
+    scanned, updated = parallel_scan(tableName, totalSegments, lambda item, table: backfill_item(item, table, dryRun), 'updated')
+    print('Done: ' + str(scanned) + ' scanned, ' + str(updated) + (' to update (dry run)' if dryRun else ' updated'))
+    return scanned, updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill index attributes on existing verwerkingen items')
+    parser.add_argument('--table', default='verwerkingen-table-v4', help='DynamoDB table name')
+    parser.add_argument('--segments', type=int, default=8, help='Number of parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the items that need an update')
+    args = parser.parse_args()
+
+    backfill(args.table, args.segments, args.dry_run)
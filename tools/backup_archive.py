@@ -0,0 +1,401 @@
+"""
+File: backup_archive.py
+Description: Compact the S3 backups of the verwerkingen API into a date partitioned Parquet archive.
+
+The backup bucket contains a JSON object per request (sync backup mode, named by actieId or batch/<batchId>)
+and gzipped JSONL objects written by the processing lambda (queue backup mode). The processing lambda writes
+one object per batch of messages it processed (backups/%Y/%m/%d/%H/%M/<hash of the messageIds>.jsonl.gz, by the
+minute the first message was sent), so there are many small objects per minute rather than one per time window.
+Queue mode backups are also stored as a JSON object per request when the message they were sent along with
+could not be enqueued.
+The writer turns these into Parquet files (zstd compressed, one row per verwerktObject) under
+archive/date=YYYY-MM-DD/ and keeps a manifest (archive/manifest.json) with the tijdstip and objectTypeSoortId
+range of every file. The raw events are stored once per backup (not per verwerktObject) in separate Parquet
+files under archive/events/, together with the source object they were read from and a digest of the event.
+Sources that are already archived are skipped when the writer runs again, and so are backups that were archived
+before from another source (queue mode backups of redelivered messages). The reader uses the manifest to skip files, and the Parquet
+row group statistics (rows are sorted by objectTypeSoortId and tijdstip) with ranged GETs to skip parts of
+the remaining files.
+
+Requires pyarrow (pip install pyarrow), which is not needed by the lambdas themselves.
+
+Usage:
+  python tools/backup_archive.py write --bucket <backup-bucket> [--prefix backups/2024/01/] [--delete-source]
+  python tools/backup_archive.py read --bucket <backup-bucket> [--begin 2024-01-01] [--end 2024-02-01] [--object-type-soort-id <id>]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+
+import boto3
+
+# Use the shared code from the lambda layer
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src/api/LambdaLayer/python'))
+
+from Shared.helpers import hashHelper
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # optional, only needed for the archive
+    pa = None
+    pq = None
+
+ARCHIVE_PREFIX = 'archive/'
+EVENTS_PREFIX = ARCHIVE_PREFIX + 'events/'
+# Dead-lettered messages that could not be processed (see redrive_dead_letter_queue), not backups
+QUARANTINE_PREFIX = 'quarantine/'
+MANIFEST_KEY = ARCHIVE_PREFIX + 'manifest.json'
+MANIFEST_VERSION = 1
+
+# Rows per Parquet row group, the unit the reader can skip using the statistics
+ROW_GROUP_SIZE = int(os.getenv('ARCHIVE_ROW_GROUP_SIZE', '10000'))
+# Number of source objects read before the rows are written as Parquet files
+SOURCE_CHUNK_SIZE = int(os.getenv('ARCHIVE_SOURCE_CHUNK_SIZE', '10000'))
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+# Columns of the row files, the event (raw backup) is joined from the event files by key
+ROW_COLUMNS = ['objectTypeSoortId', 'tijdstip', 'key', 'method', 'actieId', 'verwerkingId', 'verwerkingsactiviteitId', 'vertrouwelijkheid']
+EVENT_COLUMNS = ['source', 'key', 'digest', 'event']
+COLUMNS = ROW_COLUMNS + ['event']
+
+
+def require_pyarrow():
+    if pa is None:
+        raise Exception('pyarrow is required for the backup archive, install it with: pip install pyarrow')
+
+def schema(columns=None):
+    require_pyarrow()
+    return pa.schema([(name, pa.string()) for name in (columns or COLUMNS)])
+
+# Same objectTypeSoortId as stored in the verwerkingen table (objectId hashed as in the Gen lambda)
+def object_type_soort_id(verwerktObject):
+    objectId = verwerktObject.get('objectId')
+    if verwerktObject.get('objectType') is None or verwerktObject.get('soortObjectId') is None or objectId is None:
+        return None
+    objectId = hashHelper(objectId) # hashed as in objectId_check, already hashed objectIds are kept
+    return verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + objectId
+
+# The verwerkingsacties in a backup. Backups are either API Gateway events (POST, POST batch)
+# or PUT messages (a list, or the message of a single verwerktObject in older backups).
+def backup_items(event):
+    if 'httpMethod' in event:
+        try:
+            body = json.loads(event.get('body') or 'null')
+        except ValueError:
+            body = None
+        method = event.get('httpMethod')
+    else:
+        body = event
+        method = 'PUT'
+
+    items = body if isinstance(body, list) else [body]
+    return method, [item for item in items if isinstance(item, dict)]
+
+# Convert a single backup to archive rows, one for each verwerktObject
+def backup_rows(key, event, fallbackDate):
+    method, items = backup_items(event)
+    rows = []
+    for item in items:
+        verwerkteObjecten = item.get('verwerkteObjecten') if isinstance(item.get('verwerkteObjecten'), list) else []
+        for verwerktObject in verwerkteObjecten or [{}]:
+            tijdstip = item.get('tijdstip') if isinstance(item.get('tijdstip'), str) else None
+            rows.append({
+                'objectTypeSoortId': object_type_soort_id(verwerktObject) if isinstance(verwerktObject, dict) else None,
+                'tijdstip': tijdstip,
+                'key': key,
+                'method': method,
+                'actieId': item.get('actieId'),
+                'verwerkingId': item.get('verwerkingId'),
+                'verwerkingsactiviteitId': item.get('verwerkingsactiviteitId'),
+                'vertrouwelijkheid': item.get('vertrouwelijkheid'),
+                'date': tijdstip[:10] if tijdstip is not None and DATE_PATTERN.match(tijdstip) else fallbackDate,
+            })
+    return rows
+
+# Read the backups in a single source object, returns [(key, event)]
+def read_source(bucket, summary):
+    body = bucket.Object(summary.key).get().get('Body').read()
+    if summary.key.endswith('.jsonl.gz'):
+        backups = []
+        for line in gzip.decompress(body).decode('UTF-8').splitlines():
+            if line.strip() != '':
+                backup = json.loads(line)
+                backups.append((backup.get('key'), backup.get('event')))
+        return backups
+    return [(summary.key, json.loads(body))]
+
+# The source objects (backups) in the bucket (in key order, after startAfter), the archive and quarantine are skipped
+def list_sources(bucket, prefix='', startAfter=None):
+    for summary in bucket.objects.filter(Prefix=prefix, **({'Marker': startAfter} if startAfter is not None else {})):
+        if not summary.key.startswith(ARCHIVE_PREFIX) and not summary.key.startswith(QUARANTINE_PREFIX):
+            yield summary
+
+def load_manifest(bucket):
+    try:
+        manifest = json.loads(bucket.Object(MANIFEST_KEY).get().get('Body').read())
+    except bucket.meta.client.exceptions.NoSuchKey:
+        manifest = {'version': MANIFEST_VERSION, 'parts': []}
+    manifest.setdefault('events', [])
+    return manifest
+
+def save_manifest(manifest, bucket):
+    bucket.put_object(
+        ContentType='application/json',
+        Key=MANIFEST_KEY,
+        Body=bytes(json.dumps(manifest, indent=1).encode('UTF-8')),
+    )
+
+def write_parquet(key, rows, columns, bucket):
+    table = pa.Table.from_pylist([{name: row.get(name) for name in columns} for row in rows], schema=schema(columns))
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression='zstd', row_group_size=ROW_GROUP_SIZE, use_dictionary=True, write_statistics=True)
+    bucket.put_object(ContentType='application/vnd.apache.parquet', Key=key, Body=buffer.getvalue())
+    return buffer.tell()
+
+# Write the rows of a single date partition as a Parquet file, returns its manifest entry
+def write_part(date, rows, bucket):
+    rows.sort(key=lambda row: (row.get('objectTypeSoortId') or '', row.get('tijdstip') or ''))
+    key = ARCHIVE_PREFIX + 'date=' + date + '/part-' + str(uuid.uuid4()) + '.parquet'
+    size = write_parquet(key, rows, ROW_COLUMNS, bucket)
+
+    tijdstippen = [row.get('tijdstip') for row in rows if row.get('tijdstip') is not None]
+    objectTypeSoortIds = [row.get('objectTypeSoortId') for row in rows if row.get('objectTypeSoortId') is not None]
+    return {
+        'key': key,
+        'date': date,
+        'rows': len(rows),
+        'bytes': size,
+        'minTijdstip': min(tijdstippen, default=None),
+        'maxTijdstip': max(tijdstippen, default=None),
+        'minObjectTypeSoortId': min(objectTypeSoortIds, default=None),
+        'maxObjectTypeSoortId': max(objectTypeSoortIds, default=None),
+        'created': datetime.now(timezone.utc).isoformat(),
+    }
+
+# Write the raw events (one per backup, sorted by key) as a Parquet file, returns its manifest entry
+def write_events(events, bucket):
+    events.sort(key=lambda event: event.get('key') or '')
+    key = EVENTS_PREFIX + 'part-' + str(uuid.uuid4()) + '.parquet'
+    size = write_parquet(key, events, EVENT_COLUMNS, bucket)
+    keys = [event.get('key') for event in events if event.get('key') is not None]
+    return {
+        'key': key,
+        'sources': len(set(event.get('source') for event in events)),
+        'backups': len(events),
+        'bytes': size,
+        'minKey': min(keys, default=None),
+        'maxKey': max(keys, default=None),
+        'created': datetime.now(timezone.utc).isoformat(),
+    }
+
+# Write the rows (grouped by date) and the events of the sources as Parquet files and record them in the manifest.
+# The manifest is saved before the source objects are deleted, so a failure never loses backups.
+def flush(rows, events, sources, manifest, bucket, deleteSource=False):
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(row.get('date'), []).append(row)
+
+    parts = [write_part(date, partitionRows, bucket) for date, partitionRows in sorted(partitions.items())]
+    manifest['parts'].extend(parts)
+    manifest['events'].append(write_events(events, bucket))
+    save_manifest(manifest, bucket)
+
+    if deleteSource:
+        for start in range(0, len(sources), 1000):
+            bucket.delete_objects(Delete={'Objects': [{'Key': key} for key in sources[start:start + 1000]], 'Quiet': True})
+
+    return parts
+
+# Identifies a backup: the same key and event. A PUT has a backup for each verwerktObject under the same key.
+def event_digest(data):
+    return hashlib.sha256(data.encode('UTF-8')).hexdigest()[:32]
+
+# The source objects and backups ((key, digest) tuples) that are already archived (recorded in the event files of the manifest)
+def archived_backups(bucket, manifest):
+    sources = set()
+    backups = set()
+    for part in manifest.get('events'):
+        source = S3RangeFile(bucket.Object(part.get('key')), part.get('bytes'))
+        table = pq.read_table(source, columns=['source', 'key', 'digest'])
+        sources.update(table.column('source').to_pylist())
+        backups.update(zip(table.column('key').to_pylist(), table.column('digest').to_pylist()))
+    return sources, backups
+
+# Archive the backups under prefix, sources that are already archived are skipped
+# (a previous run without deleteSource), as are backups archived before. Returns (sources, rows) archived.
+def write_archive(bucket, prefix='', deleteSource=False):
+    require_pyarrow()
+    manifest = load_manifest(bucket)
+    archived, archivedBackups = archived_backups(bucket, manifest)
+
+    rows = []
+    events = []
+    sources = []
+    totalSources = 0
+    totalRows = 0
+    for summary in list_sources(bucket, prefix):
+        if summary.key in archived:
+            continue
+        fallbackDate = summary.last_modified.strftime('%Y-%m-%d')
+        for key, event in read_source(bucket, summary):
+            data = json.dumps(event)
+            digest = event_digest(data)
+            if (key, digest) in archivedBackups:
+                continue
+            archivedBackups.add((key, digest))
+            rows.extend(backup_rows(key, event, fallbackDate))
+            events.append({'source': summary.key, 'key': key, 'digest': digest, 'event': data})
+        sources.append(summary.key)
+
+        if len(sources) >= SOURCE_CHUNK_SIZE:
+            flush(rows, events, sources, manifest, bucket, deleteSource)
+            totalSources += len(sources)
+            totalRows += len(rows)
+            print('Archived ' + str(totalSources) + ' backups (' + str(totalRows) + ' rows)')
+            rows = []
+            events = []
+            sources = []
+
+    if len(sources) > 0:
+        flush(rows, events, sources, manifest, bucket, deleteSource)
+        totalSources += len(sources)
+        totalRows += len(rows)
+
+    print('Done: ' + str(totalSources) + ' backups archived (' + str(totalRows) + ' rows)')
+    return totalSources, totalRows
+
+# Seekable read only file for an S3 object, reads using ranged GETs so only the footer and the
+# selected row groups of a Parquet file are downloaded
+class S3RangeFile(io.RawIOBase):
+
+    def __init__(self, s3Object, size):
+        super().__init__()
+        self.s3Object = s3Object
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if self.position >= end:
+            return b''
+        data = self.s3Object.get(Range='bytes=' + str(self.position) + '-' + str(end - 1)).get('Body').read()
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+# Whether a part (manifest entry) may contain rows within the given range
+def part_matches(part, beginDatum=None, eindDatum=None, objectTypeSoortId=None):
+    if beginDatum is not None and part.get('maxTijdstip') is not None and part.get('maxTijdstip') < beginDatum:
+        return False
+    if eindDatum is not None and part.get('minTijdstip') is not None and part.get('minTijdstip') > eindDatum:
+        return False
+    if objectTypeSoortId is not None:
+        if part.get('minObjectTypeSoortId') is None:
+            return False
+        if not part.get('minObjectTypeSoortId') <= objectTypeSoortId <= part.get('maxObjectTypeSoortId'):
+            return False
+    return True
+
+def row_filter(beginDatum=None, eindDatum=None, objectTypeSoortId=None):
+    filters = []
+    if beginDatum is not None:
+        filters.append(('tijdstip', '>=', beginDatum))
+    if eindDatum is not None:
+        filters.append(('tijdstip', '<=', eindDatum))
+    if objectTypeSoortId is not None:
+        filters.append(('objectTypeSoortId', '=', objectTypeSoortId))
+    return filters or None
+
+# The raw events of the given backup keys, read from the event files whose key range contains them
+def read_events(bucket, manifest, keys):
+    events = {}
+    if len(keys) == 0:
+        return events
+    minKey = min(keys)
+    maxKey = max(keys)
+    for part in manifest.get('events'):
+        if part.get('minKey') is None or part.get('maxKey') < minKey or part.get('minKey') > maxKey:
+            continue
+        source = S3RangeFile(bucket.Object(part.get('key')), part.get('bytes'))
+        table = pq.read_table(source, columns=['key', 'event'], filters=[('key', 'in', sorted(keys))])
+        events.update(zip(table.column('key').to_pylist(), table.column('event').to_pylist()))
+    return events
+
+# Scan the archive for rows within a tijdstip range (inclusive, as the API) and/or of a single objectTypeSoortId.
+# Returns a pyarrow Table with the requested columns (default all), the event column is joined from the event files.
+def read_archive(bucket, beginDatum=None, eindDatum=None, objectTypeSoortId=None, columns=None):
+    require_pyarrow()
+    manifest = load_manifest(bucket)
+    columns = columns or COLUMNS
+    rowColumns = [name for name in ROW_COLUMNS if name in columns or (name == 'key' and 'event' in columns)]
+
+    tables = []
+    for part in manifest.get('parts'):
+        if not part_matches(part, beginDatum, eindDatum, objectTypeSoortId):
+            continue
+        source = S3RangeFile(bucket.Object(part.get('key')), part.get('bytes'))
+        tables.append(pq.read_table(source, columns=rowColumns, filters=row_filter(beginDatum, eindDatum, objectTypeSoortId)))
+
+    if len(tables) == 0:
+        return schema().empty_table().select(columns)
+    table = pa.concat_tables(tables)
+    if 'event' in columns:
+        keys = table.column('key').to_pylist()
+        events = read_events(bucket, manifest, set(key for key in keys if key is not None))
+        table = table.append_column('event', pa.array([events.get(key) for key in keys], type=pa.string()))
+    return table.select(columns)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write or read the Parquet archive of the verwerkingen backup bucket')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    writeParser = subparsers.add_parser('write', help='Archive the backups in the bucket')
+    writeParser.add_argument('--bucket', required=True, help='S3 backup bucket name')
+    writeParser.add_argument('--prefix', default='', help='Only archive the backups under this prefix')
+    writeParser.add_argument('--delete-source', action='store_true', help='Delete the backups once they are archived')
+
+    readParser = subparsers.add_parser('read', help='Print the archived backups as JSON lines')
+    readParser.add_argument('--bucket', required=True, help='S3 backup bucket name')
+    readParser.add_argument('--begin', help='Begin of the tijdstip range (inclusive)')
+    readParser.add_argument('--end', help='End of the tijdstip range (inclusive)')
+    readParser.add_argument('--object-type-soort-id', help='objectTypeSoortId (objectType + soortObjectId + hashed objectId)')
+    args = parser.parse_args()
+
+    backupBucket = boto3.resource('s3').Bucket(args.bucket)
+    if args.command == 'write':
+        write_archive(backupBucket, args.prefix, args.delete_source)
+    else:
+        for archivedRow in read_archive(backupBucket, args.begin, args.end, args.object_type_soort_id).to_pylist():
+            print(json.dumps(archivedRow))
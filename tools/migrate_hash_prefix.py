@@ -0,0 +1,146 @@
+"""
+File: migrate_hash_prefix.py
+Description: Rewrite the existing items of the verwerkingen table to the prefixed hash format (v1:<hex>).
+
+Before the prefix was introduced, objectId_check guessed whether an objectId was already hashed by its
+length, leaving unprefixed hashes and unhashed objectIds in the table. This script rewrites the objectIds
+of the verwerkteObjecten to their canonical hash (Shared.hashing.canonicalHash) and moves each item to its
+new key (objectTypeSoortId and compositeSortKey contain the objectId), so every subject maps to exactly one
+objectTypeSoortId partition. The new item is written before the old one is deleted, so the script can be
+run again after an interruption.
+
+Partitions that are merged (e.g. a legacy partition and the canonical partition of new verwerkingsacties)
+can hold several verwerktObjectIds for the same subject. After the scan, the subject gets the verwerktObjectId
+of its oldest item (tijdstipRegistratie) and the items with another one are rewritten to it, in all items of
+their verwerkingsactie. The merged partitions are listed in the merge file until this is done, so a run that is
+interrupted merges them when it is run again.
+
+Until the migration is done, the Gen, Rec and Inzage lambdas look up the legacy key of a subject as well
+(new verwerkingsacties keep the verwerktObjectId of unmigrated subjects, reads return their unmigrated items).
+Set LEGACY_HASH_LOOKUP=false on the lambdas once the migration is done.
+
+Usage: python tools/migrate_hash_prefix.py --table verwerkingen-table-v4 [--segments 8] [--dry-run]
+"""
+import argparse
+import os
+import sys
+import threading
+
+from boto3.dynamodb.conditions import Key
+
+# Use the shared code from the lambda layer
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../src/api/LambdaLayer/python'))
+
+from Shared.hashing import canonicalHash
+from Shared.indexes import OBJECT_TYPE_SOORT_ID_INDEX, indexAttributes, itemVerwerktObjectId
+from Shared.pagination import queryItems
+from table_scan import parallel_scan, segment_table
+
+
+def object_type_soort_id(verwerktObject):
+    return verwerktObject.get('objectType') + verwerktObject.get('soortObjectId') + verwerktObject.get('objectId')
+
+# The item with canonical hashes and its new key, None if the item is already migrated
+def migrated_item(item):
+    objectTypeSoortId = item.get('objectTypeSoortId')
+    newObjectTypeSoortId = objectTypeSoortId
+    verwerkteObjecten = []
+    for verwerktObject in item.get('verwerkteObjecten') or []:
+        migrated = dict(verwerktObject, objectId=canonicalHash(verwerktObject.get('objectId')))
+        if object_type_soort_id(verwerktObject) == objectTypeSoortId:
+            newObjectTypeSoortId = object_type_soort_id(migrated)
+        verwerkteObjecten.append(migrated)
+
+    if verwerkteObjecten == (item.get('verwerkteObjecten') or []):
+        return None
+
+    migrated = dict(item, verwerkteObjecten=verwerkteObjecten, objectTypeSoortId=newObjectTypeSoortId)
+    compositeSortKey = item.get('compositeSortKey')
+    if compositeSortKey.startswith(objectTypeSoortId + '#'):
+        migrated['compositeSortKey'] = newObjectTypeSoortId + compositeSortKey[len(objectTypeSoortId):]
+    migrated.update(indexAttributes(migrated))
+    return migrated
+
+# Rewrite a single item, if it is not yet migrated.
+# The objectTypeSoortId the item is moved to is passed to merged (a function), its partition is merged.
+def migrate_item(item, table, dryRun=False, merged=None):
+    migrated = migrated_item(item)
+    if migrated is None:
+        return False
+    if merged is not None and migrated.get('objectTypeSoortId') != item.get('objectTypeSoortId'):
+        merged(migrated.get('objectTypeSoortId'))
+
+    if not dryRun:
+        table.put_item(Item=migrated)
+        if migrated.get('compositeSortKey') != item.get('compositeSortKey'):
+            table.delete_item(Key={
+                'actieId': item.get('actieId'),
+                'compositeSortKey': item.get('compositeSortKey'),
+            })
+    return True
+
+# Give all items of a subject (objectTypeSoortId) the verwerktObjectId of its oldest item.
+# The verwerktObject of the subject is rewritten in every item of the verwerkingsacties with another verwerktObjectId.
+# Returns the number of items rewritten.
+def merge_verwerktObjectIds(objectTypeSoortId, table, dryRun=False):
+    items = [item for item in queryItems(table, IndexName=OBJECT_TYPE_SOORT_ID_INDEX, KeyConditionExpression=Key('objectTypeSoortId').eq(objectTypeSoortId))
+        if itemVerwerktObjectId(item) is not None]
+    if len(set(itemVerwerktObjectId(item) for item in items)) <= 1:
+        return 0
+
+    verwerktObjectId = itemVerwerktObjectId(min(items, key=lambda item: (item.get('tijdstipRegistratie') or '', item.get('actieId'))))
+    rewritten = 0
+    for actieId in sorted(set(item.get('actieId') for item in items if itemVerwerktObjectId(item) != verwerktObjectId)):
+        for item in queryItems(table, KeyConditionExpression=Key('actieId').eq(actieId)):
+            verwerkteObjecten = [dict(verwerktObject, verwerktObjectId=verwerktObjectId) if object_type_soort_id(verwerktObject) == objectTypeSoortId else verwerktObject
+                for verwerktObject in item.get('verwerkteObjecten') or []]
+            if verwerkteObjecten == (item.get('verwerkteObjecten') or []):
+                continue
+            if not dryRun:
+                rewrittenItem = dict(item, verwerkteObjecten=verwerkteObjecten)
+                rewrittenItem.update(indexAttributes(rewrittenItem))
+                table.put_item(Item=rewrittenItem)
+            rewritten += 1
+    return rewritten
+
+def load_merge_file(mergeFile):
+    if mergeFile is None or not os.path.exists(mergeFile):
+        return set()
+    with open(mergeFile) as file:
+        return set(line.strip() for line in file if line.strip() != '')
+
+# Migrate the whole table using a parallel scan, then merge the verwerktObjectIds of the merged partitions.
+# The merged partitions are appended to mergeFile (if given) until they are merged.
+def migrate(tableName, totalSegments=8, dryRun=False, mergeFile=None):
+    mergeKeys = load_merge_file(mergeFile)
+    lock = threading.Lock()
+
+    def merged(objectTypeSoortId):
+        with lock:
+            if objectTypeSoortId in mergeKeys:
+                return
+            mergeKeys.add(objectTypeSoortId)
+            if mergeFile is not None and not dryRun:
+                with open(mergeFile, 'a') as file:
+                    file.write(objectTypeSoortId + '\n')
+
+    scanned, migrated = parallel_scan(tableName, totalSegments, lambda item, table: migrate_item(item, table, dryRun, merged), 'migrated')
+    print('Done: ' + str(scanned) + ' scanned, ' + str(migrated) + (' to migrate (dry run)' if dryRun else ' migrated'))
+
+    table = segment_table(tableName)
+    rewritten = sum(merge_verwerktObjectIds(objectTypeSoortId, table, dryRun) for objectTypeSoortId in sorted(mergeKeys))
+    print('Merged ' + str(len(mergeKeys)) + ' partitions, ' + str(rewritten) + (' items to rewrite (dry run)' if dryRun else ' items rewritten'))
+    if mergeFile is not None and not dryRun and os.path.exists(mergeFile):
+        os.remove(mergeFile)
+    return scanned, migrated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rewrite verwerkingen items to the prefixed hash format')
+    parser.add_argument('--table', default='verwerkingen-table-v4', help='DynamoDB table name')
+    parser.add_argument('--segments', type=int, default=8, help='Number of parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the items that need to be migrated')
+    parser.add_argument('--merge-file', default='migrate-hash-merge.txt', help='File listing the merged partitions of which the verwerktObjectIds are not merged yet')
+    args = parser.parse_args()
+
+    migrate(args.table, args.segments, args.dry_run, args.merge_file)
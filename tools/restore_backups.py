@@ -0,0 +1,331 @@
+"""
+File: restore_backups.py
+Description: Restore the verwerkingen table from the S3 backups of the verwerkingen API.
+
+The backups (see backup_archive.py for the formats) are listed in pages, read and converted concurrently
+and written with parallel BatchWriteItem calls. Items are derived with the same code as the API
+(generate_post_messages of the Gen lambda, write_verwerkings_acties of the processing lambda), and
+backups contain the actieIds and tijdstipRegistratie of the original request, so a restore
+recreates the same keys and can be repeated without creating duplicates.
+
+After every page a checkpoint (the last source key, or archive part) is written to the checkpoint file,
+a restore that is stopped continues from the checkpoint when started with the same checkpoint file.
+Sources of which items could not be written are listed in the failures file, restore them again using --sources-file.
+
+PATCH and DELETE requests are not backed up. PATCHes have to be applied again after the restore. DELETEs
+(soft deletes, vervallen) are lost as well: restored verwerkingsacties are never vervallen, and restoring into
+an existing table makes deleted verwerkingsacties active again. Replay them with --deletes-file, a file with
+an actieId per line (e.g. of the old table: aws dynamodb scan --table-name <table> --filter-expression
+"vervallen = :true" --expression-attribute-values '{":true": {"BOOL": true}}' --projection-expression actieId),
+they are marked vervallen as by DELETE /verwerkingsacties/{actieId} once the backups are restored.
+
+Usage:
+  python tools/restore_backups.py --bucket <backup-bucket> --table verwerkingen-table-v4 [--prefix backups/] [--max-items-per-second 2000]
+  python tools/restore_backups.py --bucket <backup-bucket> --table verwerkingen-table-v4 --from-archive [--deletes-file deletes.txt]
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import boto3
+
+TOOLS_DIR = os.path.dirname(os.path.realpath(__file__))
+API_DIR = os.path.join(TOOLS_DIR, '../src/api')
+
+# Use the shared code from the lambda layer
+sys.path.append(os.path.join(API_DIR, 'LambdaLayer/python'))
+
+from backup_archive import list_sources, load_manifest, read_source
+
+
+# Load the handler module of a lambda (all are called handler.py)
+def load_handler(name):
+    spec = importlib.util.spec_from_file_location(name + '_handler', os.path.join(API_DIR, name, 'handler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+gen = load_handler('GenLambdaFunction')
+proc = load_handler('ProcLambdaFunction')
+rec = load_handler('RecLambdaFunction')
+
+
+# boto3 resources are not thread safe: each reader and writer thread uses
+# the Bucket and Table of its own session
+class ThreadResources:
+
+    def __init__(self, bucketName, tableName):
+        self.bucketName = bucketName
+        self.tableName = tableName
+        self.local = threading.local()
+
+    def session(self):
+        if getattr(self.local, 'session', None) is None:
+            self.local.session = boto3.session.Session()
+        return self.local.session
+
+    def bucket(self):
+        if getattr(self.local, 'bucket', None) is None:
+            self.local.bucket = self.session().resource('s3').Bucket(self.bucketName)
+        return self.local.bucket
+
+    def table(self):
+        if getattr(self.local, 'table', None) is None:
+            self.local.table = self.session().resource('dynamodb').Table(self.tableName)
+        return self.local.table
+
+
+# Token bucket limiting the number of items written per second (over all writer threads)
+class RateLimiter:
+
+    def __init__(self, ratePerSecond=None):
+        self.ratePerSecond = ratePerSecond
+        self.tokens = ratePerSecond or 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # A count above the rate (a chunk of 25 items at less than 25 items per second) waits until the bucket holds count tokens
+    def acquire(self, count):
+        if self.ratePerSecond is None:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(max(self.ratePerSecond, count), self.tokens + (now - self.updated) * self.ratePerSecond)
+                self.updated = now
+                if self.tokens >= count:
+                    self.tokens -= count
+                    return
+                wait = (count - self.tokens) / self.ratePerSecond
+            time.sleep(wait)
+
+# objectTypeSoortId -> verwerktObjectId for the whole restore, so an object gets the same
+# verwerktObjectId in all its verwerkingsacties. With lookupExisting, ids already in the table are reused
+# (needed when restoring into a table that is not empty, or when continuing from a checkpoint).
+# Otherwise the id stored in the backup (backupIds) is reused. Only objects of older backups, without
+# verwerktObjectIds, that are not in the table get a new id.
+class VerwerktObjectIdResolver:
+
+    def __init__(self, resources, lookupExisting=False):
+        self.resources = resources
+        self.lookupExisting = lookupExisting
+        self.ids = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, objectTypeSoortIds, backupIds=None):
+        missing = [key for key in dict.fromkeys(objectTypeSoortIds) if key not in self.ids]
+        found = gen.lookup_verwerktObjectIds(missing, self.resources.table()) if self.lookupExisting and len(missing) > 0 else {}
+
+        with self.lock:
+            for key in missing:
+                self.ids.setdefault(key, found.get(key) or (backupIds or {}).get(key) or str(uuid.uuid4()))
+            return {key: self.ids[key] for key in objectTypeSoortIds}
+
+# tijdstipRegistratie of the original request: stored in the backup, or else the time of the request
+# (API Gateway) or of the backup object (all in UTC, as the lambda clock)
+def registration_time(event, lastModified):
+    if event.get('tijdstipRegistratie') is not None:
+        return event.get('tijdstipRegistratie')
+    epoch = (event.get('requestContext') or {}).get('requestTimeEpoch')
+    moment = datetime.fromtimestamp(epoch / 1000, timezone.utc) if epoch is not None else lastModified.astimezone(timezone.utc)
+    return moment.replace(tzinfo=None).isoformat(timespec='seconds')
+
+# Derive the table items of a single backup (POST, POST batch or PUT message)
+def restore_items(key, event, lastModified, resolver):
+    if isinstance(event, list):
+        # PUT backups are the messages of the verwerkingsactie
+        return event
+    if 'httpMethod' not in event:
+        # PUT backups of a single verwerktObject (before PUT messages were sent as a list)
+        return [event]
+
+    tijdstipRegistratie = registration_time(event, lastModified)
+    body = json.loads(event.get('body'))
+    if key.startswith('batch/'):
+        actieIds = event.get('actieIds') or [str(uuid.uuid1()) for _ in body] # older batch backups have no actieIds
+        requests = [(actieId, item) for actieId, item in zip(actieIds, body) if actieId is not None]
+    else:
+        requests = [(key, body)]
+
+    items = []
+    for actieId, requestJson in requests:
+        try:
+            requestJson = gen.objectId_check(gen.validate_batch_item(requestJson))
+        except Exception:
+            continue # rejected by the API as well
+        resolvedIds = resolver.resolve([gen.object_type_soort_id(object) for object in requestJson.get('verwerkteObjecten')], event.get('verwerktObjectIds'))
+        items.extend(gen.generate_post_messages(requestJson, actieId, tijdstipRegistratie, None, resolvedIds))
+    return items
+
+# Read and convert a single source object, returns (sourceKey, [(sourceKey, item)]) or (sourceKey, None) if it failed
+def read_items(resources, summary, resolver):
+    try:
+        # Objects of a sources file are not loaded yet, load them using the Bucket of this thread
+        lastModified = summary.last_modified if summary.meta.data is not None else resources.bucket().Object(summary.key).last_modified
+        return summary.key, [(summary.key, item) for key, event in read_source(resources.bucket(), summary) for item in restore_items(key, event, lastModified, resolver)]
+    except Exception as e:
+        logging.error('Failed to read backup ' + summary.key + ': ' + str(e))
+        return summary.key, None
+
+# Convert a single backup of the archive, returns (key, [(key, item)]) or (key, None) if it failed
+def archive_items(backup, resolver):
+    key, event, created = backup
+    try:
+        return key, [(key, item) for item in restore_items(key, event, created, resolver)]
+    except Exception as e:
+        logging.error('Failed to restore backup ' + key + ': ' + str(e))
+        return key, None
+
+# Write the items with parallel BatchWriteItem calls (25 items each).
+# Returns the source keys of the items that could not be written.
+def write_items(writes, resources, executor, limiter):
+    chunks = [writes[start:start + proc.batchWriteMaxItems] for start in range(0, len(writes), proc.batchWriteMaxItems)]
+
+    def write_chunk(chunk):
+        limiter.acquire(len(chunk))
+        return proc.write_verwerkings_acties(chunk, resources.table())
+
+    return set(sourceKey for failed in executor.map(write_chunk, chunks) for sourceKey in failed)
+
+# Source objects in pages, starting after the checkpoint (S3 lists keys in order)
+def source_pages(bucket, prefix='', startAfter=None, pageSize=1000, sourcesFile=None):
+    if sourcesFile is not None:
+        with open(sourcesFile) as file:
+            keys = [line.strip() for line in file if line.strip() != '']
+        summaries = (bucket.Object(key) for key in keys if startAfter is None or key > startAfter)
+    else:
+        summaries = list_sources(bucket, prefix, startAfter)
+
+    page = []
+    for summary in summaries:
+        page.append(summary)
+        if len(page) >= pageSize:
+            yield page[-1].key, page
+            page = []
+    if len(page) > 0:
+        yield page[-1].key, page
+
+# Event files of the archive (see backup_archive.py) as pages, each contains a row for every backup
+def archive_pages(bucket, startAfter=None):
+    import pyarrow.parquet as pq # optional, only needed to restore from the archive
+    from backup_archive import S3RangeFile
+
+    parts = load_manifest(bucket).get('events')
+    keys = [part.get('key') for part in parts]
+    start = keys.index(startAfter) + 1 if startAfter in keys else 0
+    for part in parts[start:]:
+        table = pq.read_table(S3RangeFile(bucket.Object(part.get('key')), part.get('bytes')), columns=['key', 'event'])
+        backups = zip(table.column('key').to_pylist(), table.column('event').to_pylist())
+        created = datetime.fromisoformat(part.get('created'))
+        yield part.get('key'), [(key, json.loads(event), created) for key, event in backups]
+
+def load_checkpoint(checkpointFile):
+    if checkpointFile is None or not os.path.exists(checkpointFile):
+        return None
+    with open(checkpointFile) as file:
+        return json.load(file)
+
+def save_checkpoint(checkpointFile, checkpoint):
+    if checkpointFile is None:
+        return
+    with open(checkpointFile + '.tmp', 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(checkpointFile + '.tmp', checkpointFile)
+
+# Mark the verwerkingsacties in the deletes file (an actieId per line) vervallen, as DELETE /verwerkingsacties/{actieId}.
+# Returns the number of actieIds replayed.
+def replay_deletes(deletesFile, resources, workers=16):
+    with open(deletesFile) as file:
+        actieIds = list(dict.fromkeys(line.strip() for line in file if line.strip() != ''))
+
+    def delete(actieId):
+        rec.delete_verwerkingsacties_actieid({'pathParameters': {'actieId': actieId}}, resources.table())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(delete, actieIds))
+    print('Replayed ' + str(len(actieIds)) + ' deletes')
+    return len(actieIds)
+
+# Restore the backups into the table. Returns the progress metrics (sources, items, failed).
+def restore(bucket, table, prefix='', fromArchive=False, sourcesFile=None, readers=16, writers=16, maxItemsPerSecond=None,
+        pageSize=1000, checkpointFile=None, failuresFile=None, lookupExisting=False, deletesFile=None):
+    resources = ThreadResources(bucket.name, table.name)
+    checkpoint = load_checkpoint(checkpointFile)
+    startAfter = checkpoint.get('lastKey') if checkpoint is not None else None
+    metrics = checkpoint.get('metrics') if checkpoint is not None else {'sources': 0, 'items': 0, 'failed': 0}
+
+    # When continuing, objects restored before the checkpoint already have a verwerktObjectId in the table
+    resolver = VerwerktObjectIdResolver(resources, lookupExisting or startAfter is not None)
+    limiter = RateLimiter(maxItemsPerSecond)
+    started = time.monotonic()
+    restoredItems = 0
+
+    if fromArchive:
+        pages = archive_pages(bucket, startAfter)
+    else:
+        pages = source_pages(bucket, prefix, startAfter, pageSize, sourcesFile)
+
+    with ThreadPoolExecutor(max_workers=readers) as readExecutor, ThreadPoolExecutor(max_workers=writers) as writeExecutor:
+        for lastKey, page in pages:
+            if fromArchive:
+                results = list(readExecutor.map(lambda backup: archive_items(backup, resolver), page))
+            else:
+                results = list(readExecutor.map(lambda summary: read_items(resources, summary, resolver), page))
+            writes = [write for _, result in results if result is not None for write in result]
+
+            failed = write_items(writes, resources, writeExecutor, limiter) | set(sourceKey for sourceKey, result in results if result is None)
+            if len(failed) > 0 and failuresFile is not None:
+                with open(failuresFile, 'a') as file:
+                    file.writelines(sourceKey + '\n' for sourceKey in sorted(failed))
+
+            restoredItems += len(writes)
+            metrics = {
+                'sources': metrics.get('sources') + len(page),
+                'items': metrics.get('items') + len(writes),
+                'failed': metrics.get('failed') + len(failed),
+            }
+            save_checkpoint(checkpointFile, {'lastKey': lastKey, 'metrics': metrics})
+
+            elapsed = time.monotonic() - started
+            print('PROGRESS: ' + json.dumps({**metrics, 'lastKey': lastKey, 'itemsPerSecond': round(restoredItems / elapsed, 1) if elapsed > 0 else None}))
+
+    if deletesFile is not None:
+        replay_deletes(deletesFile, resources, writers)
+
+    print('Done: ' + json.dumps(metrics))
+    return metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Restore the verwerkingen table from the S3 backups')
+    parser.add_argument('--bucket', required=True, help='S3 backup bucket name')
+    parser.add_argument('--table', default='verwerkingen-table-v4', help='DynamoDB table name')
+    parser.add_argument('--prefix', default='', help='Only restore the backups under this prefix')
+    parser.add_argument('--from-archive', action='store_true', help='Restore from the Parquet archive (backup_archive.py) instead of the backups')
+    parser.add_argument('--sources-file', help='Only restore the backups listed in this file (e.g. a failures file)')
+    parser.add_argument('--readers', type=int, default=16, help='Number of concurrent backup reads')
+    parser.add_argument('--writers', type=int, default=16, help='Number of concurrent BatchWriteItem calls')
+    parser.add_argument('--max-items-per-second', type=int, help='Throughput cap (items written per second)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Backups per page (checkpoint interval)')
+    parser.add_argument('--checkpoint-file', default='restore-checkpoint.json', help='Checkpoint file, the restore continues from it if it exists')
+    parser.add_argument('--failures-file', default='restore-failures.txt', help='File listing the backups that could not be restored')
+    parser.add_argument('--lookup-existing', action='store_true', help='Reuse the verwerktObjectIds already in the table '
+        '(otherwise those stored in the backups, objects of older backups without them get a new verwerktObjectId)')
+    parser.add_argument('--deletes-file', help='Mark the actieIds listed in this file vervallen after the restore (DELETE requests are not backed up)')
+    parser.add_argument('--api-base-url', help='Base url of the API (used in the url of the items)')
+    args = parser.parse_args()
+
+    if args.api_base_url is not None:
+        gen.apiBaseUrl = args.api_base_url
+
+    restore(boto3.resource('s3').Bucket(args.bucket), boto3.resource('dynamodb').Table(args.table), args.prefix, args.from_archive,
+        args.sources_file, args.readers, args.writers, args.max_items_per_second, args.page_size, args.checkpoint_file,
+        args.failures_file, args.lookup_existing, args.deletes_file)
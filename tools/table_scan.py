@@ -0,0 +1,40 @@
+"""
+File: table_scan.py
+Description: Parallel scan of the verwerkingen table, shared by the tools that rewrite existing items
+(backfill_index_attributes.py, migrate_hash_prefix.py).
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+
+# boto3 resources are not thread safe, each segment uses a Table of its own session
+def segment_table(tableName):
+    return boto3.session.Session().resource('dynamodb').Table(tableName)
+
+# Scan one segment of the table and call processItem(item, table) for each item.
+# Returns (scanned, processed): processed counts the items for which processItem returned True.
+def scan_segment(table, segment, totalSegments, processItem, action='processed'):
+    scanned = 0
+    processed = 0
+    scanArgs = {'Segment': segment, 'TotalSegments': totalSegments}
+    while True:
+        response = table.scan(**scanArgs)
+        for item in response.get('Items'):
+            scanned += 1
+            if processItem(item, table):
+                processed += 1
+
+        if response.get('LastEvaluatedKey') is None:
+            break
+        scanArgs['ExclusiveStartKey'] = response.get('LastEvaluatedKey')
+        print('Segment ' + str(segment) + ': ' + str(scanned) + ' scanned, ' + str(processed) + ' ' + action)
+
+    return scanned, processed
+
+# Process the whole table using a parallel scan. Returns (scanned, processed).
+def parallel_scan(tableName, totalSegments, processItem, action='processed'):
+    with ThreadPoolExecutor(max_workers=totalSegments) as executor:
+        results = list(executor.map(lambda segment: scan_segment(segment_table(tableName), segment, totalSegments, processItem, action), range(totalSegments)))
+
+    return sum(result[0] for result in results), sum(result[1] for result in results)